@@ -0,0 +1,151 @@
+"""
+根据 latent 收敛情况提前结束去噪 (自适应步数)
+
+客户端通常固定发送 20 / 30 步，但很多 prompt 在后面的步骤里 latent 几乎不再变化。
+ConvergenceMonitor 作为 callback_on_step_end 在每步之后计算相邻两步 latent 的相对
+变化 ||x_{i+1} - x_i|| / ||x_{i+1}|| (批内取最大值，所有样本都收敛才结束)，在至少
+min_steps 步之后连续 patience 步低于阈值时结束剩余步骤:
+
+- extrapolate: Euler 采样器上相邻两步的差就是最后一次 UNet 预测的 ODE 导数，沿该
+  导数直接外推到 sigma=0 (即最后一步预测的 x0)，相当于跳过剩余的时间步；其它采样器
+  退回 stop
+- stop:        直接设置 pipeline 的 _interrupt 标志，解码当前 latent
+
+结束的方式与 StepStreamer.cancel() 相同：diffusers 跳过剩余步骤，然后照常进行 VAE 解码。
+"""
+
+import logging
+import math
+import threading
+
+logger = logging.getLogger(__name__)
+
+ADAPTIVE_MODES = ("extrapolate", "stop")
+
+# 沿最后一步的导数外推到 sigma=0 只对确定性的 Euler 采样器成立
+EXTRAPOLATE_SCHEDULERS = ("EulerDiscreteScheduler",)
+
+
+def validate_threshold(value):
+    """检查 adaptive_threshold，返回 float；无效时抛出 ValueError"""
+    try:
+        threshold = float(value)
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid adaptive_threshold: {value}")
+    if not math.isfinite(threshold) or threshold < 0:
+        raise ValueError(f"adaptive_threshold must be a non-negative number, got {value}")
+    return threshold
+
+
+def latent_delta(previous, current):
+    """相邻两步 latent 的相对变化，批内每个样本分别计算后取最大值"""
+    previous = previous.detach().float().flatten(1)
+    current = current.detach().float().flatten(1)
+    change = (current - previous).norm(dim=1) / current.norm(dim=1).clamp_min(1e-8)
+    return change.max().item()
+
+
+class ConvergenceMonitor:
+    """包装 callback_on_step_end，latent 收敛后结束一次 pipeline 调用的剩余步骤
+
+    inner 是原有的步骤回调 (例如流式进度)，先于收敛检查调用。每次 pipeline 调用使用
+    一个新实例；调用结束后 steps_run / exited_at / deltas 记录本次的实际情况。
+    """
+
+    def __init__(self, total_steps, threshold, min_steps=10, patience=2, mode="extrapolate", inner=None):
+        if mode not in ADAPTIVE_MODES:
+            raise ValueError(f"Unknown adaptive mode: {mode} (expected one of {ADAPTIVE_MODES})")
+        self.total_steps = int(total_steps)
+        self.threshold = float(threshold)
+        self.min_steps = max(1, int(min_steps))
+        self.patience = max(1, int(patience))
+        self.mode = mode
+        self.inner = inner
+
+        self.steps_run = 0
+        self.exited_at = None
+        self.extrapolated = False
+        self.deltas = []
+        self._previous = None
+        self._below = 0
+
+    def callback(self, pipe, step, timestep, callback_kwargs):
+        if self.inner is not None:
+            callback_kwargs = self.inner(pipe, step, timestep, callback_kwargs)
+        self.steps_run = step + 1
+
+        latents = callback_kwargs.get("latents")
+        if latents is None or getattr(pipe, "_interrupt", False):
+            return callback_kwargs
+
+        previous, self._previous = self._previous, latents.detach().clone()
+        if previous is None or previous.shape != latents.shape:
+            return callback_kwargs
+
+        delta = latent_delta(previous, latents)
+        self.deltas.append(delta)
+        self._below = self._below + 1 if delta < self.threshold else 0
+
+        remaining = self.total_steps - self.steps_run
+        if remaining <= 0 or self.steps_run < self.min_steps or self._below < self.patience:
+            return callback_kwargs
+
+        self.exited_at = self.steps_run
+        if self.mode == "extrapolate":
+            final = self._extrapolate(pipe.scheduler, step, previous, latents)
+            if final is not None:
+                callback_kwargs["latents"] = final
+                self.extrapolated = True
+        pipe._interrupt = True
+        logger.info(f"🏁 latent 已收敛 (delta {delta:.4f} < {self.threshold})，第 {self.steps_run}/{self.total_steps} 步结束")
+        return callback_kwargs
+
+    def _extrapolate(self, scheduler, step, previous, latents):
+        """Euler: x_{i+1} = x_i + d * (sigma_{i+1} - sigma_i)，沿 d 外推到 sigma=0"""
+        if type(scheduler).__name__ not in EXTRAPOLATE_SCHEDULERS:
+            return None
+        sigmas = getattr(scheduler, "sigmas", None)
+        # step() 之后 step_index 指向 latents 当前所在的 sigma
+        index = getattr(scheduler, "step_index", None)
+        index = step + 1 if index is None else index
+        if sigmas is None or not 1 <= index < len(sigmas):
+            return None
+        sigma, sigma_next = float(sigmas[index - 1]), float(sigmas[index])
+        if sigma == sigma_next:
+            return None
+        derivative = (latents.float() - previous.float()) / (sigma_next - sigma)
+        return (latents.float() - sigma_next * derivative).to(latents.dtype)
+
+
+class AdaptiveStepStats:
+    """汇总自适应步数节省的去噪步骤 (handler 的 stats action)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.early_exits = 0
+        self.extrapolated = 0
+        self.steps_planned = 0
+        self.steps_run = 0
+
+    def record(self, monitor):
+        with self._lock:
+            self.calls += 1
+            self.steps_planned += monitor.total_steps
+            self.steps_run += monitor.steps_run
+            if monitor.exited_at is not None:
+                self.early_exits += 1
+                self.extrapolated += int(monitor.extrapolated)
+
+    def stats(self):
+        with self._lock:
+            saved = self.steps_planned - self.steps_run
+            return {
+                "calls": self.calls,
+                "early_exits": self.early_exits,
+                "extrapolated": self.extrapolated,
+                "steps_planned": self.steps_planned,
+                "steps_run": self.steps_run,
+                "steps_saved": saved,
+                "saved_fraction": saved / self.steps_planned if self.steps_planned else 0.0,
+            }
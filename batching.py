@@ -0,0 +1,186 @@
+"""
+进程内请求微批处理 (micro-batching)
+
+把在短时间窗口内到达、且尺寸/步数/guidance 相同的请求合并成一次
+pipeline 调用，一次 UNet 去噪循环服务多个任务，然后把结果分发回各调用方。
+"""
+
+import threading
+import time
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingRequest:
+    """队列中等待合批的单个请求"""
+
+    __slots__ = ("key", "payload", "size", "enqueued_at", "done", "result", "error", "queue_wait")
+
+    def __init__(self, key, payload, size):
+        self.key = key
+        self.payload = payload
+        self.size = size
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.queue_wait = 0.0
+
+
+class MicroBatcher:
+    """收集兼容请求并以批次方式执行
+
+    run_batch(payloads) 接收同一 key 的 payload 列表，必须返回等长的结果列表。
+    submit() 是阻塞调用，可以从多个线程 (RunPod 并发 handler) 同时调用。
+    """
+
+    def __init__(self, run_batch, max_batch_size=4, window_ms=25.0, name="batcher"):
+        if max_batch_size < 1:
+            raise ValueError(f"max_batch_size must be >= 1, got {max_batch_size}")
+
+        self.run_batch = run_batch
+        self.max_batch_size = int(max_batch_size)
+        self.window = max(0.0, float(window_ms)) / 1000.0
+        self.name = name
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # 统计信息
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._samples = 0
+        self._queue_wait_total = 0.0
+        self._queue_wait_max = 0.0
+
+        self._worker = threading.Thread(target=self._run, name=f"{name}-worker", daemon=True)
+        self._worker.start()
+
+    def submit(self, key, payload, size=1):
+        """提交一个请求并等待其结果
+
+        key 相同的请求才会被合并；size 是该请求在批次中占用的样本数
+        (例如 num_images_per_prompt)。
+        """
+        request = _PendingRequest(key, payload, max(1, int(size)))
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"{self.name} is closed")
+            self._queue.append(request)
+            self._cond.notify_all()
+
+        request.done.wait()
+
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def close(self, timeout=5.0):
+        """停止后台线程；队列中剩余请求仍会被执行完"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join(timeout)
+
+    def stats(self):
+        """返回批次填充率和排队等待时间统计"""
+        with self._stats_lock:
+            batches = self._batches
+            return {
+                "batches": batches,
+                "requests": self._requests,
+                "samples": self._samples,
+                "max_batch_size": self.max_batch_size,
+                "window_ms": self.window * 1000.0,
+                "avg_batch_size": self._samples / batches if batches else 0.0,
+                "batch_fill_ratio": self._samples / (batches * self.max_batch_size) if batches else 0.0,
+                "avg_queue_wait_ms": self._queue_wait_total / self._requests * 1000.0 if self._requests else 0.0,
+                "max_queue_wait_ms": self._queue_wait_max * 1000.0,
+            }
+
+    def _collect(self):
+        """从队列中取出一个批次 (调用时持有 self._cond)
+
+        以队首请求的 key 为准，按到达顺序取出兼容请求，直到批次满为止；
+        不兼容的请求留在队列中等待下一轮。
+        """
+        head = self._queue[0]
+        batch = []
+        used = 0
+        remaining = deque()
+
+        while self._queue:
+            request = self._queue.popleft()
+            # 超大请求 (size > max_batch_size) 单独成批
+            fits = used + request.size <= self.max_batch_size or not batch
+            if request.key == head.key and fits and used < self.max_batch_size:
+                batch.append(request)
+                used += request.size
+            else:
+                remaining.append(request)
+
+        self._queue = remaining
+        return batch
+
+    def _ready_samples(self, key):
+        return sum(r.size for r in self._queue if r.key == key)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue and self._closed:
+                    return
+
+                # 等待合批窗口：直到批次已满、窗口到期或正在关闭
+                head = self._queue[0]
+                deadline = head.enqueued_at + self.window
+                while not self._closed and self._ready_samples(head.key) < self.max_batch_size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                batch = self._collect()
+
+            self._execute(batch)
+
+    def _execute(self, batch):
+        started = time.perf_counter()
+        samples = sum(r.size for r in batch)
+
+        for request in batch:
+            request.queue_wait = started - request.enqueued_at
+
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += len(batch)
+            self._samples += samples
+            for request in batch:
+                self._queue_wait_total += request.queue_wait
+                self._queue_wait_max = max(self._queue_wait_max, request.queue_wait)
+
+        if len(batch) > 1:
+            logger.info(f"📦 合并批次: {len(batch)} 个请求 / {samples} 个样本")
+
+        try:
+            results = self.run_batch([r.payload for r in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(
+                    f"run_batch returned {len(results)} results for {len(batch)} requests"
+                )
+            for request, result in zip(batch, results):
+                request.result = result
+        except Exception as e:
+            logger.error(f"❌ 批次执行失败: {e}")
+            for request in batch:
+                request.error = e
+        finally:
+            for request in batch:
+                request.done.set()
@@ -0,0 +1,1056 @@
+#!/usr/bin/env python3
+"""
+性能基准测试 (CPU, 微型合成 SDXL 模型)
+
+使用方法:
+python benchmark.py load [--repeat 3] [--json results.json]
+python benchmark.py warmup
+python benchmark.py encode
+python benchmark.py memory [--requests 20]
+python benchmark.py samplers
+python benchmark.py postprocess [--requests 16]
+python benchmark.py vae
+python benchmark.py cache [--repeat 3] [--model-path /runpod-volume/photonicfusion-sdxl]
+python benchmark.py compile [--repeat 3]
+python benchmark.py zygote [--repeat 3] [--requests 4]
+python benchmark.py generate [--repeat 3]
+python benchmark.py throughput [--requests 16]
+python benchmark.py adaptive [--requests 2] [--prompts prompts.txt] [--model-path /runpod-volume/photonicfusion-sdxl]
+python benchmark.py suite --json results.json
+python benchmark.py compare baseline.json results.json [--threshold 0.15]
+
+--json 写出的结果带有 meta (git commit、torch / diffusers 版本、CPU 数)，可以在不同
+commit 之间用 compare 对比：耗时 / 内存变大或吞吐变小超过阈值的项会被标为回归，
+此时退出码为 1。
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARKS = {}
+
+
+def benchmark(name, help_text):
+    """注册一个基准测试子命令"""
+    def _register(fn):
+        BENCHMARKS[name] = (fn, help_text)
+        return fn
+    return _register
+
+
+def _reset_peak_rss():
+    """把进程的峰值 RSS (VmHWM) 重置为当前 RSS (Linux 4.0+，不支持时忽略)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb():
+    """进程的峰值 RSS (MB)；没有 /proc 时退回 getrusage (不可重置)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2 ** 20 if sys.platform == "darwin" else 1024), 1)
+
+
+def _timeit(fn, repeat):
+    """运行 fn repeat 次，返回 (中位数秒数, 所有样本)"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), samples
+
+
+@benchmark("load", "冷启动加载耗时：逐个尝试加载策略 vs preflight 选择策略 vs mmap 逐组件加载 vs 单文件快照")
+def bench_load(args):
+    import handler
+    from snapshot import export_snapshot
+    from synthetic_sdxl import write_tiny_model_dir
+
+    results = []
+    layouts = {
+        "safetensors": {"safetensors": True, "fp16_variant": True},
+        "bin-only": {"safetensors": False, "fp16_variant": False},
+    }
+    folder = {"USE_SNAPSHOT": False}
+    modes = {
+        # 原始行为：不用清单，按顺序尝试所有 from_pretrained 策略
+        "trial_chain": {**folder, "USE_PREFLIGHT": False, "USE_LOAD_MANIFEST": False, "USE_MMAP_LOADER": False},
+        # 目录检查选择 from_pretrained 策略，仍执行修复流程
+        "preflight": {**folder, "USE_PREFLIGHT": True, "USE_LOAD_MANIFEST": False, "USE_MMAP_LOADER": False},
+        # 目录检查后用 mmap 逐个加载组件 (只有 .bin 时退回 from_pretrained)
+        "mmap_serial": {**folder, "USE_PREFLIGHT": True, "USE_LOAD_MANIFEST": False, "USE_MMAP_LOADER": True, "LOAD_WORKERS": 1},
+        # 同上，四个组件在线程池中并发加载
+        "mmap": {**folder, "USE_PREFLIGHT": True, "USE_LOAD_MANIFEST": False, "USE_MMAP_LOADER": True, "LOAD_WORKERS": 4},
+        # 导出单文件 fp16 快照后从快照加载
+        "snapshot": {"USE_SNAPSHOT": True, "USE_PREFLIGHT": True, "USE_LOAD_MANIFEST": False, "USE_MMAP_LOADER": True, "LOAD_WORKERS": 4},
+        # 清单命中：跳过修复流程，直接使用记录的策略
+        "manifest": {"USE_SNAPSHOT": True, "USE_PREFLIGHT": True, "USE_LOAD_MANIFEST": True, "USE_MMAP_LOADER": True, "LOAD_WORKERS": 4},
+    }
+
+    saved = {
+        key: getattr(handler, key)
+        for key in (
+            "MODEL_PATH", "USE_PREFLIGHT", "USE_LOAD_MANIFEST", "USE_MMAP_LOADER", "USE_SNAPSHOT", "LOAD_WORKERS", "pipeline"
+        )
+    }
+    try:
+        for layout, layout_kwargs in layouts.items():
+            model_path = tempfile.mkdtemp(prefix=f"bench-{layout}-")
+            try:
+                write_tiny_model_dir(model_path, **layout_kwargs)
+                handler.MODEL_PATH = model_path
+
+                for mode, settings in modes.items():
+                    for key, value in settings.items():
+                        setattr(handler, key, value)
+                    if mode == "snapshot":
+                        export_snapshot(model_path)
+                    if mode == "manifest":
+                        handler.load_model()  # 生成清单
+
+                    median, samples = _timeit(handler.load_model, args.repeat)
+                    strategy = handler.load_stats.get("strategy") or {}
+                    components = handler.load_stats.get("components") or {}
+                    component_load = handler.load_stats.get("component_load") or {}
+                    results.append({
+                        "layout": layout,
+                        "mode": mode,
+                        "median_s": round(median, 4),
+                        "samples_s": [round(s, 4) for s in samples],
+                        "strategy": strategy.get("name"),
+                        "attempts": strategy.get("attempts"),
+                        "weights_mb": round(sum(c["bytes"] for c in components.values()) / 2 ** 20, 2) if components else None,
+                        # 组件加载的总耗时 vs 各组件耗时之和 (并发时前者更小)
+                        "components_s": component_load.get("seconds"),
+                        "components_sum_s": round(sum(c["seconds"] for c in components.values()), 4) if components else None,
+                    })
+            finally:
+                shutil.rmtree(model_path, ignore_errors=True)
+    finally:
+        for key, value in saved.items():
+            setattr(handler, key, value)
+
+    return results
+
+
+def _run_isolated(fn, *args):
+    """在全新的子进程中运行 fn(*args)，用于测量冷启动/首个请求这类只发生一次的开销"""
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(fn, args)
+
+
+def _warmup_then_first_request(mode, resolutions):
+    """子进程：构建微型 pipeline，按 mode 预热，然后测量第一个真实请求的延迟"""
+    logging.disable(logging.WARNING)
+    import torch
+    from synthetic_sdxl import build_tiny_pipeline
+    from warmup import run_warmup, start_background_warmup
+
+    pipe = build_tiny_pipeline()
+    lock = threading.RLock()
+
+    start = time.perf_counter()
+    if mode == "background":
+        stats = {}
+        thread = start_background_warmup(pipe, resolutions, lock, stats)
+    else:
+        stats = run_warmup(pipe, mode, resolutions, lock)
+    blocking = time.perf_counter() - start
+
+    width, height = resolutions[-1]
+    start = time.perf_counter()
+    with lock, torch.no_grad():
+        pipe(prompt="a cat", num_inference_steps=2, width=width, height=height)
+    first_request = time.perf_counter() - start
+
+    if mode == "background":
+        thread.join()
+
+    return {
+        "mode": mode,
+        "blocking_s": round(blocking, 4),
+        "warmup_total_s": stats.get("seconds"),
+        "first_request_s": round(first_request, 4),
+    }
+
+
+@benchmark("warmup", "各预热模式的阻塞时间和之后第一个请求的延迟")
+def bench_warmup(args):
+    resolutions = [(64, 64), (128, 128)]
+    return [
+        _run_isolated(_warmup_then_first_request, mode, resolutions)
+        for mode in ("skip", "encode", "unet", "full", "background")
+    ]
+
+
+def _photo_like_image(width=1024, height=1024, seed=0):
+    """平滑渐变 + 轻微噪声，压缩特性接近真实照片 (纯噪声或纯色都会失真)"""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([
+        128 + 100 * np.sin(x / 97.0),
+        128 + 100 * np.cos(y / 131.0),
+        128 + 60 * np.sin((x + y) / 53.0),
+    ], axis=-1)
+    noise = rng.normal(0, 6, size=base.shape)
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8))
+
+
+@benchmark("encode", "各输出格式的编码耗时和 payload 大小 (1024x1024)")
+def bench_encode(args):
+    import base64
+    from io import BytesIO
+    from output_encoding import encode_output
+
+    image = _photo_like_image()
+
+    def _legacy():
+        # 原实现: save -> getvalue() 拷贝 -> b64encode -> decode
+        buffered = BytesIO()
+        image.save(buffered, format="PNG")
+        return {"image": base64.b64encode(buffered.getvalue()).decode()}
+
+    cases = [("png (legacy, level 6)", _legacy)]
+    for level in (0, 1, 6):
+        cases.append((f"png level {level}", lambda level=level: encode_output(image, "png", compress_level=level)))
+    for quality in (75, 90):
+        cases.append((f"jpeg q{quality}", lambda q=quality: encode_output(image, "jpeg", quality=q)))
+        cases.append((f"webp q{quality}", lambda q=quality: encode_output(image, "webp", quality=q)))
+    cases.append(("raw uint8", lambda: encode_output(image, "raw")))
+
+    results = []
+    for name, fn in cases:
+        payload = fn()
+        median, samples = _timeit(fn, args.repeat)
+        results.append({
+            "format": name,
+            "median_ms": round(median * 1000, 2),
+            "samples_s": [round(s, 4) for s in samples],
+            "payload_kb": round(len(payload["image"]) / 1024, 1),
+        })
+    return results
+
+
+def _percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+@benchmark("memory", "各内存回收策略下的单请求延迟 (微型 pipeline, 64x64)")
+def bench_memory(args):
+    import handler
+    from memory_policy import MemoryPolicy
+    from synthetic_sdxl import build_tiny_pipeline
+
+    requests = args.requests or 20
+    policies = [
+        ("always", {}),
+        ("every_n", {"every_n": 10}),
+        ("watermark", {"watermark": handler.MEMORY_WATERMARK}),
+        ("idle", {"idle_seconds": 60}),
+        ("never", {}),
+    ]
+
+    saved = (handler.pipeline, handler.memory_policy)
+    handler.pipeline = build_tiny_pipeline()
+    results = []
+    try:
+        # 第一次调用包含惰性初始化，不计入
+        handler.generate_images("warmup", num_inference_steps=2, width=64, height=64, seed=0)
+        for mode, kwargs in policies:
+            policy = MemoryPolicy(mode, device=handler.DEVICE, **kwargs)
+            handler.memory_policy = policy
+            samples = []
+            for i in range(requests):
+                start = time.perf_counter()
+                handler.generate_images(f"a cat {i}", num_inference_steps=2, width=64, height=64, seed=i)
+                samples.append(time.perf_counter() - start)
+            policy.close()
+            stats = policy.stats()
+            results.append({
+                "policy": mode,
+                "median_ms": round(statistics.median(samples) * 1000, 2),
+                "p95_ms": round(_percentile(samples, 0.95) * 1000, 2),
+                "cleanups": stats["cleanups"],
+                "cleanup_ms_total": stats["cleanup_ms_total"],
+                "samples_s": [round(s, 4) for s in samples],
+            })
+    finally:
+        handler.pipeline, handler.memory_policy = saved
+
+    return results
+
+
+@benchmark("generate", "预热后的 generate_images() 延迟: 分辨率 x 步数 x 批大小 (微型 pipeline) 及峰值 RSS")
+def bench_generate(args):
+    import handler
+    from synthetic_sdxl import build_tiny_pipeline
+
+    resolutions = [(64, 64), (128, 128)]
+    steps_options = (2, 4, 8)
+    batch_sizes = (1, 2, 4)
+
+    saved = handler.pipeline
+    handler.pipeline = build_tiny_pipeline()
+    results = []
+    try:
+        # 第一次调用包含惰性初始化，不计入
+        handler.generate_images("warmup", num_inference_steps=2, width=64, height=64, seed=0)
+        for width, height in resolutions:
+            for steps in steps_options:
+                for batch in batch_sizes:
+                    _reset_peak_rss()
+                    median, samples = _timeit(lambda: handler.generate_images(
+                        "a cat", num_inference_steps=steps, width=width, height=height,
+                        seed=0, num_images_per_prompt=batch
+                    ), args.repeat)
+                    results.append({
+                        "scenario": f"{width}x{height} steps={steps} batch={batch}",
+                        "median_ms": round(median * 1000, 2),
+                        "per_step_ms": round(median * 1000 / steps, 2),
+                        "peak_rss_mb": _peak_rss_mb(),
+                        "samples_s": [round(s, 4) for s in samples],
+                    })
+    finally:
+        handler.pipeline = saved
+
+    return results
+
+
+@benchmark("throughput", "并发 handler() 调用的吞吐和延迟分布 (微型 pipeline, 64x64, 4 步, 默认合批配置)")
+def bench_throughput(args):
+    import handler
+    from batching import MicroBatcher
+    from synthetic_sdxl import build_tiny_pipeline
+
+    requests = args.requests or 16
+    saved = (handler.pipeline, handler.batcher, handler.result_cache)
+    handler.pipeline = build_tiny_pipeline()
+    # 每个并发级别发送同样的 seed 固定请求，结果缓存会让后面的级别全部命中
+    handler.result_cache = None
+    results = []
+    try:
+        handler.handler({"input": {"prompt": "warmup", "num_inference_steps": 2, "width": 64, "height": 64}})
+        for concurrency in (1, 2, 4, 8):
+            handler.batcher = MicroBatcher(
+                handler.generate_batch, max_batch_size=handler.MAX_BATCH_SIZE, window_ms=handler.BATCH_WINDOW_MS
+            )
+            latencies, errors = [], []
+            lock = threading.Lock()
+            pending = list(range(requests))
+
+            def _client():
+                while True:
+                    with lock:
+                        if not pending:
+                            return
+                        i = pending.pop()
+                    start = time.perf_counter()
+                    result = handler.handler({"input": {
+                        "prompt": f"a cat {i % 4}", "num_inference_steps": 4, "width": 64, "height": 64, "seed": i
+                    }})
+                    with lock:
+                        latencies.append(time.perf_counter() - start)
+                        if "error" in result:
+                            errors.append(result["error"])
+
+            _reset_peak_rss()
+            threads = [threading.Thread(target=_client) for _ in range(concurrency)]
+            start = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            seconds = time.perf_counter() - start
+            batch_stats = handler.batcher.stats()
+            handler.batcher.close()
+
+            results.append({
+                "scenario": f"concurrency={concurrency}",
+                "requests": requests,
+                "requests_per_s": round(requests / seconds, 2),
+                "p50_ms": round(_percentile(latencies, 0.5) * 1000, 2),
+                "p95_ms": round(_percentile(latencies, 0.95) * 1000, 2),
+                "errors": len(errors),
+                "avg_batch": round(batch_stats["avg_batch_size"], 2),
+                "peak_rss_mb": _peak_rss_mb(),
+            })
+    finally:
+        handler.pipeline, handler.batcher, handler.result_cache = saved
+
+    return results
+
+
+class _GaussianDenoiser:
+    """替身 UNet：数据分布为逐元素 N(mean, std^2) 时的最优 epsilon 预测
+
+    每次调用 sleep cost_s 模拟真实 UNet 的前向耗时，这样延迟主要由调用次数决定；
+    采样结果的均值 / 标准差与目标分布的偏差可作为质量指标。
+    """
+
+    def __init__(self, alphas_cumprod, mean=0.3, std=0.5, cost_s=0.02):
+        self.alphas_cumprod = alphas_cumprod.double()
+        self.mean = mean
+        self.std = std
+        self.cost_s = cost_s
+        self.calls = 0
+
+    def _alpha_bar(self, t):
+        import torch
+        t = float(t)
+        low = int(min(max(t, 0), len(self.alphas_cumprod) - 1))
+        high = min(low + 1, len(self.alphas_cumprod) - 1)
+        frac = t - low
+        return torch.lerp(self.alphas_cumprod[low], self.alphas_cumprod[high], frac)
+
+    def __call__(self, x_t, t):
+        self.calls += 1
+        time.sleep(self.cost_s)
+        a = self._alpha_bar(t)
+        eps = (1 - a).sqrt() * (x_t.double() - a.sqrt() * self.mean) / (a * self.std ** 2 + 1 - a)
+        return eps.to(x_t.dtype)
+
+
+def _sample(scheduler, denoiser, steps, seed=0, shape=(1, 4, 64, 64)):
+    """与 pipeline 去噪循环相同的采样流程，返回最终 latent"""
+    import inspect
+    import torch
+
+    generator = torch.Generator().manual_seed(seed)
+    scheduler.set_timesteps(steps)
+    latents = torch.randn(shape, generator=generator) * scheduler.init_noise_sigma
+    step_kwargs = {"generator": generator} if "generator" in inspect.signature(scheduler.step).parameters else {}
+    for t in scheduler.timesteps:
+        model_input = scheduler.scale_model_input(latents, t)
+        latents = scheduler.step(denoiser(model_input, t), t, latents, **step_kwargs).prev_sample
+    return latents
+
+
+@benchmark("samplers", "各采样器在不同步数下的延迟和质量 (替身 UNet, 每次前向 20ms)")
+def bench_samplers(args):
+    from schedulers import SchedulerRegistry, SAMPLERS, supports_karras
+    from synthetic_sdxl import SCHEDULER_CONFIG
+
+    registry = SchedulerRegistry(SCHEDULER_CONFIG)
+    variants = [(name, False) for name in SAMPLERS]
+    variants += [(name, True) for name in SAMPLERS if supports_karras(name)]
+
+    results = []
+    for name, karras in variants:
+        for steps in (8, 15, 30):
+            scheduler = registry.get(name, karras)
+            denoiser = _GaussianDenoiser(scheduler.alphas_cumprod)
+            start = time.perf_counter()
+            latents = _sample(scheduler, denoiser, steps)
+            seconds = time.perf_counter() - start
+            error = abs(latents.mean().item() - denoiser.mean) + abs(latents.std().item() - denoiser.std)
+            results.append({
+                "sampler": name + (" (karras)" if karras else ""),
+                "steps": steps,
+                "unet_calls": denoiser.calls,
+                "latency_ms": round(seconds * 1000, 1),
+                "dist_error": round(error, 4),
+            })
+    return results
+
+
+class _SleepingPipeline:
+    """替身 pipeline：sleep 模拟 GPU 去噪 (释放 GIL)，以 np 数组返回照片般的 1024x1024 图像"""
+
+    def __init__(self, gpu_s=0.15):
+        import numpy as np
+        self.gpu_s = gpu_s
+        self.frame = np.asarray(_photo_like_image(), dtype=np.float32) / 255.0
+
+    def __call__(self, prompt, num_images_per_prompt=1, **kwargs):
+        from types import SimpleNamespace
+        count = len(prompt) if isinstance(prompt, list) else num_images_per_prompt
+        time.sleep(self.gpu_s)
+        return SimpleNamespace(images=[self.frame] * count)
+
+
+@benchmark("postprocess", "端到端吞吐: 推理线程内编码 vs 后处理线程池 (替身 pipeline, 1024x1024 PNG)")
+def bench_postprocess(args):
+    import handler
+    from batching import MicroBatcher
+    from postprocess import PostProcessPool
+
+    requests = args.requests or 16
+    events = [
+        {"input": {"prompt": f"a cat {i}", "seed": i, "width": 1024, "height": 1024}}
+        for i in range(requests)
+    ]
+    modes = [("inline", 0), ("pool x1", 1), ("pool x2", 2), ("pool x4", 4)]
+
+    saved = (handler.pipeline, handler.batcher, handler.postprocess_pool, handler.prompt_cache, handler.result_cache)
+    results = []
+    try:
+        handler.pipeline = _SleepingPipeline()
+        handler.prompt_cache = None
+        handler.result_cache = None
+        for mode, workers in modes:
+            handler.postprocess_pool = PostProcessPool(workers, max_pending=8) if workers else None
+            # 每批一个请求，只比较编码是否与下一次去噪重叠
+            handler.batcher = MicroBatcher(handler.generate_batch, max_batch_size=1, window_ms=0)
+
+            threads = [threading.Thread(target=handler.handler, args=(e,)) for e in events]
+            start = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            seconds = time.perf_counter() - start
+
+            handler.batcher.close()
+            pool_stats = handler.postprocess_pool.stats() if handler.postprocess_pool else {}
+            if handler.postprocess_pool:
+                handler.postprocess_pool.close()
+            results.append({
+                "mode": mode,
+                "requests": requests,
+                "seconds": round(seconds, 3),
+                "images_per_s": round(requests / seconds, 2),
+                "backpressure_waits": pool_stats.get("backpressure_waits"),
+            })
+    finally:
+        handler.pipeline, handler.batcher, handler.postprocess_pool, handler.prompt_cache, handler.result_cache = saved
+
+    return results
+
+
+def _vae_decode_peak(width, height, tile_size):
+    """子进程：用 SDXL 结构 (4 级, 8 倍下采样) 的窄通道 VAE 解码一次，返回峰值内存增量"""
+    import resource
+    logging.disable(logging.WARNING)
+    import torch
+    from diffusers import AutoencoderKL
+    from vae_tiling import VaeTiling
+
+    torch.manual_seed(0)
+    vae = AutoencoderKL(
+        block_out_channels=[16, 32, 64, 64],
+        down_block_types=["DownEncoderBlock2D"] * 4,
+        up_block_types=["UpDecoderBlock2D"] * 4,
+        latent_channels=4,
+        norm_num_groups=16,
+        layers_per_block=1,
+        sample_size=1024,
+    ).eval()
+    latents = torch.randn(1, 4, height // 8, width // 8)
+    if tile_size is not None:
+        VaeTiling(min_pixels=0, tile_size=tile_size).configure(vae, width, height)
+
+    use_cuda = torch.cuda.is_available()
+    if use_cuda:
+        vae, latents = vae.cuda(), latents.cuda()
+        torch.cuda.reset_peak_memory_stats()
+        baseline = torch.cuda.memory_allocated()
+    else:
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    start = time.perf_counter()
+    with torch.no_grad():
+        image = vae.decode(latents).sample
+    seconds = time.perf_counter() - start
+
+    peak = torch.cuda.max_memory_allocated() if use_cuda else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {
+        "resolution": f"{width}x{height}",
+        "mode": "full" if tile_size is None else f"tiled {tile_size}px",
+        "device": "cuda" if use_cuda else "cpu",
+        "peak_mb": round((peak - baseline) / 2 ** 20, 1),
+        "decode_s": round(seconds, 3),
+        "output": "x".join(str(d) for d in image.shape[2:]),
+    }
+
+
+@benchmark("vae", "VAE 解码峰值内存: 整块 vs 分块 (SDXL 结构的窄通道 VAE, 每项一个子进程)")
+def bench_vae(args):
+    results = []
+    for size in (512, 1024, 2048):
+        for tile_size in (None, 512):
+            if tile_size is not None and size <= tile_size:
+                continue
+            results.append(_run_isolated(_vae_decode_peak, size, size, tile_size))
+    return results
+
+
+def _drop_page_cache():
+    """尽量清空内核页缓存，让每次加载都真正读盘 (需要 root，失败时返回 False)"""
+    try:
+        os.sync()
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("3\n")
+        return True
+    except OSError:
+        return False
+
+
+@benchmark("cache", "冷启动: 从网络卷加载 vs 从本地权重缓存加载 (--model-path 指定真实模型目录)")
+def bench_cache(args):
+    import handler
+    from model_manifest import load_manifest
+    from synthetic_sdxl import write_tiny_model_dir
+    from weight_cache import WeightCache
+
+    work = tempfile.mkdtemp(prefix="bench-cache-")
+    model_path = args.model_path
+    if model_path is None:
+        model_path = os.path.join(work, "volume")
+        write_tiny_model_dir(model_path)
+
+    saved = {key: getattr(handler, key) for key in ("MODEL_PATH", "USE_LOAD_MANIFEST", "weight_cache", "pipeline")}
+    results = []
+    try:
+        handler.MODEL_PATH, handler.USE_LOAD_MANIFEST, handler.weight_cache = model_path, True, None
+        handler.load_model()  # 写入 (或复用) 校验清单
+        manifest = load_manifest(model_path)
+        if manifest is None:
+            raise SystemExit(f"❌ 无法为 {model_path} 写入校验清单，本地缓存需要清单")
+
+        # 临时目录与模型目录通常在同一文件系统，强制复制以测量真实的填充耗时
+        cache = WeightCache(os.path.join(work, "cache"), 2 ** 50, link_mode="copy")
+        start = time.perf_counter()
+        cache.populate(model_path, manifest)
+        size_mb = round(sum(info["size"] for info in manifest["files"].values()) / 2 ** 20, 2)
+        results.append({
+            "step": "populate", "median_s": round(time.perf_counter() - start, 4), "mb": size_mb,
+            "page_cache_dropped": None,
+        })
+
+        for source, weight_cache in (("volume", None), ("local_cache", cache)):
+            handler.weight_cache = weight_cache
+            samples, dropped = [], True
+            for _ in range(args.repeat):
+                dropped = _drop_page_cache() and dropped
+                start = time.perf_counter()
+                handler.load_model()
+                samples.append(time.perf_counter() - start)
+                assert handler.load_stats["source"] == source
+            results.append({
+                "step": f"load_from_{source}",
+                "median_s": round(statistics.median(samples), 4),
+                "samples_s": [round(s, 4) for s in samples],
+                "mb": size_mb,
+                "page_cache_dropped": dropped,
+            })
+    finally:
+        for key, value in saved.items():
+            setattr(handler, key, value)
+        shutil.rmtree(work, ignore_errors=True)
+    return results
+
+
+def _compile_and_time(cache_dir, repeat):
+    """子进程：eager 请求耗时 -> 编译 (或从 cache_dir 加载产物) -> 编译后请求耗时"""
+    logging.disable(logging.WARNING)
+    import torch
+    from compile_cache import compile_unet
+    from synthetic_sdxl import build_tiny_pipeline
+
+    pipe = build_tiny_pipeline()
+
+    def _request():
+        with torch.no_grad():
+            pipe(prompt="a red fox", num_inference_steps=10, width=64, height=64, output_type="latent")
+
+    _request()
+    eager, _ = _timeit(_request, repeat)
+    stats = compile_unet(pipe, cache_dir, "benchmark", [(64, 64)], mode="default")
+    compiled, _ = _timeit(_request, repeat)
+    return {
+        "status": stats["status"],
+        "source": stats["buckets"].get("64x64", {}).get("source"),
+        "compile_s": stats["seconds"],
+        "eager_request_s": round(eager, 4),
+        "compiled_request_s": round(compiled, 4),
+    }
+
+
+@benchmark("compile", "UNet 编译: 冷编译 vs 从卷上的编译产物加载 (每项一个全新 inductor 缓存的子进程)")
+def bench_compile(args):
+    work = tempfile.mkdtemp(prefix="bench-compile-")
+    cache_dir = os.path.join(work, "volume-cache")
+    saved = os.environ.get("TORCHINDUCTOR_CACHE_DIR")
+    results = []
+    try:
+        for scenario in ("cold", "cached"):
+            # spawn 的子进程继承当前环境，本地 inductor 缓存每次都是空的
+            os.environ["TORCHINDUCTOR_CACHE_DIR"] = os.path.join(work, f"inductor-{scenario}")
+            results.append({"scenario": scenario, **_run_isolated(_compile_and_time, cache_dir, args.repeat)})
+    finally:
+        if saved is None:
+            os.environ.pop("TORCHINDUCTOR_CACHE_DIR", None)
+        else:
+            os.environ["TORCHINDUCTOR_CACHE_DIR"] = saved
+        shutil.rmtree(work, ignore_errors=True)
+    return results
+
+
+def _fresh_worker(model_path):
+    """子进程：一个全新 worker 从 import 到就绪 (load_model + 就绪检查) 的耗时"""
+    logging.disable(logging.WARNING)
+    start = time.perf_counter()
+    import handler
+    imported = time.perf_counter()
+    handler.MODEL_PATH = model_path
+    handler.load_model()
+    loaded = time.perf_counter()
+    handler.zygote_ready_check()
+    return {"import_s": imported - start, "load_s": loaded - imported, "ready_s": time.perf_counter() - start}
+
+
+@benchmark("zygote", "worker 就绪时间: 全新进程 import + load_model() vs 从已加载的父进程 fork (--requests 为子进程数)")
+def bench_zygote(args):
+    import handler
+    import zygote
+    from synthetic_sdxl import write_tiny_model_dir
+
+    model_path = tempfile.mkdtemp(prefix="bench-zygote-")
+    saved = {key: getattr(handler, key) for key in ("MODEL_PATH", "pipeline")}
+    workers = args.requests or 4
+    try:
+        write_tiny_model_dir(model_path)
+        handler.MODEL_PATH = model_path
+        handler.load_model()  # 写入校验清单，之后的全新 worker 与父进程走同样的加载路径
+
+        fresh = [_run_isolated(_fresh_worker, model_path) for _ in range(args.repeat)]
+
+        start = time.perf_counter()
+        handler.load_model()
+        parent_load_s = time.perf_counter() - start
+        supervisor = zygote.Supervisor(
+            lambda: time.sleep(3600), workers=workers, ready_check=handler.zygote_ready_check,
+            parent_load_s=round(parent_load_s, 4), threads_per_worker=1,
+        )
+        supervisor.start()
+        ready = supervisor.wait_ready(timeout=120)
+        stats = supervisor.stats()
+        supervisor.stop()
+        if not ready:
+            raise SystemExit("❌ zygote 子进程未能就绪")
+    finally:
+        for key, value in saved.items():
+            setattr(handler, key, value)
+        shutil.rmtree(model_path, ignore_errors=True)
+
+    ready_times = [child["time_to_ready_s"] for child in stats["children"]]
+    return [
+        {
+            "mode": "fresh_process",
+            "workers": len(fresh),
+            "median_ready_s": round(statistics.median(r["ready_s"] for r in fresh), 4),
+            "samples_s": [round(r["ready_s"], 4) for r in fresh],
+            "detail": f"import {statistics.median(r['import_s'] for r in fresh):.3f}s + load_model {statistics.median(r['load_s'] for r in fresh):.3f}s",
+        },
+        {
+            "mode": "zygote_fork",
+            "workers": workers,
+            "median_ready_s": round(statistics.median(ready_times), 4),
+            "samples_s": ready_times,
+            "detail": f"parent load_model {parent_load_s:.3f}s (once)",
+        },
+    ]
+
+
+def _psnr(reference, image):
+    """两张 [0, 1] float 图像的 PSNR (dB)，完全相同时返回 None"""
+    import numpy as np
+    mse = float(np.mean((np.asarray(reference, dtype=np.float64) - np.asarray(image, dtype=np.float64)) ** 2))
+    return 10 * np.log10(1.0 / mse) if mse > 0 else None
+
+
+# adaptive 基准的参考步数 (客户端常用的 30 步) 和对照的固定步数 / 阈值
+ADAPTIVE_REFERENCE_STEPS = 30
+ADAPTIVE_FIXED_STEPS = (10, 15, 20, 25)
+ADAPTIVE_THRESHOLDS = (0.005, 0.01, 0.02, 0.05)
+ADAPTIVE_PROMPTS = (
+    "a photo of a cat sitting on a windowsill",
+    "portrait of an old fisherman, dramatic lighting",
+    "a mountain lake at sunrise, highly detailed",
+)
+
+
+@benchmark("adaptive", "质量 vs 步数: 固定步数和自适应步数 (各阈值 / 模式) 相对 30 步参考图的 PSNR 和耗时")
+def bench_adaptive(args):
+    import handler
+    import metrics
+    from adaptive_steps import ADAPTIVE_MODES
+    from synthetic_sdxl import build_tiny_pipeline
+
+    prompts = list(ADAPTIVE_PROMPTS)
+    if args.prompts:
+        with open(args.prompts) as f:
+            prompts = [line.strip() for line in f if line.strip()]
+    seeds = range(args.requests or 2)
+
+    saved = {key: getattr(handler, key) for key in ("MODEL_PATH", "ADAPTIVE_MODE", "pipeline")}
+    results = []
+    try:
+        if args.model_path:
+            handler.MODEL_PATH = args.model_path
+            handler.load_model()
+            width = height = 1024
+        else:
+            handler.pipeline = build_tiny_pipeline()
+            width = height = 64
+
+        def _render(prompt, seed, steps, threshold=None):
+            trace = metrics.RequestTrace()
+            start = time.perf_counter()
+            with metrics.activate(trace):
+                image = handler.run_pipeline(
+                    [prompt], [""], [seed], steps, 7.0, width, height, adaptive_threshold=threshold
+                )[0]
+            return image, time.perf_counter() - start, len(trace.to_dict()["steps_ms"])
+
+        # 第一次调用包含惰性初始化，不计入
+        _render("warmup", 0, 2)
+        references, reference_times = {}, []
+        for prompt in prompts:
+            for seed in seeds:
+                references[prompt, seed], seconds, _ = _render(prompt, seed, ADAPTIVE_REFERENCE_STEPS)
+                reference_times.append(seconds)
+        results.append({
+            "scenario": f"steps={ADAPTIVE_REFERENCE_STEPS} (reference)", "steps_run": ADAPTIVE_REFERENCE_STEPS,
+            "median_ms": round(statistics.median(reference_times) * 1000, 2), "psnr_db": None, "min_psnr_db": None,
+        })
+
+        def _row(scenario, steps, threshold=None):
+            times, steps_run, scores = [], [], []
+            for (prompt, seed), reference in references.items():
+                image, seconds, run = _render(prompt, seed, steps, threshold)
+                times.append(seconds)
+                steps_run.append(run)
+                scores.append(_psnr(reference, image))
+            finite = [score for score in scores if score is not None]
+            results.append({
+                "scenario": scenario,
+                "steps_run": round(statistics.mean(steps_run), 2),
+                "median_ms": round(statistics.median(times) * 1000, 2),
+                "psnr_db": round(statistics.mean(finite), 2) if finite else None,
+                "min_psnr_db": round(min(finite), 2) if finite else None,
+            })
+
+        for steps in ADAPTIVE_FIXED_STEPS:
+            _row(f"steps={steps}", steps)
+        for mode in ADAPTIVE_MODES:
+            handler.ADAPTIVE_MODE = mode
+            for threshold in ADAPTIVE_THRESHOLDS:
+                _row(f"adaptive<{threshold} {mode}", ADAPTIVE_REFERENCE_STEPS, threshold)
+    finally:
+        for key, value in saved.items():
+            setattr(handler, key, value)
+
+    return results
+
+
+# suite 依次运行的基准 (都只依赖微型合成模型，可以在任何机器上复现)
+SUITE = ("load", "generate", "throughput", "encode")
+
+
+@benchmark("suite", f"依次运行 {', '.join(SUITE)}，结果按基准名分组 (配合 --json 和 compare 做回归对比)")
+def bench_suite(args):
+    results = {}
+    for name in SUITE:
+        fn, _ = BENCHMARKS[name]
+        print(f"⏱️ {name} ...", flush=True)
+        results[name] = fn(args)
+    return results
+
+
+def _environment():
+    """结果文件的 meta：运行环境和代码版本，对比时用于确认两份结果可比"""
+    import torch
+    import diffusers
+
+    def _git(*cmd):
+        try:
+            return subprocess.run(
+                ["git", *cmd], capture_output=True, text=True, timeout=10,
+                cwd=os.path.dirname(os.path.abspath(__file__))
+            ).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            return None
+
+    return {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "diffusers": diffusers.__version__,
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "platform": platform.platform(),
+    }
+
+
+def _metric_direction(key):
+    """指标方向：1 表示越小越好，-1 表示越大越好，None 表示不是性能指标"""
+    if key.endswith("samples_s"):
+        return None
+    if key.endswith("_per_s"):
+        return -1
+    if key.endswith(("_ms", "_s", "_mb", "_kb")) or key in ("seconds", "errors"):
+        return 1
+    return None
+
+
+def _row_key(row, seen):
+    """用字符串 / bool 字段标识一行 (数值字段是测量结果)，重复的标识按出现顺序编号"""
+    ident = tuple((k, v) for k, v in row.items() if _metric_direction(k) is None and isinstance(v, (str, bool)))
+    seen[ident] = seen.get(ident, -1) + 1
+    return ident + (("#", seen[ident]),)
+
+
+def _grouped(data):
+    """把 --json 写出的结果统一为 {基准名: [行]}"""
+    if data["benchmark"] == "suite":
+        return data["results"]
+    return {data["benchmark"]: data["results"]}
+
+
+def compare_results(baseline, current, threshold=0.15):
+    """对比两份 --json 结果，返回 [{"benchmark", "row", "metric", "baseline", "current", "change", "regression"}]
+
+    change 是相对变化 (current / baseline - 1)；越小越好的指标变大超过 threshold，
+    或越大越好的指标变小超过 threshold 时 regression 为 True。只有一边存在的行不参与对比。
+    """
+    baseline, current = _grouped(baseline), _grouped(current)
+    changes = []
+    for name, rows in current.items():
+        seen = {}
+        base_rows = {_row_key(r, seen): r for r in baseline.get(name, [])}
+        seen = {}
+        for row in rows:
+            key = _row_key(row, seen)
+            base = base_rows.get(key)
+            if base is None:
+                continue
+            label = " ".join(str(v) for k, v in key if k != "#") or f"#{key[-1][1]}"
+            for metric, value in row.items():
+                direction = _metric_direction(metric)
+                old = base.get(metric)
+                if direction is None or not isinstance(value, (int, float)) or not isinstance(old, (int, float)):
+                    continue
+                if old:
+                    change = value / old - 1
+                else:
+                    change = float("inf") if value > old else 0.0
+                changes.append({
+                    "benchmark": name,
+                    "row": label,
+                    "metric": metric,
+                    "baseline": old,
+                    "current": value,
+                    "change": round(change, 4) if change != float("inf") else None,
+                    "regression": change * direction > threshold,
+                })
+    return changes
+
+
+def run_compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    for label, data in (("baseline", baseline), ("current", current)):
+        meta = data.get("meta") or {}
+        print(f"   {label}: commit {str(meta.get('commit'))[:12]}{' (dirty)' if meta.get('dirty') else ''}, "
+              f"torch {meta.get('torch')}, {meta.get('cpu_count')} CPU")
+    if (baseline.get("meta") or {}).get("cpu_count") != (current.get("meta") or {}).get("cpu_count"):
+        print("⚠️ 两份结果的 CPU 数不同，对比结果仅供参考")
+
+    changes = compare_results(baseline, current, args.threshold)
+    regressions = [c for c in changes if c["regression"]]
+    _print_results(f"回归 (阈值 {args.threshold:.0%})", [
+        {k: c[k] for k in ("benchmark", "row", "metric", "baseline", "current", "change")} for c in regressions
+    ])
+    print(f"\n{'❌' if regressions else '✅'} 对比了 {len(changes)} 项指标，{len(regressions)} 项回归")
+    return 1 if regressions else 0
+
+
+def _print_results(name, results):
+    if isinstance(results, dict):
+        for sub_name, sub_results in results.items():
+            _print_results(sub_name, sub_results)
+        return
+    print(f"\n📊 {name}")
+    if not results:
+        return
+    columns = [k for k in results[0] if not k.endswith("samples_s")]
+    widths = {c: max(len(c), *(len(str(r.get(c))) for r in results)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for r in results:
+        print("  ".join(str(r.get(c)).ljust(widths[c]) for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PhotonicFusion SDXL 性能基准测试")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    parser.add_argument("--verbose", action="store_true", help="显示 handler 日志")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    for name, (_, help_text) in BENCHMARKS.items():
+        sub = subparsers.add_parser(name, help=help_text)
+        # 放在子命令之后也能识别 --json
+        sub.add_argument("--json", default=argparse.SUPPRESS, help="把结果写入 JSON 文件")
+        sub.add_argument("--repeat", type=int, default=3)
+        sub.add_argument("--requests", type=int, default=None, help="每个场景的请求数 (仅部分基准使用)")
+        sub.add_argument("--model-path", default=None, help="使用已有的模型目录代替微型合成模型 (仅 cache / adaptive 使用)")
+        sub.add_argument("--prompts", default=None, help="每行一个 prompt 的文本文件 (仅 adaptive 使用)")
+
+    compare = subparsers.add_parser("compare", help="对比两份 --json 结果，有回归时退出码为 1")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=0.15, help="判为回归的相对变化 (默认 0.15)")
+
+    args = parser.parse_args()
+    if args.benchmark == "compare":
+        return run_compare(args)
+
+    if not args.verbose:
+        logging.disable(logging.WARNING)
+        os.environ.setdefault("TRANSFORMERS_VERBOSITY", "error")
+
+    fn, _ = BENCHMARKS[args.benchmark]
+    results = fn(args)
+    _print_results(args.benchmark, results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": args.benchmark, "meta": _environment(), "results": results}, f, indent=2)
+        print(f"\n💾 结果已写入: {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+分辨率分桶 (resolution bucketing) 和 latent 缓冲池
+
+任意 width/height 会被吸附到一组固定的 SDXL 训练分辨率 (约 1 百万像素、不同宽高比)，
+所有请求只会出现少数几种形状：注意力缓冲区、kernel 选择和显存分配都能复用。
+需要时生成后再裁剪或缩放回请求的尺寸。
+
+每个桶有一块预分配的 latent 噪声缓冲区 (按批大小增长)，请求的初始噪声直接用各
+样本的 generator 填充到缓冲区里，结果与 pipeline 自己生成的噪声逐位一致。
+"""
+
+import math
+import threading
+import logging
+
+import torch
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# SDXL 训练时使用的宽高比桶
+SDXL_BUCKETS = [
+    (1024, 1024),
+    (1152, 896), (896, 1152),
+    (1216, 832), (832, 1216),
+    (1344, 768), (768, 1344),
+    (1536, 640), (640, 1536),
+]
+
+FIT_MODES = ("none", "crop", "resize")
+
+
+def nearest_bucket(width, height, buckets=None):
+    """选择宽高比最接近的桶，宽高比相同时选面积最接近的"""
+    buckets = buckets or SDXL_BUCKETS
+    ratio = math.log(width / height)
+    area = width * height
+    return min(
+        buckets,
+        key=lambda b: (round(abs(math.log(b[0] / b[1]) - ratio), 6), abs(b[0] * b[1] - area))
+    )
+
+
+def fit_to_size(image, width, height, mode="crop"):
+    """把桶尺寸的图像还原为请求尺寸
+
+    crop:   等比缩放到覆盖目标尺寸后居中裁剪 (不变形)
+    resize: 直接缩放到目标尺寸
+    none:   原样返回
+    """
+    if mode == "none" or image.size == (width, height):
+        return image
+    if mode == "resize":
+        return image.resize((width, height), Image.LANCZOS)
+
+    scale = max(width / image.width, height / image.height)
+    resized = image.resize((max(width, round(image.width * scale)), max(height, round(image.height * scale))), Image.LANCZOS)
+    left = (resized.width - width) // 2
+    top = (resized.height - height) // 2
+    return resized.crop((left, top, left + width, top + height))
+
+
+class LatentPool:
+    """按 (宽, 高, dtype, device) 复用的初始噪声缓冲区
+
+    调用方必须串行使用 (handler 在 pipeline_lock 内调用 acquire 和 pipeline)。
+    pipeline 只读取传入的 latents (乘以 init_noise_sigma 得到新张量)，不会原地修改缓冲区。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buffers = {}
+        self._stats = {}
+
+    @staticmethod
+    def latent_shape(pipe, width, height):
+        scale = getattr(pipe, "vae_scale_factor", 8)
+        return (pipe.unet.config.in_channels, height // scale, width // scale)
+
+    def _buffer(self, pipe, width, height, batch):
+        """返回至少能容纳 batch 个样本的缓冲区，以及是否命中"""
+        dtype = pipe.unet.dtype
+        device = pipe._execution_device
+        key = (width, height, dtype, str(device))
+        with self._lock:
+            stats = self._stats.setdefault(f"{width}x{height}", {"requests": 0, "hits": 0, "allocations": 0})
+            stats["requests"] += 1
+            buffer = self._buffers.get(key)
+            if buffer is not None and buffer.shape[0] >= batch:
+                stats["hits"] += 1
+                return buffer
+            buffer = torch.empty((batch, *self.latent_shape(pipe, width, height)), dtype=dtype, device=device)
+            self._buffers[key] = buffer
+            stats["allocations"] += 1
+            return buffer
+
+    def preallocate(self, pipe, width, height, batch):
+        """在加载阶段为一个桶预先分配缓冲区 (不计入命中统计)"""
+        dtype = pipe.unet.dtype
+        device = pipe._execution_device
+        key = (width, height, dtype, str(device))
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is None or buffer.shape[0] < batch:
+                self._buffers[key] = torch.empty(
+                    (batch, *self.latent_shape(pipe, width, height)), dtype=dtype, device=device
+                )
+                self._stats.setdefault(f"{width}x{height}", {"requests": 0, "hits": 0, "allocations": 0})
+
+    def acquire(self, pipe, width, height, generators):
+        """用每个样本的 generator 填充缓冲区，返回 (len(generators), C, h, w) 的视图
+
+        与 diffusers randn_tensor() 的取数顺序相同，同一 seed 得到同样的噪声。
+        """
+        batch = len(generators)
+        buffer = self._buffer(pipe, width, height, batch)
+        latents = buffer[:batch]
+        for sample, generator in zip(latents, generators):
+            if generator.device == sample.device:
+                sample.normal_(generator=generator)
+            else:
+                sample.copy_(torch.randn(sample.shape, generator=generator, device=generator.device, dtype=sample.dtype))
+        return latents
+
+    def stats(self):
+        with self._lock:
+            return {
+                bucket: {**s, "hit_rate": round(s["hits"] / s["requests"], 4) if s["requests"] else 0.0}
+                for bucket, s in self._stats.items()
+            }
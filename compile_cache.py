@@ -0,0 +1,158 @@
+"""
+UNet 的 torch.compile 编译产物缓存
+
+编译 UNet 能明显加快每一步去噪，但 serverless 冷启动 (min_workers 0) 每次都重新
+编译得不偿失。这里把编译产物 (inductor FX graph 缓存、autotune 结果等，由
+torch.compiler.save_cache_artifacts() 打包) 按分辨率桶保存到网络卷上的缓存目录，
+下次冷启动先用 load_cache_artifacts() 放回本地缓存，编译时直接命中。
+
+缓存键由模型指纹、torch 版本、dtype、分辨率桶、设备类型和编译模式组成，任何一项
+变化都会生成新的产物文件。save_cache_artifacts() 会累积进程内记录的所有产物，
+因此每个桶在独立的记录范围内编译和保存，产物文件只包含该桶自己的产物。编译使用 dynamic=False，每个桶各自特化；请求尺寸不在
+桶内或批大小不同时会在第一次遇到时重新编译，因此建议与 RESOLUTION_BUCKETING 一起使用。
+
+产物只省去 inductor 的代码生成，Dynamo 的图追踪每次冷启动仍要重新进行，所以即使
+命中缓存，编译仍是冷启动的净开销，只有在 worker 处理足够多请求后才能收回。
+
+编译或加载失败时 UNet 恢复为 eager 模式，不影响服务。
+"""
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import time
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+COMPILE_MODES = ("default", "reduce-overhead", "max-autotune", "max-autotune-no-cudagraphs")
+
+# 每个桶一份特化的图，重新编译次数上限至少要能容纳所有桶
+MIN_RECOMPILE_LIMIT = 64
+
+
+def model_digest(manifest, unet):
+    """模型指纹：优先使用校验清单的目录指纹，没有清单时退回 UNet 配置的哈希"""
+    if manifest and manifest.get("digest"):
+        return manifest["digest"]
+    config = json.dumps(dict(unet.config), sort_keys=True, default=str)
+    return hashlib.sha256(config.encode()).hexdigest()
+
+
+def cache_key(digest, dtype, width, height, device, mode):
+    """返回 (键的组成部分, 文件名用的哈希)"""
+    parts = {
+        "model": digest,
+        "torch": torch.__version__,
+        "dtype": str(dtype).replace("torch.", ""),
+        "bucket": f"{width}x{height}",
+        "device": torch.device(device).type,
+        "mode": mode,
+    }
+    return parts, hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:32]
+
+
+def _set_recompile_limit(limit):
+    config = torch._dynamo.config
+    for name in ("recompile_limit", "cache_size_limit"):
+        if hasattr(config, name):
+            setattr(config, name, max(getattr(config, name), limit))
+            return
+
+
+def _trigger(pipe, width, height):
+    """用真实的 pipeline 调用触发编译 (与请求的 UNet 调用参数一致，跳过 VAE)"""
+    with torch.no_grad():
+        pipe(prompt="warmup", num_inference_steps=2, width=width, height=height, output_type="latent")
+
+
+def _fresh_artifacts():
+    """新的编译产物记录范围：范围内 save_cache_artifacts() 只返回范围内记录的产物"""
+    try:
+        from torch.compiler._cache import CacheArtifactManager
+    except ImportError:
+        return contextlib.nullcontext()
+    return CacheArtifactManager.with_fresh_cache()
+
+
+def _replace_file(path, data, mode="wb"):
+    """先写临时文件再 os.replace，其它 worker 不会读到写了一半的文件"""
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, mode) as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _write_artifacts(path, parts):
+    artifacts = torch.compiler.save_cache_artifacts()
+    if artifacts is None:
+        return 0
+    data, _ = artifacts
+    _replace_file(path, data)
+    _replace_file(f"{path[:-len('.bin')]}.json", json.dumps(parts, indent=2), mode="w")
+    return len(data)
+
+
+def compile_unet(pipe, cache_dir, digest, resolutions, mode="max-autotune-no-cudagraphs", lock=None):
+    """原地编译 pipe.unet 并为每个分辨率触发编译，返回统计
+
+    每个桶先尝试加载缓存的产物；没有缓存时编译后把产物写回 cache_dir。
+    任何一步失败都把 UNet 恢复为 eager 模式，返回的 status 为 "eager"。
+    """
+    if mode not in COMPILE_MODES:
+        raise ValueError(f"Unknown compile mode: {mode} (expected one of {COMPILE_MODES})")
+
+    unet = pipe.unet
+    device = pipe._execution_device
+    stats = {"status": "compiled", "mode": mode, "seconds": 0.0, "buckets": {}}
+    start = time.perf_counter()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        _set_recompile_limit(max(MIN_RECOMPILE_LIMIT, 2 * len(resolutions)))
+        unet.compile(mode=mode, dynamic=False)
+
+        for width, height in resolutions:
+            parts, key = cache_key(digest, unet.dtype, width, height, device, mode)
+            path = os.path.join(cache_dir, f"{key}.bin")
+            source = "compiled"
+            if os.path.exists(path):
+                try:
+                    with open(path, "rb") as f:
+                        torch.compiler.load_cache_artifacts(f.read())
+                    source = "cache"
+                except Exception as e:
+                    logger.warning(f"⚠️ 加载编译缓存失败 ({width}x{height}): {e}")
+
+            saved_bytes = 0
+            with _fresh_artifacts():
+                bucket_start = time.perf_counter()
+                if lock is not None:
+                    with lock:
+                        _trigger(pipe, width, height)
+                else:
+                    _trigger(pipe, width, height)
+                seconds = time.perf_counter() - bucket_start
+
+                if source == "compiled":
+                    try:
+                        saved_bytes = _write_artifacts(path, parts)
+                    except OSError as e:
+                        logger.warning(f"⚠️ 写入编译缓存失败: {e}")
+            stats["buckets"][f"{width}x{height}"] = {
+                "key": key,
+                "source": source,
+                "seconds": round(seconds, 3),
+                "saved_bytes": saved_bytes,
+            }
+            logger.info(f"⚙️ UNet 编译 {width}x{height} ({source}) 耗时 {seconds:.2f}s")
+    except Exception as e:
+        logger.warning(f"⚠️ UNet 编译失败，使用 eager 模式: {e}")
+        unet._compiled_call_impl = None
+        torch._dynamo.reset()
+        stats.update({"status": "eager", "error": str(e)[:500]})
+
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    return stats
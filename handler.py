@@ -1,14 +1,44 @@
 import runpod
 import torch
-from diffusers import StableDiffusionXLPipeline, EulerDiscreteScheduler
-import base64
-from io import BytesIO
+from diffusers import StableDiffusionXLPipeline
 from PIL import Image
 import os
-import gc
 import logging
 import warnings
 import json
+import random
+import threading
+import time
+import asyncio
+import uuid
+
+from batching import MicroBatcher
+from prompt_cache import PromptEmbeddingCache, cached_prompt_embeds
+from model_manifest import load_manifest, validate_manifest, write_manifest, update_manifest
+from output_encoding import encode_output, indexed_path, parse_output_options, OutputOptionsError
+from memory_policy import MemoryPolicy
+from schedulers import SchedulerRegistry, validate_sampler, BASE_SCHEDULER_CONFIG, DEFAULT_SCHEDULER_CLASS
+from job_queue import JobQueue, StepCostModel, DeadlineError
+from postprocess import PostProcessPool, to_pil, resolve
+from buckets import SDXL_BUCKETS, FIT_MODES, LatentPool, nearest_bucket, fit_to_size
+from vae_tiling import VaeTiling
+from mmap_loader import MissingWeightsError, check_weights_complete, load_pipeline_mmap
+from weight_cache import WeightCache
+from snapshot import load_snapshot
+from compile_cache import compile_unet, model_digest
+import zygote
+import metrics
+from replay import TrafficRecorder
+from result_cache import ResultCache, fingerprint, request_key
+from adaptive_steps import ConvergenceMonitor, AdaptiveStepStats, validate_threshold
+from streaming import StepStreamer, stream_generation
+from warmup import run_warmup, start_background_warmup, parse_resolutions
+from preflight import (
+    inspect_model_dir, choose_strategy, SNAPSHOT_CONFIG_PATH,
+    STRATEGY_SNAPSHOT, STRATEGY_MMAP,
+    STRATEGY_LOW_MEM_FP16, STRATEGY_FP16, STRATEGY_NO_VARIANT, STRATEGY_FP16_VARIANT, STRATEGY_NO_SAFETENSORS,
+    STRATEGY_ALLOW_DOWNLOAD
+)
 
 # Configure logging and suppress specific warnings
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -21,12 +51,199 @@ warnings.filterwarnings("ignore", category=UserWarning, message="You should prob
 
 # --- Configuration ---
 # The model path in the RunPod volume
-MODEL_PATH = "/runpod-volume/photonicfusion-sdxl"
+MODEL_PATH = os.environ.get("LOCAL_MODEL_PATH", "/runpod-volume/photonicfusion-sdxl")
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 
+# 微批处理：在窗口期内合并尺寸/步数相同的请求，一次 pipeline 调用完成
+# MAX_BATCH_SIZE=1 时关闭合批，每个请求单独生成
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", "4"))
+BATCH_WINDOW_MS = float(os.environ.get("BATCH_WINDOW_MS", "25"))
+
+# 多图生成：单个请求最多生成的图像数，以及单次 pipeline 调用的显存预算
+# 超出预算的批次会被拆成多次调用，避免 OOM
+MAX_IMAGES_PER_REQUEST = int(os.environ.get("MAX_IMAGES_PER_REQUEST", "8"))
+MAX_BATCH_PIXELS = int(os.environ.get("MAX_BATCH_PIXELS", str(4 * 1024 * 1024)))
+# 每个输出像素估算的峰值显存占用 (SDXL fp16 + CFG，约 1.5GB / 百万像素)
+BYTES_PER_PIXEL = int(os.environ.get("BYTES_PER_PIXEL", "1536"))
+
+# Prompt embedding 缓存的字节预算，0 表示关闭
+PROMPT_CACHE_MAX_BYTES = int(os.environ.get("PROMPT_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+
+# 冷启动时若校验清单仍然有效，则跳过所有目录修复和诊断流程
+USE_LOAD_MANIFEST = os.environ.get("USE_LOAD_MANIFEST", "1") == "1"
+
+# 加载前检查模型目录，直接选择可行的加载策略 (关闭后按原顺序逐个尝试)
+USE_PREFLIGHT = os.environ.get("USE_PREFLIGHT", "1") == "1"
+LOAD_STRATEGY_NAMES = [
+    STRATEGY_SNAPSHOT,
+    STRATEGY_MMAP,
+    STRATEGY_LOW_MEM_FP16,
+    STRATEGY_FP16,
+    STRATEGY_NO_VARIANT,
+    STRATEGY_FP16_VARIANT,
+    STRATEGY_NO_SAFETENSORS,
+    STRATEGY_ALLOW_DOWNLOAD
+]
+
+# 有 safetensors 文件时用 mmap 逐组件加载权重 (失败时退回 from_pretrained 策略)
+USE_MMAP_LOADER = os.environ.get("USE_MMAP_LOADER", "1") == "1"
+# 模型目录中有 snapshot.py 导出的单文件快照时优先从快照加载
+USE_SNAPSHOT = os.environ.get("USE_SNAPSHOT", "1") == "1"
+# mmap / 快照加载时并发读取组件的线程数 (1 表示逐个加载)
+LOAD_WORKERS = int(os.environ.get("LOAD_WORKERS", "4"))
+
+# 本地权重缓存目录 (容器本地磁盘，留空表示关闭)：加载成功后在后台把网络卷上的模型
+# 复制过来并校验，之后的冷启动直接从本地副本加载 (见 weight_cache.py)
+WEIGHT_CACHE_DIR = os.environ.get("WEIGHT_CACHE_DIR", "")
+# 缓存总大小上限，超过时按最近使用时间淘汰其它模型版本
+WEIGHT_CACHE_MAX_GB = float(os.environ.get("WEIGHT_CACHE_MAX_GB", "40"))
+# auto / hardlink / reflink / copy
+WEIGHT_CACHE_LINK_MODE = os.environ.get("WEIGHT_CACHE_LINK_MODE", "auto")
+
+# 用 torch.compile 编译 UNet，编译产物按 (模型指纹, torch 版本, dtype, 分辨率桶) 缓存在卷上
+COMPILE_UNET = os.environ.get("COMPILE_UNET", "0") == "1"
+COMPILE_CACHE_DIR = os.environ.get("COMPILE_CACHE_DIR", "/runpod-volume/torch-compile-cache")
+COMPILE_MODE = os.environ.get("COMPILE_MODE", "max-autotune-no-cudagraphs")
+
+# zygote 模式 (仅 CPU)：父进程加载一次模型后 fork 出 ZYGOTE_WORKERS 个 worker，
+# 子进程写时复制共享权重，异常退出时由 supervisor 重启 (0 或 1 表示关闭)
+ZYGOTE_WORKERS = int(os.environ.get("ZYGOTE_WORKERS", "0"))
+ZYGOTE_MAX_RESTARTS = int(os.environ.get("ZYGOTE_MAX_RESTARTS", "5"))
+# 每个子进程的 torch 线程数，0 表示平分 CPU 核数
+ZYGOTE_THREADS_PER_WORKER = int(os.environ.get("ZYGOTE_THREADS_PER_WORKER", "0"))
+
+# Prometheus 文本格式的 metrics 端点 (/metrics, /metrics.json)，0 表示关闭；
+# zygote 子进程依次使用 METRICS_PORT + 1 + 序号
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+
+# seed 固定的请求的结果缓存：内存层字节预算 (0 表示关闭内存层)
+RESULT_CACHE_MAX_MB = int(os.environ.get("RESULT_CACHE_MAX_MB", "256"))
+# 磁盘层目录 (建议放在网络卷上，多个 worker 共享；留空表示关闭) 和大小上限
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "")
+RESULT_CACHE_DISK_MAX_GB = float(os.environ.get("RESULT_CACHE_DISK_MAX_GB", "10"))
+
+# 自适应步数：相邻两步 latent 的相对变化连续 ADAPTIVE_PATIENCE 步低于阈值后结束去噪
+# (见 adaptive_steps.py)。请求可以用 adaptive_steps / adaptive_threshold 覆盖
+ADAPTIVE_STEPS = os.environ.get("ADAPTIVE_STEPS", "0") == "1"
+ADAPTIVE_THRESHOLD = float(os.environ.get("ADAPTIVE_THRESHOLD", "0.02"))
+# 至少运行的步数和连续低于阈值的步数
+ADAPTIVE_MIN_STEPS = int(os.environ.get("ADAPTIVE_MIN_STEPS", "10"))
+ADAPTIVE_PATIENCE = int(os.environ.get("ADAPTIVE_PATIENCE", "2"))
+# extrapolate (Euler 上沿最后一步导数外推到 x0) / stop (直接解码当前 latent)
+ADAPTIVE_MODE = os.environ.get("ADAPTIVE_MODE", "extrapolate")
+
+# 把收到的请求追加到该 JSONL 文件，供 replay.py 回放 (留空表示不录制)
+CAPTURE_TRAFFIC_PATH = os.environ.get("CAPTURE_TRAFFIC_PATH", "")
+
+# 加载后的预热模式: skip / encode / unet / full / background (见 warmup.py)
+WARMUP_MODE = os.environ.get("WARMUP_MODE", "unet")
+# 需要预热的服务分辨率，例如 "1024x1024,832x1216"；留空时只在 64x64 上检查
+WARMUP_RESOLUTIONS = parse_resolutions(os.environ.get("WARMUP_RESOLUTIONS", ""))
+
+# 流式 handler：逐步返回进度事件和每 STREAM_PREVIEW_EVERY 步一张 latent 预览 (0 为关闭)
+STREAMING = os.environ.get("STREAMING", "0") == "1"
+STREAM_PREVIEW_EVERY = int(os.environ.get("STREAM_PREVIEW_EVERY", "5"))
+
+# 回收策略: always / never / every_n / watermark / idle (见 memory_policy.py)
+MEMORY_POLICY = os.environ.get("MEMORY_POLICY", "watermark")
+MEMORY_CLEANUP_EVERY_N = int(os.environ.get("MEMORY_CLEANUP_EVERY_N", "50"))
+# 请求结束后占用 (CUDA reserved 或 CPU RSS) 超过该比例才回收
+MEMORY_WATERMARK = float(os.environ.get("MEMORY_WATERMARK", "0.9"))
+MEMORY_IDLE_SECONDS = float(os.environ.get("MEMORY_IDLE_SECONDS", "5"))
+
+# 默认采样器 (见 schedulers.SAMPLERS)，请求可以用 sampler / use_karras_sigmas 覆盖
+DEFAULT_SAMPLER = os.environ.get("SAMPLER", "euler")
+
+# 异步任务队列：同时接收多个任务，按 priority / deadline_ms 调度 (见 job_queue.py)
+ASYNC_QUEUE = os.environ.get("ASYNC_QUEUE", "0") == "1"
+JOB_QUEUE_CONCURRENCY = int(os.environ.get("JOB_QUEUE_CONCURRENCY", "8"))
+# 为赶截止时间降级时的最低步数
+JOB_MIN_STEPS = int(os.environ.get("JOB_MIN_STEPS", "8"))
+# 耗时估算的初始值 (每步每百万像素秒数)，运行中按实际耗时更新
+JOB_SECONDS_PER_STEP_MP = float(os.environ.get("JOB_SECONDS_PER_STEP_MP", "0.25"))
+
+# 图像后处理 (np -> PIL -> 编码) 线程数，0 表示在推理线程中直接编码
+POSTPROCESS_WORKERS = int(os.environ.get("POSTPROCESS_WORKERS", "2"))
+# 未完成的后处理任务上限，达到后推理线程等待 (背压)
+POSTPROCESS_MAX_PENDING = int(os.environ.get("POSTPROCESS_MAX_PENDING", "8"))
+
+# 分辨率分桶：把请求尺寸吸附到固定的 SDXL 分辨率桶，并复用每个桶的 latent 缓冲区
+RESOLUTION_BUCKETING = os.environ.get("RESOLUTION_BUCKETING", "0") == "1"
+RESOLUTION_BUCKETS = parse_resolutions(os.environ.get("RESOLUTION_BUCKETS", "")) or SDXL_BUCKETS
+# 生成后如何还原为请求尺寸: none (直接返回桶尺寸) / crop / resize，请求可用 bucket_fit 覆盖
+BUCKET_FIT = os.environ.get("BUCKET_FIT", "none")
+
+# 单张输出超过该像素数时使用分块 VAE 解码 (0 表示从不分块)，默认 1536x1536
+VAE_TILING_PIXELS = int(os.environ.get("VAE_TILING_PIXELS", str(1536 * 1536)))
+# 分块边长 (像素，0 表示使用 VAE 配置的 sample_size) 和相邻块重叠比例
+VAE_TILE_SIZE = int(os.environ.get("VAE_TILE_SIZE", "0"))
+VAE_TILE_OVERLAP = float(os.environ.get("VAE_TILE_OVERLAP", "0.25"))
+
 # Global pipeline variable
 pipeline = None
 
+# 当前 pipeline 的采样器注册表 (load_model() 中创建)
+scheduler_registry = None
+
+# 串行化对 pipeline 的调用 (后台预热与请求、并发 handler 之间)
+pipeline_lock = threading.RLock()
+
+# 最近一次预热的模式和耗时
+warmup_stats = {}
+
+# 最近一次 load_model() 的耗时和所用加载策略
+load_stats = {}
+
+# 最近一次 UNet 编译的结果 (每个分辨率桶来自缓存还是重新编译)
+compile_stats = {}
+
+# 微批处理器 (首次使用时创建)
+batcher = None
+_batcher_lock = threading.Lock()
+
+# 异步任务队列 (首次使用时创建)
+job_queue = None
+
+# Prompt embedding 缓存 (text_encoder + text_encoder_2 的输出)
+prompt_cache = PromptEmbeddingCache(PROMPT_CACHE_MAX_BYTES) if PROMPT_CACHE_MAX_BYTES > 0 else None
+
+# 每个分辨率桶的 latent 噪声缓冲区 (仅分桶模式)
+latent_pool = LatentPool() if RESOLUTION_BUCKETING else None
+
+# 大尺寸输出的分块 VAE
+vae_tiling = VaeTiling(VAE_TILING_PIXELS, VAE_TILE_SIZE, VAE_TILE_OVERLAP) if VAE_TILING_PIXELS > 0 else None
+
+# 网络卷前面的本地权重缓存
+weight_cache = (
+    WeightCache(WEIGHT_CACHE_DIR, WEIGHT_CACHE_MAX_GB * 2 ** 30, WEIGHT_CACHE_LINK_MODE) if WEIGHT_CACHE_DIR else None
+)
+
+# 图像后处理线程池
+postprocess_pool = (
+    PostProcessPool(POSTPROCESS_WORKERS, POSTPROCESS_MAX_PENDING) if POSTPROCESS_WORKERS > 0 else None
+)
+
+# 自适应步数节省的去噪步骤
+adaptive_stats = AdaptiveStepStats()
+
+# 确定性请求的结果缓存
+result_cache = (
+    ResultCache(RESULT_CACHE_MAX_MB * 2 ** 20, RESULT_CACHE_DIR, RESULT_CACHE_DISK_MAX_GB * 2 ** 30)
+    if RESULT_CACHE_MAX_MB > 0 or RESULT_CACHE_DIR else None
+)
+
+# 线上流量录制
+traffic_recorder = TrafficRecorder(CAPTURE_TRAFFIC_PATH) if CAPTURE_TRAFFIC_PATH else None
+
+# 请求后的 gc / empty_cache 回收策略
+memory_policy = MemoryPolicy(
+    MEMORY_POLICY,
+    device=DEVICE,
+    every_n=MEMORY_CLEANUP_EVERY_N,
+    watermark=MEMORY_WATERMARK,
+    idle_seconds=MEMORY_IDLE_SECONDS
+)
+
 def check_and_fix_model_index():
     """检查并修复 model_index.json 中的 None 值"""
     model_index_path = os.path.join(MODEL_PATH, "model_index.json")
@@ -116,21 +333,9 @@ def create_missing_configs():
         },
         
         "scheduler/scheduler_config.json": {
-            "_class_name": "EulerDiscreteScheduler",
+            "_class_name": DEFAULT_SCHEDULER_CLASS,
             "_diffusers_version": "0.21.0",
-            "beta_end": 0.012,
-            "beta_schedule": "scaled_linear",
-            "beta_start": 0.00085,
-            "clip_sample": False,
-            "num_train_timesteps": 1000,
-            "prediction_type": "epsilon",
-            "sample_max_value": 1.0,
-            "set_alpha_to_one": False,
-            "skip_prk_steps": True,
-            "steps_offset": 1,
-            "timestep_spacing": "leading",
-            "trained_betas": None,
-            "use_karras_sigmas": False
+            **BASE_SCHEDULER_CONFIG
         }
     }
     
@@ -274,24 +479,11 @@ def fix_config_none_values():
             with open(scheduler_config_path, 'r') as f:
                 config = json.load(f)
             
-            # 检查关键参数
-            critical_params = {
-                "num_train_timesteps": 1000,
-                "beta_start": 0.00085,
-                "beta_end": 0.012,
-                "beta_schedule": "scaled_linear",
-                "prediction_type": "epsilon",
-                "clip_sample": False,
-                "set_alpha_to_one": False,
-                "steps_offset": 1,
-                "timestep_spacing": "leading",
-                "skip_prk_steps": True,
-                "use_karras_sigmas": False,
-                "sample_max_value": 1.0
-            }
-            
+            # 检查关键参数 (默认值为 None 的参数本身允许为 None)
             fixes_applied = []
-            for key, default_value in critical_params.items():
+            for key, default_value in BASE_SCHEDULER_CONFIG.items():
+                if default_value is None:
+                    continue
                 if key not in config or config[key] is None:
                     config[key] = default_value
                     fixes_applied.append(key)
@@ -347,21 +539,8 @@ def fix_config_none_values():
             except Exception as e:
                 logger.warning(f"⚠️ 修复 {component} 配置失败: {e}")
 
-def load_model():
-    """Load the PhotonicFusion SDXL model from RunPod volume"""
-    global pipeline
-    
-    logger.info(f"Using device: {DEVICE}")
-    logger.info(f"📁 Loading model from: {MODEL_PATH}")
-    
-    # 首先修复配置文件中的 None 值
-    fix_config_none_values()
-    
-    # 然后诊断并修复模型结构
-    if not diagnose_volume_structure():
-        raise RuntimeError(f"❌ Volume模型结构检查失败")
-    
-    # 检查tokenizer文件，如果缺失关键文件，尝试自动修复
+def ensure_tokenizer_files():
+    """检查tokenizer文件，如果缺失关键文件，尝试自动修复"""
     try:
         from transformers import CLIPTokenizer
         
@@ -415,63 +594,166 @@ def load_model():
                         
     except Exception as e:
         logger.error(f"❌ Tokenizer文件检查失败: {e}")
+
+def build_load_strategies():
+    """加载策略，按 preflight.STRATEGY_* 名称排列
+
+    STRATEGY_SNAPSHOT 的参数交给 snapshot.load_snapshot()，STRATEGY_MMAP 的参数交给
+    mmap_loader.load_pipeline_mmap()，其余交给 from_pretrained。
+    """
+    strategies = [
+        # 快照: 单文件 fp16 权重 + 合并配置
+        {
+            "torch_dtype": torch.float16 if DEVICE == "cuda" else torch.float32,
+            "device": DEVICE
+        },
+        # 策略0: mmap 逐组件加载 safetensors
+        {
+            "torch_dtype": torch.float16 if DEVICE == "cuda" else torch.float32,
+            "variant": "fp16" if DEVICE == "cuda" else None,
+            "device": DEVICE
+        },
+        # 策略1: 低内存模式 + FP16
+        {
+            "torch_dtype": torch.float16 if DEVICE == "cuda" else torch.float32,
+            "variant": "fp16" if DEVICE == "cuda" else None,
+            "use_safetensors": True,
+            "local_files_only": True,
+            "safety_checker": None,
+            "requires_safety_checker": False,
+            "low_cpu_mem_usage": True,
+            "device_map": "auto" if DEVICE == "cuda" else None
+        },
+        # 策略2: 标准FP16加载（原策略1）
+        {
+            "torch_dtype": torch.float16 if DEVICE == "cuda" else torch.float32,
+            "variant": "fp16" if DEVICE == "cuda" else None,
+            "use_safetensors": True,
+            "local_files_only": True,
+            "safety_checker": None,
+            "requires_safety_checker": False
+        },
+        # 策略3: 不指定variant
+        {
+            "torch_dtype": torch.float16 if DEVICE == "cuda" else torch.float32,
+            "use_safetensors": True,
+            "local_files_only": True,
+            "safety_checker": None,
+            "requires_safety_checker": False,
+            "low_cpu_mem_usage": True
+        },
+        # 策略3b: 只有 fp16 变体的 safetensors (CPU 上按 float32 加载)
+        {
+            "torch_dtype": torch.float16 if DEVICE == "cuda" else torch.float32,
+            "variant": "fp16",
+            "use_safetensors": True,
+            "local_files_only": True,
+            "safety_checker": None,
+            "requires_safety_checker": False,
+            "low_cpu_mem_usage": True
+        },
+        # 策略4: 不使用safetensors
+        {
+            "torch_dtype": torch.float16 if DEVICE == "cuda" else torch.float32,
+            "local_files_only": True,
+            "safety_checker": None,
+            "requires_safety_checker": False
+        },
+        # 策略5: 允许网络下载缺失组件
+        {
+            "torch_dtype": torch.float16 if DEVICE == "cuda" else torch.float32,
+            "use_safetensors": True,
+            "safety_checker": None,
+            "requires_safety_checker": False,
+            "local_files_only": False,
+            "low_cpu_mem_usage": True
+        }
+    ]
+    return [
+        (name, strategy) for name, strategy in zip(LOAD_STRATEGY_NAMES, strategies)
+        if (USE_MMAP_LOADER or name != STRATEGY_MMAP) and (USE_SNAPSHOT or name != STRATEGY_SNAPSHOT)
+    ]
+
+def compile_resolutions():
+    """需要编译的分辨率: 分桶模式下为所有桶，否则为预热分辨率 (未配置时 1024x1024)"""
+    if RESOLUTION_BUCKETING:
+        return RESOLUTION_BUCKETS
+    return WARMUP_RESOLUTIONS or [(1024, 1024)]
+
+def load_model():
+    """Load the PhotonicFusion SDXL model from RunPod volume"""
+    global pipeline, scheduler_registry
+    
+    load_start = time.perf_counter()
+    # 每个加载阶段的耗时: [{"stage", "name", "seconds", "ok"}]，同时进入 metrics 直方图
+    load_timings = []
+    
+    def _record(stage, name, seconds, ok=True):
+        load_timings.append({"stage": stage, "name": name, "seconds": round(seconds, 4), "ok": ok})
+        metrics.observe_load(stage, seconds, name=name, outcome="ok" if ok else "error")
+    
+    logger.info(f"Using device: {DEVICE}")
+    logger.info(f"📁 Loading model from: {MODEL_PATH}")
+    
+    # 校验清单仍然有效时，一次 stat 扫描即可确认目录未被修改，跳过修复流程
+    manifest = load_manifest(MODEL_PATH) if USE_LOAD_MANIFEST else None
+    if validate_manifest(MODEL_PATH, manifest):
+        logger.info("⚡ 校验清单匹配，跳过配置修复和目录诊断")
+    else:
+        manifest = None
+        
+        # 首先修复配置文件中的 None 值
+        fix_config_none_values()
+        
+        # 然后诊断并修复模型结构
+        if not diagnose_volume_structure():
+            raise RuntimeError(f"❌ Volume模型结构检查失败")
+        
+        # 检查tokenizer文件，如果缺失关键文件，尝试自动修复
+        ensure_tokenizer_files()
+    
+    # 本地缓存中有与清单一致的副本时从本地磁盘加载，否则从网络卷加载
+    load_path = MODEL_PATH
+    if weight_cache is not None and manifest is not None:
+        cached_path = weight_cache.lookup(manifest)
+        if cached_path is not None:
+            load_path = cached_path
+            logger.info(f"💾 使用本地权重缓存: {load_path}")
     
     try:
         # Load the pipeline with comprehensive error handling
         logger.info("🔄 Loading StableDiffusionXLPipeline...")
         
-        # 尝试不同的加载策略
+        # 没有导出快照时不尝试快照策略
+        has_snapshot = os.path.isfile(os.path.join(load_path, SNAPSHOT_CONFIG_PATH))
         load_strategies = [
-            # 策略1: 低内存模式 + FP16
-            {
-                "torch_dtype": torch.float16 if DEVICE == "cuda" else torch.float32,
-                "variant": "fp16" if DEVICE == "cuda" else None,
-                "use_safetensors": True,
-                "local_files_only": True,
-                "safety_checker": None,
-                "requires_safety_checker": False,
-                "low_cpu_mem_usage": True,
-                "device_map": "auto" if DEVICE == "cuda" else None
-            },
-            # 策略2: 标准FP16加载（原策略1）
-            {
-                "torch_dtype": torch.float16 if DEVICE == "cuda" else torch.float32,
-                "variant": "fp16" if DEVICE == "cuda" else None,
-                "use_safetensors": True,
-                "local_files_only": True,
-                "safety_checker": None,
-                "requires_safety_checker": False
-            },
-            # 策略3: 不指定variant
-            {
-                "torch_dtype": torch.float16 if DEVICE == "cuda" else torch.float32,
-                "use_safetensors": True,
-                "local_files_only": True,
-                "safety_checker": None,
-                "requires_safety_checker": False,
-                "low_cpu_mem_usage": True
-            },
-            # 策略4: 不使用safetensors
-            {
-                "torch_dtype": torch.float16 if DEVICE == "cuda" else torch.float32,
-                "local_files_only": True,
-                "safety_checker": None,
-                "requires_safety_checker": False
-            },
-            # 策略5: 允许网络下载缺失组件
-            {
-                "torch_dtype": torch.float16 if DEVICE == "cuda" else torch.float32,
-                "use_safetensors": True,
-                "safety_checker": None,
-                "requires_safety_checker": False,
-                "local_files_only": False,
-                "low_cpu_mem_usage": True
-            }
+            (name, strategy) for name, strategy in build_load_strategies()
+            if name != STRATEGY_SNAPSHOT or has_snapshot
         ]
+        strategy_names = [name for name, _ in load_strategies]
+        
+        # 确定性选择加载策略：优先使用清单中记录的成功策略，其次由 preflight 检查目录决定；
+        # 依次尝试其余策略只作为最后手段
+        first_choice, choice_source = None, None
+        if USE_PREFLIGHT:
+            cached = (manifest or {}).get("load_strategy") or {}
+            if cached.get("device") == DEVICE and cached.get("name") in strategy_names:
+                first_choice, choice_source = cached["name"], "manifest"
+            else:
+                preflight_start = time.perf_counter()
+                report = inspect_model_dir(load_path)
+                first_choice = choose_strategy(report, DEVICE, USE_MMAP_LOADER, USE_SNAPSHOT)
+                choice_source = "preflight"
+                logger.info(f"🧭 Preflight 检查耗时 {time.perf_counter() - preflight_start:.3f}s, 缺失组件: {report['missing'] or '无'}")
+            logger.info(f"🧭 选定加载策略: {first_choice} (来源: {choice_source})")
+            load_strategies.sort(key=lambda item: item[0] != first_choice)
         
         last_error = None
-        for i, strategy in enumerate(load_strategies, 1):
-            logger.info(f"🔄 尝试加载策略 {i}/{len(load_strategies)}...")
+        load_strategy_info = None
+        mmap_stats = None
+        for i, (strategy_name, strategy) in enumerate(load_strategies, 1):
+            logger.info(f"🔄 尝试加载策略 {i}/{len(load_strategies)} ({strategy_name})...")
+            attempt_start = time.perf_counter()
             
             # Suppress stderr temporarily to hide warnings
             import sys
@@ -481,10 +763,21 @@ def load_model():
             sys.stderr = StringIO()
             
             try:
-                pipeline = StableDiffusionXLPipeline.from_pretrained(
-                    MODEL_PATH,
-                    **strategy
-                )
+                if strategy_name == STRATEGY_SNAPSHOT:
+                    pipeline, mmap_stats = load_snapshot(
+                        load_path, StableDiffusionXLPipeline, workers=LOAD_WORKERS, **strategy
+                    )
+                elif strategy_name == STRATEGY_MMAP:
+                    pipeline, mmap_stats = load_pipeline_mmap(
+                        load_path, StableDiffusionXLPipeline, workers=LOAD_WORKERS, **strategy
+                    )
+                else:
+                    pipeline = StableDiffusionXLPipeline.from_pretrained(
+                        load_path,
+                        **strategy
+                    )
+                    # from_pretrained 会随机初始化权重文件中缺失的张量，不能静默接受
+                    check_weights_complete(pipeline, load_path, strategy.get("variant"))
                 
                 # 检查并修复 meta tensors
                 logger.info(f"🔍 检查 meta tensors...")
@@ -510,7 +803,16 @@ def load_model():
                 else:
                     logger.info(f"✅ 未发现 meta tensors")
                 
-                logger.info(f"✅ 策略 {i} 成功!")
+                attempt_seconds = time.perf_counter() - attempt_start
+                _record("strategy", strategy_name, attempt_seconds)
+                load_strategy_info = {
+                    "name": strategy_name,
+                    "device": DEVICE,
+                    "seconds": round(attempt_seconds, 3),
+                    "attempts": i,
+                    "source": choice_source if i == 1 else "fallback"
+                }
+                logger.info(f"✅ 策略 {i} ({strategy_name}) 成功! 耗时 {attempt_seconds:.2f}s")
                 break
                 
             except Exception as e:
@@ -526,8 +828,13 @@ def load_model():
                     logger.warning(f"⚠️ 策略 {i} 失败 (device): {error_msg[:150]}...")
                 else:
                     logger.warning(f"⚠️ 策略 {i} 失败: {error_msg[:150]}...")
+                logger.info(f"⏱️ 策略 {i} ({strategy_name}) 耗时 {time.perf_counter() - attempt_start:.2f}s")
+                _record("strategy", strategy_name, time.perf_counter() - attempt_start, ok=False)
                 
                 pipeline = None
+                # 组件权重文件本身不完整时换策略也无济于事
+                if isinstance(e, MissingWeightsError) and strategy_name != STRATEGY_SNAPSHOT:
+                    break
                 
             finally:
                 # Restore stderr
@@ -536,8 +843,9 @@ def load_model():
         if pipeline is None:
             raise RuntimeError(f"所有加载策略都失败了。最后错误: {last_error}")
         
-        # Configure scheduler
-        pipeline.scheduler = EulerDiscreteScheduler.from_config(pipeline.scheduler.config)
+        # Configure scheduler: 所有采样器都从模型自带的 scheduler 配置构建
+        scheduler_registry = SchedulerRegistry(pipeline.scheduler.config, default=DEFAULT_SAMPLER)
+        pipeline.scheduler = scheduler_registry.get(DEFAULT_SAMPLER)
         
         # Move to device with meta tensor handling
         logger.info(f"🔄 Moving pipeline to {DEVICE}...")
@@ -552,6 +860,7 @@ def load_model():
             for component_name in components:
                 component = getattr(pipeline, component_name, None)
                 if component is not None:
+                    move_start = time.perf_counter()
                     try:
                         logger.info(f"   🔄 Moving {component_name} to {DEVICE}...")
                         
@@ -573,9 +882,11 @@ def load_model():
                             setattr(pipeline, component_name, component)
                         
                         logger.info(f"   ✅ {component_name} moved successfully")
+                        _record("move", component_name, time.perf_counter() - move_start)
                         
                     except Exception as e:
                         logger.warning(f"   ⚠️ Failed to move {component_name}: {e}")
+                        _record("move", component_name, time.perf_counter() - move_start, ok=False)
                         # If individual component fails, try to continue with others
                         continue
             
@@ -605,17 +916,61 @@ def load_model():
             except:
                 logger.info("ℹ️ XFormers not available")
         
-        # Test the model
-        logger.info("🧪 Testing model...")
-        test_result = pipeline(
-            prompt="test",
-            num_inference_steps=1,
-            width=64,
-            height=64,
-            output_type="pil"
-        )
+        # 预热 / 检查模型 (background 模式在 worker 开始接收任务后继续进行)
+        logger.info(f"🧪 Warming up model (mode={WARMUP_MODE})...")
+        if WARMUP_MODE == "background":
+            start_background_warmup(pipeline, WARMUP_RESOLUTIONS, pipeline_lock, warmup_stats)
+        else:
+            warmup_stats.clear()
+            warmup_stats.update(run_warmup(pipeline, WARMUP_MODE, WARMUP_RESOLUTIONS, pipeline_lock))
+            _record("warmup", WARMUP_MODE, warmup_stats["seconds"], ok=warmup_stats.get("status") == "ok")
+        
+        if latent_pool is not None:
+            for bucket_width, bucket_height in RESOLUTION_BUCKETS:
+                latent_pool.preallocate(
+                    pipeline, bucket_width, bucket_height, max_images_per_call(bucket_width, bucket_height)
+                )
+            logger.info(f"🪣 已为 {len(RESOLUTION_BUCKETS)} 个分辨率桶预分配 latent 缓冲区")
         
         logger.info("✅ Model loaded and tested successfully!")
+        load_stats.clear()
+        load_stats.update({
+            "seconds": round(time.perf_counter() - load_start, 3),
+            "source": "local_cache" if load_path != MODEL_PATH else "volume",
+            "strategy": load_strategy_info,
+            "components": mmap_stats and mmap_stats["components"],
+            "component_load": mmap_stats and {"workers": mmap_stats["workers"], "seconds": mmap_stats["seconds"]},
+            "warmup": warmup_stats,
+            "timings": load_timings
+        })
+        
+        # 加载成功后记录校验清单和成功的加载策略，下次冷启动可跳过修复流程和策略试错
+        if USE_LOAD_MANIFEST:
+            if manifest is None:
+                manifest = write_manifest(MODEL_PATH, extra={"load_strategy": load_strategy_info})
+            elif (manifest.get("load_strategy") or {}).get("name") != load_strategy_info["name"]:
+                update_manifest(MODEL_PATH, manifest, load_strategy=load_strategy_info)
+        
+        # 从网络卷加载时在后台填充本地缓存 (需要清单中的文件列表和哈希)
+        if weight_cache is not None and manifest is not None and load_path == MODEL_PATH:
+            weight_cache.populate_in_background(MODEL_PATH, manifest)
+        
+        # 结果缓存的模型指纹 (与编译缓存相同)
+        pipeline._model_digest = model_digest(manifest, pipeline.unet)
+        
+        # 编译放在写入清单之后，首次冷启动和之后的冷启动使用同一个模型指纹
+        if COMPILE_UNET:
+            compile_stats.clear()
+            compile_stats.update(compile_unet(
+                pipeline,
+                COMPILE_CACHE_DIR,
+                pipeline._model_digest,
+                compile_resolutions(),
+                COMPILE_MODE,
+                pipeline_lock
+            ))
+            _record("compile", COMPILE_MODE, compile_stats["seconds"], ok=compile_stats["status"] == "compiled")
+        
         return pipeline
         
     except Exception as e:
@@ -628,18 +983,8 @@ def load_model():
         
         raise RuntimeError(f"Failed to load model from volume: {e}")
 
-def generate_image(prompt, negative_prompt="", num_inference_steps=20, guidance_scale=7.0, 
-                  width=1024, height=1024, seed=None):
-    """Generate an image using the loaded pipeline"""
-    global pipeline
-    
-    # Load model if not already loaded
-    if pipeline is None:
-        pipeline = load_model()
-    
-    logger.info(f"🎨 Generating image with prompt: {prompt[:50]}...")
-    
-    # 验证和修复参数
+def normalize_params(num_inference_steps=20, guidance_scale=7.0, width=1024, height=1024):
+    """验证和修复生成参数，返回 (steps, guidance, width, height)"""
     if num_inference_steps is None or num_inference_steps <= 0:
         num_inference_steps = 20
         logger.warning(f"⚠️ 修复 num_inference_steps: {num_inference_steps}")
@@ -657,98 +1002,705 @@ def generate_image(prompt, negative_prompt="", num_inference_steps=20, guidance_
         logger.warning(f"⚠️ 修复 height: {height}")
     
     # 确保尺寸是 8 的倍数（SDXL 要求）
-    width = (width // 8) * 8
-    height = (height // 8) * 8
+    width = (int(width) // 8) * 8
+    height = (int(height) // 8) * 8
     
-    # Set seed for reproducibility
-    if seed is not None:
-        try:
-            generator = torch.Generator(device=DEVICE).manual_seed(int(seed))
-        except (ValueError, TypeError):
+    return int(num_inference_steps), float(guidance_scale), width, height
+
+def make_generator(seed):
+    """根据 seed 创建 torch.Generator，无效或缺失时返回 None"""
+    if seed is None:
+        return None
+    try:
+        return torch.Generator(device=DEVICE).manual_seed(int(seed))
+    except (ValueError, TypeError):
+        logger.warning(f"⚠️ 无效的 seed 值: {seed}，使用随机种子")
+        return None
+
+def derive_seeds(seed, count):
+    """从基础 seed 派生每张图像的 seed (seed, seed+1, ...)，缺失或无效时随机选取基础 seed"""
+    try:
+        base = int(seed)
+    except (ValueError, TypeError):
+        if seed is not None:
             logger.warning(f"⚠️ 无效的 seed 值: {seed}，使用随机种子")
-            generator = None
-    else:
-        generator = None
+        base = random.randint(0, 2**32 - 1)
+    return [(base + i) % 2**32 for i in range(count)]
+
+def max_images_per_call(width, height):
+    """根据像素预算和当前可用显存计算单次 pipeline 调用最多生成的图像数"""
+    pixels = max(1, width * height)
+    limit = MAX_BATCH_PIXELS // pixels
+    
+    if DEVICE == "cuda":
+        try:
+            free_bytes, _ = torch.cuda.mem_get_info()
+            limit = min(limit, int(free_bytes * 0.8) // (pixels * BYTES_PER_PIXEL))
+        except Exception as e:
+            logger.warning(f"⚠️ 无法读取显存信息: {e}")
+    
+    return max(1, limit)
+
+def encode_images(images, seeds, output_options=None, trace=None):
+    """按请求的输出参数编码一组图像 (np 数组或 PIL)，返回 [{"image"/"path", "seed", ...}, ...]
+
+    trace 是请求的 metrics.RequestTrace，各编码阶段的耗时会记录到上面。
+    """
+    options = dict(output_options or {})
+    output_path = options.pop("output_path", None)
+    fit = options.pop("fit", None)
+    results = []
+    with metrics.activate(trace):
+        for i, (image, s) in enumerate(zip(images, seeds)):
+            with metrics.stage("pil_convert"):
+                image = to_pil(image)
+            if fit is not None:
+                with metrics.stage("fit"):
+                    image = fit_to_size(image, fit["width"], fit["height"], fit["mode"])
+            results.append(
+                {**encode_output(image, output_path=indexed_path(output_path, i, len(images)), **options), "seed": s}
+            )
+    return results
+
+def encode_images_async(images, seeds, output_options=None, trace=None):
+    """把 encode_images() 交给后处理线程池，返回 Future (未启用线程池时直接返回结果)"""
+    if postprocess_pool is None:
+        return encode_images(images, seeds, output_options, trace)
+    return postprocess_pool.submit(encode_images, images, seeds, output_options, trace)
+
+def run_pipeline(prompts, negative_prompts, seeds, num_inference_steps, guidance_scale, width, height,
+                 callback=None, sampler=None, karras_sigmas=False, adaptive_threshold=None, return_steps=False):
+    """按显存预算分块调用 pipeline，每个样本使用自己的 seed，返回按顺序排列的图像
+
+    pipeline 以 output_type="np" 输出 float 数组，转为 PIL 的工作留给后处理线程
+    (encode_images())。
+
+    当一个分块内 prompt/negative_prompt 都相同时，直接把数量作为
+    num_images_per_prompt 交给 pipeline，prompt 只编码一次。启用 prompt 缓存时
+    以预先计算好的 embeddings 调用 pipeline，跳过文本编码器。callback 会作为
+    callback_on_step_end 在每个去噪步骤后调用。sampler 为 None 时使用 DEFAULT_SAMPLER。
+    adaptive_threshold 不为 None 时 latent 收敛后提前结束去噪 (见 adaptive_steps.py)。
+    return_steps 为 True 时返回 (图像, 实际运行的步数)，多个分块时按图像数加权平均。
+
+    各阶段耗时记录到 metrics 中 (以及当前线程激活的 RequestTrace)。
+    """
+    global pipeline
+    
+    if pipeline is None:
+        pipeline = load_model()
+    
+    chunk_size = max_images_per_call(width, height)
+    if len(prompts) > chunk_size:
+        logger.info(f"✂️ {len(prompts)} 张图像超出单次预算，拆分为每批 {chunk_size} 张")
+    
+    images = []
+    image_steps = 0
+    # 是否在请求后执行 gc / empty_cache 由 MEMORY_POLICY 决定 (见 memory_policy.py)
+    with memory_policy.track():
+        for start in range(0, len(prompts), chunk_size):
+            chunk_prompts = prompts[start:start + chunk_size]
+            chunk_negatives = negative_prompts[start:start + chunk_size]
+            generators = [make_generator(s) for s in seeds[start:start + chunk_size]]
+            
+            if len(set(chunk_prompts)) == 1 and len(set(chunk_negatives)) == 1:
+                prompt_kwargs = {
+                    "prompt": chunk_prompts[0],
+                    "negative_prompt": chunk_negatives[0],
+                    "num_images_per_prompt": len(chunk_prompts)
+                }
+            else:
+                prompt_kwargs = {"prompt": chunk_prompts, "negative_prompt": chunk_negatives}
+            
+            if prompt_cache is not None and hasattr(pipeline, "encode_prompt"):
+                unique = "num_images_per_prompt" in prompt_kwargs
+                with pipeline_lock, metrics.stage("text_encoding"):
+                    embeds = cached_prompt_embeds(
+                        prompt_cache,
+                        pipeline,
+                        chunk_prompts[:1] if unique else chunk_prompts,
+                        chunk_negatives[:1] if unique else chunk_negatives
+                    )
+                prompt_kwargs.pop("prompt")
+                prompt_kwargs.pop("negative_prompt")
+                prompt_kwargs.update(embeds)
+            
+            monitor = None
+            if adaptive_threshold is not None:
+                monitor = ConvergenceMonitor(
+                    num_inference_steps, adaptive_threshold, ADAPTIVE_MIN_STEPS, ADAPTIVE_PATIENCE, ADAPTIVE_MODE,
+                    inner=callback
+                )
+            step_timer = metrics.StepTimer(monitor.callback if monitor is not None else callback)
+            prompt_kwargs["callback_on_step_end"] = step_timer.callback
+            
+            with pipeline_lock, torch.no_grad():
+                metrics.instrument_text_encoders(pipeline)
+                if scheduler_registry is not None:
+                    pipeline.scheduler = scheduler_registry.get(sampler, karras_sigmas)
+                if vae_tiling is not None and getattr(pipeline, "vae", None) is not None:
+                    vae_tiling.configure(pipeline.vae, width, height, len(chunk_prompts))
+                if latent_pool is not None and hasattr(pipeline, "unet") and None not in generators:
+                    prompt_kwargs["latents"] = latent_pool.acquire(pipeline, width, height, generators)
+                with step_timer:
+                    result = pipeline(
+                        **prompt_kwargs,
+                        num_inference_steps=num_inference_steps,
+                        guidance_scale=guidance_scale,
+                        width=width,
+                        height=height,
+                        generator=generators,
+                        output_type="np"
+                    )
+            if monitor is not None:
+                adaptive_stats.record(monitor)
+            image_steps += len(chunk_prompts) * (monitor.steps_run if monitor is not None else num_inference_steps)
+            images.extend(result.images)
+    
+    if return_steps:
+        return images, image_steps / max(1, len(prompts))
+    return images
+
+def generate_images(prompt, negative_prompt="", num_inference_steps=20, guidance_scale=7.0,
+                    width=1024, height=1024, seed=None, num_images_per_prompt=1, output_options=None,
+                    callback=None, sampler=None, use_karras_sigmas=False, adaptive_threshold=None, trace=None):
+    """为同一个 prompt 生成多张图像，返回 [{"image": base64, "seed": int}, ...]
+
+    output_options 见 output_encoding.parse_output_options()，默认输出 base64 PNG。
+    adaptive_threshold 不为 None 时启用自适应步数。
+    trace 是可选的 metrics.RequestTrace，用于收集本请求的分阶段耗时。
+    """
+    logger.info(f"🎨 Generating {num_images_per_prompt} image(s) with prompt: {str(prompt)[:50]}...")
+    
+    # 验证和修复参数
+    num_inference_steps, guidance_scale, width, height = normalize_params(
+        num_inference_steps, guidance_scale, width, height
+    )
+    count = max(1, int(num_images_per_prompt or 1))
+    seeds = derive_seeds(seed, count)
     
-    logger.info(f"📊 参数: steps={num_inference_steps}, guidance={guidance_scale}, size={width}x{height}")
+    logger.info(f"📊 参数: steps={num_inference_steps}, guidance={guidance_scale}, size={width}x{height}, images={count}")
     
     try:
-        # Generate image
-        with torch.no_grad():
-            result = pipeline(
-                prompt=str(prompt) if prompt is not None else "",
-                negative_prompt=str(negative_prompt) if negative_prompt is not None else "",
-                num_inference_steps=int(num_inference_steps),
-                guidance_scale=float(guidance_scale),
-                width=int(width),
-                height=int(height),
-                generator=generator
+        prompt = str(prompt) if prompt is not None else ""
+        negative_prompt = str(negative_prompt) if negative_prompt is not None else ""
+        with metrics.activate(trace):
+            images = run_pipeline(
+                [prompt] * count, [negative_prompt] * count, seeds,
+                num_inference_steps, guidance_scale, width, height, callback,
+                sampler=sampler, karras_sigmas=use_karras_sigmas, adaptive_threshold=adaptive_threshold
             )
         
-        # Convert to base64
-        image = result.images[0]
-        buffered = BytesIO()
-        image.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+        results = resolve(encode_images_async(images, seeds, output_options, trace))
+        logger.info(f"✅ Generated {len(results)} image(s) successfully!")
+        return results
         
-        # Cleanup
-        gc.collect()
-        if DEVICE == "cuda":
-            torch.cuda.empty_cache()
+    except Exception as e:
+        logger.error(f"❌ Image generation failed: {e}")
+        raise
+
+def generate_image(prompt, negative_prompt="", num_inference_steps=20, guidance_scale=7.0, 
+                  width=1024, height=1024, seed=None):
+    """Generate an image using the loaded pipeline"""
+    return generate_images(
+        prompt, negative_prompt, num_inference_steps, guidance_scale, width, height, seed
+    )[0]["image"]
+
+def generate_batch(requests):
+    """一次 pipeline 调用为多个请求生成图像
+
+    requests 中的每一项是 dict (prompt, negative_prompt, seed, num_images_per_prompt, output_options，
+    可选的 trace)，
+    并共享 num_inference_steps / guidance_scale / width / height / sampler / use_karras_sigmas /
+    adaptive_threshold。返回与 requests
+    等长的列表，每项是该请求的 [{"image": base64, "seed": int}, ...]。启用后处理线程池时
+    每项是对应的 Future (用 postprocess.resolve() 取值)，本批次编码的同时下一批已经开始去噪。
+    """
+    first = requests[0]
+    num_inference_steps, guidance_scale, width, height = normalize_params(
+        first["num_inference_steps"], first["guidance_scale"], first["width"], first["height"]
+    )
+    
+    traces = [r.get("trace") for r in requests]
+    now = time.perf_counter()
+    for trace in traces:
+        if trace is not None and trace.enqueued_at is not None:
+            with metrics.activate(trace):
+                metrics.observe("queue_wait", now - trace.enqueued_at)
+    
+    # 展开为逐样本列表：每张图像对应一个 prompt / negative_prompt / seed
+    prompts, negative_prompts, seeds, counts = [], [], [], []
+    for r in requests:
+        count = max(1, int(r.get("num_images_per_prompt") or 1))
+        request_seeds = derive_seeds(r.get("seed"), count)
+        prompts += [str(r["prompt"]) if r["prompt"] is not None else ""] * count
+        negative_prompts += [str(r["negative_prompt"]) if r["negative_prompt"] is not None else ""] * count
+        seeds += request_seeds
+        counts.append(count)
+    
+    logger.info(f"🎨 批量生成 {len(requests)} 个请求 / {len(prompts)} 张图像: steps={num_inference_steps}, guidance={guidance_scale}, size={width}x{height}")
+    
+    try:
+        # 共享的去噪阶段记到批内每个请求上
+        with metrics.activate(*traces):
+            images = run_pipeline(
+                prompts, negative_prompts, seeds, num_inference_steps, guidance_scale, width, height,
+                sampler=first.get("sampler"), karras_sigmas=first.get("use_karras_sigmas", False),
+                adaptive_threshold=first.get("adaptive_threshold")
+            )
+        
+        # 按请求拆分结果，每个请求使用自己的输出参数编码
+        results, offset = [], 0
+        for r, count in zip(requests, counts):
+            results.append(encode_images_async(
+                images[offset:offset + count], seeds[offset:offset + count], r.get("output_options"), r.get("trace")
+            ))
+            offset += count
         
-        logger.info("✅ Image generated successfully!")
-        return img_str
+        logger.info(f"✅ 批量去噪完成: {len(images)} 张图像")
+        return results
         
     except Exception as e:
-        logger.error(f"❌ Image generation failed: {e}")
+        logger.error(f"❌ Batch generation failed: {e}")
         raise
 
+def get_batcher():
+    """获取 (必要时创建) 全局微批处理器"""
+    global batcher
+    
+    with _batcher_lock:
+        if batcher is None:
+            batcher = MicroBatcher(generate_batch, max_batch_size=MAX_BATCH_SIZE, window_ms=BATCH_WINDOW_MS)
+            logger.info(f"📦 微批处理已启用: max_batch_size={MAX_BATCH_SIZE}, window={BATCH_WINDOW_MS}ms")
+    return batcher
+
+def _queued_generate(params):
+    """任务队列的 GPU 阶段：只做去噪，返回 (图像, seeds, 实际运行的步数)"""
+    count = params["num_images_per_prompt"]
+    seeds = derive_seeds(params["seed"], count)
+    prompt = str(params["prompt"])
+    negative_prompt = str(params["negative_prompt"]) if params["negative_prompt"] is not None else ""
+    trace = params.get("trace")
+    with metrics.activate(trace):
+        if trace is not None and trace.enqueued_at is not None:
+            metrics.observe("queue_wait", time.perf_counter() - trace.enqueued_at)
+        images, steps_run = run_pipeline(
+            [prompt] * count, [negative_prompt] * count, seeds,
+            params["num_inference_steps"], params["guidance_scale"], params["width"], params["height"],
+            sampler=params["sampler"], karras_sigmas=params["use_karras_sigmas"],
+            adaptive_threshold=params.get("adaptive_threshold"), return_steps=True
+        )
+    return images, seeds, steps_run
+
+def _queued_encode(params, rendered):
+    """任务队列的 CPU 阶段：编码图像并组装返回结果"""
+    images, seeds, _ = rendered
+    return build_response(params, encode_images(images, seeds, params["output_options"], params.get("trace")))
+
+def get_job_queue():
+    """获取 (必要时创建) 全局异步任务队列"""
+    global job_queue
+    
+    if job_queue is None:
+        job_queue = JobQueue(
+            _queued_generate,
+            _queued_encode,
+            min_steps=JOB_MIN_STEPS,
+            cost_model=StepCostModel(seconds_per_step_mp=JOB_SECONDS_PER_STEP_MP),
+            steps_run=lambda rendered: rendered[2]
+        )
+        logger.info(f"📥 异步任务队列已启用: concurrency={JOB_QUEUE_CONCURRENCY}, min_steps={JOB_MIN_STEPS}")
+    return job_queue
+
+def concurrency_modifier(current_concurrency):
+    """RunPod 并发控制：开启合批时允许 worker 同时接收 MAX_BATCH_SIZE 个任务"""
+    if ASYNC_QUEUE:
+        return max(1, JOB_QUEUE_CONCURRENCY)
+    return max(1, MAX_BATCH_SIZE)
+
+def get_stats():
+    """汇总各子系统的运行统计 (handler 的 stats action)"""
+    return {
+        "batching": batcher.stats() if batcher is not None else None,
+        "prompt_cache": prompt_cache.stats() if prompt_cache is not None else None,
+        "load": load_stats or None,
+        "warmup": warmup_stats or None,
+        "memory": memory_policy.stats(),
+        "schedulers": scheduler_registry.stats() if scheduler_registry is not None else None,
+        "job_queue": job_queue.stats() if job_queue is not None else None,
+        "postprocess": postprocess_pool.stats() if postprocess_pool is not None else None,
+        "buckets": latent_pool.stats() if latent_pool is not None else None,
+        "vae_tiling": vae_tiling.stats() if vae_tiling is not None else None,
+        "weight_cache": weight_cache.stats() if weight_cache is not None else None,
+        "result_cache": result_cache.stats() if result_cache is not None else None,
+        "adaptive_steps": adaptive_stats.stats(),
+        "compile": compile_stats or None,
+        "zygote": zygote.worker_info()
+    }
+
+def _parse_number(name, value, cast):
+    """把数值参数转换为 int / float (None 保持不变，由 normalize_params() 修复)，无效时抛出 ValueError"""
+    if value is None:
+        return None
+    try:
+        return cast(value)
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid {name}: {value}")
+
+def parse_request(input_data):
+    """解析并校验生成请求参数，无效时抛出 ValueError"""
+    prompt = input_data.get('prompt', '')
+    if not prompt:
+        raise ValueError("Prompt is required")
+    
+    num_images_per_prompt = input_data.get('num_images_per_prompt', 1)
+    try:
+        num_images_per_prompt = int(num_images_per_prompt or 1)
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid num_images_per_prompt: {num_images_per_prompt}")
+    if not 1 <= num_images_per_prompt <= MAX_IMAGES_PER_REQUEST:
+        raise ValueError(f"num_images_per_prompt must be between 1 and {MAX_IMAGES_PER_REQUEST}")
+    
+    # OutputOptionsError 是 ValueError 的子类
+    output_options = parse_output_options(input_data)
+    
+    use_karras_sigmas = bool(input_data.get('use_karras_sigmas', False))
+    sampler = validate_sampler(input_data.get('sampler'), use_karras_sigmas, DEFAULT_SAMPLER)
+    
+    # None 表示关闭自适应步数
+    adaptive_threshold = None
+    if bool(input_data.get('adaptive_steps', ADAPTIVE_STEPS)):
+        adaptive_threshold = validate_threshold(input_data.get('adaptive_threshold', ADAPTIVE_THRESHOLD))
+    
+    num_inference_steps = _parse_number('num_inference_steps', input_data.get('num_inference_steps', 20), int)
+    guidance_scale = _parse_number('guidance_scale', input_data.get('guidance_scale', 7.0), float)
+    width = _parse_number('width', input_data.get('width', 1024), int)
+    height = _parse_number('height', input_data.get('height', 1024), int)
+    if RESOLUTION_BUCKETING:
+        width, height = apply_bucket(width, height, input_data.get('bucket_fit', BUCKET_FIT), output_options)
+    
+    return {
+        "prompt": prompt,
+        "negative_prompt": input_data.get('negative_prompt', ''),
+        "num_inference_steps": num_inference_steps,
+        "guidance_scale": guidance_scale,
+        "width": width,
+        "height": height,
+        "seed": input_data.get('seed', None),
+        "num_images_per_prompt": num_images_per_prompt,
+        "output_options": output_options,
+        "sampler": sampler,
+        "use_karras_sigmas": use_karras_sigmas,
+        "adaptive_threshold": adaptive_threshold
+    }
+
+def apply_bucket(width, height, fit_mode, output_options):
+    """把请求尺寸吸附到最近的分辨率桶，返回桶的 (width, height)
+
+    fit_mode 不是 none 且尺寸有变化时，在 output_options["fit"] 中记录请求尺寸，
+    编码前把图像裁剪 / 缩放回去。
+    """
+    fit_mode = str(fit_mode or "none").lower()
+    if fit_mode not in FIT_MODES:
+        raise ValueError(f"Unsupported bucket_fit: {fit_mode} (expected one of {list(FIT_MODES)})")
+    try:
+        _, _, width, height = normalize_params(20, 7.0, int(width), int(height))
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid size: {width}x{height}")
+    
+    bucket_width, bucket_height = nearest_bucket(width, height, RESOLUTION_BUCKETS)
+    if fit_mode != "none" and (bucket_width, bucket_height) != (width, height):
+        output_options["fit"] = {"width": width, "height": height, "mode": fit_mode}
+    return bucket_width, bucket_height
+
+def build_response(params, images):
+    """组装 handler 的返回结果 (width/height 是返回图像的实际尺寸)"""
+    fit = params["output_options"].get("fit")
+    return {
+        "image": images[0].get("image"),
+        "images": images,
+        "output_format": params["output_options"]["output_format"],
+        "prompt": params["prompt"],
+        "negative_prompt": params["negative_prompt"],
+        "num_inference_steps": params["num_inference_steps"],
+        "guidance_scale": params["guidance_scale"],
+        "width": fit["width"] if fit else params["width"],
+        "height": fit["height"] if fit else params["height"],
+        "bucket": f"{params['width']}x{params['height']}" if RESOLUTION_BUCKETING else None,
+        "seed": images[0]["seed"],
+        "num_images_per_prompt": params["num_images_per_prompt"],
+        "sampler": params["sampler"],
+        "use_karras_sigmas": params["use_karras_sigmas"],
+        "adaptive_threshold": params.get("adaptive_threshold")
+    }
+
+def result_cache_key(params):
+    """seed 固定的请求的结果缓存键；未启用缓存、模型未加载或请求不可缓存时返回 None"""
+    if result_cache is None or pipeline is None:
+        return None
+    digest = getattr(pipeline, "_model_digest", None)
+    if digest is None:
+        # 没有经过 load_model() 的 pipeline (例如测试替身)：只在本进程内有效的随机标识
+        digest = pipeline._model_digest = uuid.uuid4().hex
+    unet = getattr(pipeline, "unet", None)
+    model = fingerprint(
+        model=digest,
+        scheduler=scheduler_registry.base_config if scheduler_registry is not None else None,
+        dtype=getattr(unet, "dtype", None),
+        device=DEVICE,
+        compiled=compile_stats.get("status"),
+        vae_tiling=[VAE_TILING_PIXELS, VAE_TILE_SIZE, VAE_TILE_OVERLAP] if vae_tiling is not None else None,
+        adaptive=(
+            [ADAPTIVE_MIN_STEPS, ADAPTIVE_PATIENCE, ADAPTIVE_MODE] if params.get("adaptive_threshold") is not None else None
+        ),
+        torch=torch.__version__
+    )
+    steps, guidance, width, height = normalize_params(
+        params["num_inference_steps"], params["guidance_scale"], params["width"], params["height"]
+    )
+    return request_key(
+        {**params, "num_inference_steps": steps, "guidance_scale": guidance, "width": width, "height": height}, model
+    )
+
+def get_metrics(input_data):
+    """handler 的 metrics action：format 为 prometheus 时返回文本，否则返回 JSON 直方图"""
+    if str(input_data.get('format', 'json')).lower() == 'prometheus':
+        return {"content_type": "text/plain; version=0.0.4", "metrics": metrics.registry.prometheus_text()}
+    return {"metrics": metrics.registry.to_json()}
+
+def finish_trace(trace, result, input_data):
+    """记录请求总耗时；请求带 return_timings 时把分阶段耗时附加到结果中"""
+    metrics.observe("total", time.perf_counter() - trace.created_at)
+    if input_data.get('return_timings') and isinstance(result, dict) and "error" not in result:
+        result["timings"] = trace.to_dict()
+    return result
+
 def handler(event):
-    """RunPod handler function"""
+    """RunPod handler function
+
+    输入带 return_timings: true 时，结果中附加 timings (各阶段耗时，毫秒)。
+    seed 固定的请求命中结果缓存时直接返回已编码的图像，结果中带 cache (memory / disk / inflight)。
+    """
     try:
         input_data = event['input']
+        if traffic_recorder is not None:
+            traffic_recorder.record(input_data)
         
-        prompt = input_data.get('prompt', '')
-        negative_prompt = input_data.get('negative_prompt', '')
-        num_inference_steps = input_data.get('num_inference_steps', 20)
-        guidance_scale = input_data.get('guidance_scale', 7.0)
-        width = input_data.get('width', 1024)
-        height = input_data.get('height', 1024)
-        seed = input_data.get('seed', None)
-        
-        if not prompt:
-            return {"error": "Prompt is required"}
-        
-        # Generate image
-        image_base64 = generate_image(
-            prompt=prompt,
-            negative_prompt=negative_prompt,
-            num_inference_steps=num_inference_steps,
-            guidance_scale=guidance_scale,
-            width=width,
-            height=height,
-            seed=seed
-        )
+        if input_data.get('action') == 'stats':
+            return get_stats()
+        if input_data.get('action') == 'metrics':
+            return get_metrics(input_data)
         
-        return {
-            "image": image_base64,
-            "prompt": prompt,
-            "negative_prompt": negative_prompt,
-            "num_inference_steps": num_inference_steps,
-            "guidance_scale": guidance_scale,
-            "width": width,
-            "height": height,
-            "seed": seed
-        }
+        trace = metrics.RequestTrace()
+        try:
+            with metrics.activate(trace), metrics.stage("validation"):
+                params = parse_request(input_data)
+        except ValueError as e:
+            return {"error": str(e)}
+        
+        def _render():
+            # 自适应步数按批内所有图像的收敛情况结束，合批会让结果取决于同批的其它请求，
+            # 因此自适应请求不合批 (seed 固定时结果可复现，可以进入结果缓存)
+            if MAX_BATCH_SIZE > 1 and params["adaptive_threshold"] is None:
+                # 合批 key：只有这些参数完全一致的请求才能共享一次去噪循环
+                steps, guidance, batch_width, batch_height = normalize_params(
+                    params["num_inference_steps"], params["guidance_scale"], params["width"], params["height"]
+                )
+                trace.enqueued_at = time.perf_counter()
+                return resolve(get_batcher().submit(
+                    (steps, guidance, batch_width, batch_height, params["sampler"], params["use_karras_sigmas"]),
+                    {
+                        **params,
+                        "num_inference_steps": steps,
+                        "guidance_scale": guidance,
+                        "width": batch_width,
+                        "height": batch_height,
+                        "trace": trace
+                    },
+                    size=params["num_images_per_prompt"]
+                ))
+            # Generate images
+            return generate_images(**params, trace=trace)
+        
+        cache_key = result_cache_key(params)
+        if cache_key is None:
+            images, source = _render(), None
+        else:
+            images, source = result_cache.get_or_compute(cache_key, _render)
+        
+        response = build_response(params, images)
+        if source not in (None, "computed"):
+            response["cache"] = source
+        return finish_trace(trace, response, input_data)
+        
+    except Exception as e:
+        logger.error(f"❌ Handler error: {e}")
+        return {"error": str(e)}
+
+async def handler_async(event):
+    """RunPod 异步 handler：任务进入优先级队列，按 priority / deadline_ms 调度
+
+    输入额外支持 priority (越大越优先，默认 0) 和 deadline_ms (从收到任务起算)。
+    赶不上截止时间的任务会降低步数，仍然赶不上则直接返回错误。
+    """
+    input_data = event['input']
+    if traffic_recorder is not None:
+        traffic_recorder.record(input_data)
+    
+    if input_data.get('action') == 'stats':
+        return get_stats()
+    if input_data.get('action') == 'metrics':
+        return get_metrics(input_data)
+    
+    trace = metrics.RequestTrace()
+    try:
+        with metrics.activate(trace), metrics.stage("validation"):
+            params = parse_request(input_data)
+        priority = int(input_data.get('priority', 0) or 0)
+        deadline_ms = input_data.get('deadline_ms')
+        deadline_ms = float(deadline_ms) if deadline_ms is not None else None
         
+        # 排队和降级需要确定的步数 / 尺寸
+        steps, guidance, width, height = normalize_params(
+            params["num_inference_steps"], params["guidance_scale"], params["width"], params["height"]
+        )
+        params.update(num_inference_steps=steps, guidance_scale=guidance, width=width, height=height)
+        cache_key = result_cache_key(params)
+    except (ValueError, TypeError) as e:
+        return {"error": str(e)}
+    
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + deadline_ms / 1000 if deadline_ms is not None else None
+    
+    job = {}
+    
+    async def _render():
+        trace.enqueued_at = time.perf_counter()
+        job["result"], job["info"] = await get_job_queue().submit({**params, "trace": trace}, priority, deadline)
+        # 降级过步数的结果与请求的参数不一致，不缓存
+        if job["info"].get("downgraded_from_steps") is not None:
+            return None, 0.0
+        return job["result"]["images"], job["info"]["gpu_ms"] / 1000
+    
+    try:
+        if cache_key is None:
+            await _render()
+            source = None
+        else:
+            # 缓存查找 / 写入 (可能在网络卷上) 在线程池中执行，相同请求只生成一次
+            images, source = await result_cache.get_or_compute_async(cache_key, _render)
+    except DeadlineError as e:
+        logger.warning(f"⏰ 拒绝任务: {e}")
+        return {"error": str(e), "rejected": True}
     except Exception as e:
         logger.error(f"❌ Handler error: {e}")
         return {"error": str(e)}
+    
+    if source not in (None, "computed"):
+        return finish_trace(trace, {**build_response(params, images), "cache": source}, input_data)
+    
+    result = job["result"]
+    result["queue"] = job["info"]
+    return finish_trace(trace, result, input_data)
+
+def handler_stream(event):
+    """RunPod 流式 handler：逐步产出进度事件、可选的 latent 预览，最后产出结果
+
+    输入额外支持 preview_every (每 N 步一张预览，0 为关闭) 和 preview_size。
+    流式请求不经过微批处理，每个请求有自己的步骤回调。自适应步数提前结束时，
+    最后一个进度事件的 step 小于 total。
+    """
+    input_data = event['input']
+    if traffic_recorder is not None:
+        traffic_recorder.record(input_data)
+    
+    if input_data.get('action') == 'stats':
+        yield {"type": "stats", **get_stats()}
+        return
+    if input_data.get('action') == 'metrics':
+        yield {"type": "metrics", **get_metrics(input_data)}
+        return
+    
+    trace = metrics.RequestTrace()
+    try:
+        with metrics.activate(trace), metrics.stage("validation"):
+            params = parse_request(input_data)
+        steps, _, _, _ = normalize_params(
+            params["num_inference_steps"], params["guidance_scale"], params["width"], params["height"]
+        )
+        streamer = StepStreamer(
+            steps,
+            preview_every=int(input_data.get('preview_every', STREAM_PREVIEW_EVERY) or 0),
+            preview_size=int(input_data.get('preview_size', 256))
+        )
+    except (ValueError, TypeError) as e:
+        yield {"type": "error", "error": str(e)}
+        return
+    
+    def _generate(streamer):
+        images = generate_images(**params, callback=streamer.callback, trace=trace)
+        return finish_trace(trace, build_response(params, images), input_data)
+    
+    yield from stream_generation(_generate, streamer)
+
+def start_metrics_server():
+    """METRICS_PORT 非 0 时启动 metrics HTTP 端点 (zygote 子进程各用一个端口)"""
+    if METRICS_PORT <= 0:
+        return None
+    worker = zygote.worker_info()
+    port = METRICS_PORT + 1 + worker["index"] if worker is not None else METRICS_PORT
+    try:
+        return metrics.start_server(port)
+    except OSError as e:
+        logger.warning(f"⚠️ 无法启动 metrics 端点 (端口 {port}): {e}")
+        return None
+
+def start_worker():
+    """按配置的模式启动 RunPod worker (阻塞)"""
+    start_metrics_server()
+    if STREAMING:
+        logger.info("📡 流式模式: 逐步返回进度和预览")
+        runpod.serverless.start({
+            "handler": handler_stream,
+            "concurrency_modifier": concurrency_modifier,
+            "return_aggregate_stream": True
+        })
+    elif ASYNC_QUEUE:
+        logger.info("📥 异步队列模式: 按优先级和截止时间调度任务")
+        runpod.serverless.start({"handler": handler_async, "concurrency_modifier": concurrency_modifier})
+    else:
+        runpod.serverless.start({"handler": handler, "concurrency_modifier": concurrency_modifier})
+
+def zygote_ready_check():
+    """子进程就绪检查：跑一次文本编码器，确认继承的 pipeline 在子进程中可用"""
+    if pipeline is not None:
+        run_warmup(pipeline, "encode", lock=pipeline_lock)
+
+def run_zygote(parent_load_s):
+    """fork ZYGOTE_WORKERS 个子进程运行 worker，并在父进程中监控 (阻塞)"""
+    threads = ZYGOTE_THREADS_PER_WORKER or max(1, (os.cpu_count() or 1) // ZYGOTE_WORKERS)
+    # 后台预热持有 pipeline_lock 时 fork，子进程中的锁将永远无法释放
+    while warmup_stats.get("status") == "running":
+        time.sleep(0.1)
+    supervisor = zygote.Supervisor(
+        start_worker,
+        workers=ZYGOTE_WORKERS,
+        ready_check=zygote_ready_check,
+        parent_load_s=parent_load_s,
+        max_restarts=ZYGOTE_MAX_RESTARTS,
+        threads_per_worker=threads
+    )
+    logger.info(f"🧬 zygote 模式: {ZYGOTE_WORKERS} 个 worker, 每个 {threads} 线程")
+    try:
+        supervisor.run()
+    finally:
+        supervisor.stop()
+        logger.info(f"🧬 zygote 统计: {json.dumps(supervisor.stats())}")
 
 if __name__ == "__main__":
     logger.info("🚀 Starting RunPod serverless worker...")
     
     # Pre-load the model for faster first request
+    load_start = time.perf_counter()
     try:
         load_model()
         logger.info("✅ Model pre-loaded successfully!")
@@ -756,4 +1708,9 @@ if __name__ == "__main__":
         logger.error(f"❌ Model pre-load failed: {e}")
     
     # Start the RunPod worker
-    runpod.serverless.start({"handler": handler}) 
\ No newline at end of file
+    if ZYGOTE_WORKERS > 1 and DEVICE == "cpu" and pipeline is not None:
+        run_zygote(round(time.perf_counter() - load_start, 3))
+    else:
+        if ZYGOTE_WORKERS > 1:
+            logger.warning("⚠️ zygote 模式只支持已成功加载模型的 CPU worker，使用单进程模式")
+        start_worker()
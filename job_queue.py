@@ -0,0 +1,303 @@
+"""
+asyncio 任务队列：优先级 + 截止时间调度
+
+worker 可以同时接收多个任务 (async handler)，任务按 (优先级, 截止时间, 到达顺序)
+排队，由一个消费协程逐个交给 GPU 线程执行。GPU 阶段结束后，PNG/base64 编码等
+CPU 工作交给独立的线程池，消费协程立即开始下一个任务的去噪，两者重叠执行。
+prompt 编码留在 GPU 阶段：文本编码器与 UNet 在同一设备上运行，单独成为一个阶段
+也无法与去噪重叠。
+
+带截止时间的任务在入队和出队时都会按 StepCostModel 估算完成时间：赶不上时先
+降低步数 (不低于 min_steps)，仍然赶不上则直接拒绝 (DeadlineError)，不浪费 GPU
+时间在注定超时的任务上。
+
+LocalJobSource 是 RunPod 任务源的本地替身，用于在没有 RunPod 服务时测试。
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineError(Exception):
+    """任务无法在截止时间前完成 (即使降低步数)"""
+
+
+class StepCostModel:
+    """估算一次生成的 GPU 耗时: overhead + steps * 百万像素 * 每步每百万像素秒数
+
+    seconds_per_step_mp 用实际观测值的指数滑动平均更新。
+    """
+
+    def __init__(self, seconds_per_step_mp=0.25, overhead_s=0.5, alpha=0.2):
+        self.seconds_per_step_mp = seconds_per_step_mp
+        self.overhead_s = overhead_s
+        self.alpha = alpha
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _megapixels(width, height, count=1):
+        return width * height * count / 1e6
+
+    def estimate(self, steps, width, height, count=1):
+        return self.overhead_s + steps * self._megapixels(width, height, count) * self.seconds_per_step_mp
+
+    def max_steps_within(self, budget_s, width, height, count=1):
+        """budget_s 秒内最多能跑几步"""
+        per_step = self._megapixels(width, height, count) * self.seconds_per_step_mp
+        if per_step <= 0:
+            return math.inf
+        return int((budget_s - self.overhead_s) // per_step)
+
+    def observe(self, steps, width, height, count, seconds):
+        work = steps * self._megapixels(width, height, count)
+        if work <= 0:
+            return
+        sample = max(0.0, seconds - self.overhead_s) / work
+        with self._lock:
+            self.seconds_per_step_mp += self.alpha * (sample - self.seconds_per_step_mp)
+
+
+class _Job:
+    __slots__ = ("params", "priority", "deadline", "seq", "future", "enqueued", "downgraded_from")
+
+    def __init__(self, params, priority, deadline, seq, future, enqueued):
+        self.params = params
+        self.priority = priority
+        self.deadline = deadline
+        self.seq = seq
+        self.future = future
+        self.enqueued = enqueued
+        self.downgraded_from = None
+
+    def sort_key(self):
+        # 优先级高的先执行；同优先级按截止时间，最后按到达顺序
+        deadline = self.deadline if self.deadline is not None else math.inf
+        return (-self.priority, deadline, self.seq)
+
+    def __lt__(self, other):
+        return self.sort_key() < other.sort_key()
+
+
+class JobQueue:
+    """按优先级 / 截止时间调度任务
+
+    run_gpu(params) 在单个 GPU 线程中执行，返回中间结果；
+    run_cpu(params, intermediate) 在 CPU 线程池中执行，返回最终结果。
+    params 需要包含 num_inference_steps / width / height / num_images_per_prompt。
+    steps_run(intermediate) 可选，返回 GPU 阶段实际运行的步数 (自适应步数提前结束时少于
+    计划步数)，耗时模型按实际步数更新；未提供时使用计划步数。
+    """
+
+    def __init__(self, run_gpu, run_cpu, min_steps=8, cost_model=None, cpu_workers=2, steps_run=None):
+        self.run_gpu = run_gpu
+        self.run_cpu = run_cpu
+        self.steps_run = steps_run
+        self.min_steps = min_steps
+        self.cost_model = cost_model or StepCostModel()
+
+        self._gpu_executor = ThreadPoolExecutor(1, thread_name_prefix="job-gpu")
+        self._cpu_executor = ThreadPoolExecutor(cpu_workers, thread_name_prefix="job-cpu")
+        self._heap = []
+        self._seq = itertools.count()
+        self._loop = None
+        self._wakeup = None
+        self._consumer = None
+        self._running = None
+        self._running_started = None
+
+        self._submitted = 0
+        self._completed = 0
+        self._rejected = 0
+        self._downgraded = 0
+        self._max_depth = 0
+        # 出队的任务数及其排队等待总时长 (提交时就被拒绝的任务不计入)
+        self._dequeued = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _ensure_consumer(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._consumer = loop.create_task(self._consume())
+
+    def _estimate(self, job):
+        p = job.params
+        return self.cost_model.estimate(
+            p["num_inference_steps"], p["width"], p["height"], p.get("num_images_per_prompt", 1)
+        )
+
+    def _backlog_before(self, job):
+        """job 开始执行之前预计还要等待的秒数"""
+        backlog = 0.0
+        if self._running is not None:
+            elapsed = self._loop.time() - self._running_started
+            backlog += max(0.0, self._estimate(self._running) - elapsed)
+        backlog += sum(self._estimate(other) for other in self._heap if other < job)
+        return backlog
+
+    def _plan(self, job, start_at):
+        """按截止时间检查任务，必要时降低步数；无法满足时抛出 DeadlineError"""
+        if job.deadline is None:
+            return
+        p = job.params
+        budget = job.deadline - start_at
+        if self._estimate(job) <= budget:
+            return
+
+        steps = self.cost_model.max_steps_within(budget, p["width"], p["height"], p.get("num_images_per_prompt", 1))
+        if steps < self.min_steps:
+            raise DeadlineError(
+                f"Deadline cannot be met: needs ~{self._estimate(job):.1f}s, {max(0.0, budget):.1f}s left"
+            )
+        if job.downgraded_from is None:
+            job.downgraded_from = p["num_inference_steps"]
+        logger.info(f"⏬ 为赶上截止时间，步数 {p['num_inference_steps']} -> {steps}")
+        p["num_inference_steps"] = steps
+
+    async def submit(self, params, priority=0, deadline=None):
+        """提交任务并等待结果
+
+        deadline 是 loop.time() 下的绝对时间 (None 表示没有截止时间)。
+        返回 (result, info)，info 包含排队时间和降级信息。
+        """
+        self._ensure_consumer()
+        loop = self._loop
+        job = _Job(dict(params), int(priority), deadline, next(self._seq), loop.create_future(), loop.time())
+        self._submitted += 1
+
+        try:
+            self._plan(job, loop.time() + self._backlog_before(job))
+        except DeadlineError:
+            self._rejected += 1
+            raise
+
+        heapq.heappush(self._heap, job)
+        self._max_depth = max(self._max_depth, len(self._heap))
+        self._wakeup.set()
+        return await job.future
+
+    async def _consume(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            job = heapq.heappop(self._heap)
+            if job.future.cancelled():
+                continue
+            try:
+                await self._run(job)
+            except Exception as e:
+                # 单个任务出错不能结束唯一的消费协程，否则之后的 submit() 永远等不到结果
+                logger.exception(f"❌ 任务处理失败: {e}")
+                if not job.future.done():
+                    job.future.set_exception(e)
+
+    async def _run(self, job):
+        """处理一个出队的任务：检查截止时间、执行 GPU 阶段，再把 CPU 阶段交给线程池"""
+        loop = self._loop
+        now = loop.time()
+        wait = now - job.enqueued
+        self._dequeued += 1
+        self._total_wait += wait
+        self._max_wait = max(self._max_wait, wait)
+
+        try:
+            # 排队期间可能被更高优先级的任务插队，出队时重新检查截止时间
+            self._plan(job, now)
+        except DeadlineError as e:
+            self._rejected += 1
+            job.future.set_exception(e)
+            return
+        if job.downgraded_from is not None:
+            self._downgraded += 1
+
+        self._running, self._running_started = job, now
+        try:
+            intermediate = await loop.run_in_executor(self._gpu_executor, self.run_gpu, job.params)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+            return
+        finally:
+            seconds = loop.time() - now
+            self._running = None
+
+        p = job.params
+        steps = self.steps_run(intermediate) if self.steps_run is not None else p["num_inference_steps"]
+        self.cost_model.observe(steps, p["width"], p["height"], p.get("num_images_per_prompt", 1), seconds)
+        info = {
+            "queue_wait_ms": round(wait * 1000, 2),
+            "gpu_ms": round(seconds * 1000, 2),
+            "steps_run": steps,
+            "priority": job.priority,
+            "downgraded_from_steps": job.downgraded_from,
+        }
+        # CPU 后处理不占用消费协程，下一个任务的 GPU 阶段立即开始
+        loop.create_task(self._finish(job, intermediate, info))
+
+    async def _finish(self, job, intermediate, info):
+        try:
+            result = await self._loop.run_in_executor(self._cpu_executor, self.run_cpu, job.params, intermediate)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+            return
+        self._completed += 1
+        if not job.future.done():
+            job.future.set_result((result, info))
+
+    def close(self):
+        if self._consumer is not None:
+            self._consumer.cancel()
+        self._gpu_executor.shutdown(wait=False)
+        self._cpu_executor.shutdown(wait=False)
+
+    def stats(self):
+        return {
+            "submitted": self._submitted,
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "downgraded": self._downgraded,
+            "depth": len(self._heap),
+            "max_depth": self._max_depth,
+            "avg_queue_wait_ms": round(self._total_wait / self._dequeued * 1000, 2) if self._dequeued else 0.0,
+            "max_queue_wait_ms": round(self._max_wait * 1000, 2),
+            "seconds_per_step_mp": round(self.cost_model.seconds_per_step_mp, 4),
+        }
+
+
+class LocalJobSource:
+    """RunPod 任务源的本地替身
+
+    jobs 是 [{"id", "input", "delay_s"}]：每个任务在 delay_s 秒后到达，并发执行的
+    任务数不超过 concurrency (对应 RunPod 的 concurrency_modifier)。
+    """
+
+    def __init__(self, jobs, concurrency=4):
+        self.jobs = jobs
+        self.concurrency = concurrency
+
+    async def run(self, handler):
+        """把任务交给 async handler，返回按任务顺序排列的 [{"id", "output", "latency_s"}]"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def _one(job):
+            await asyncio.sleep(job.get("delay_s", 0))
+            async with semaphore:
+                start = time.perf_counter()
+                output = await handler({"id": job.get("id"), "input": job["input"]})
+                return {"id": job.get("id"), "output": output, "latency_s": time.perf_counter() - start}
+
+        return await asyncio.gather(*(_one(job) for job in self.jobs))
@@ -0,0 +1,183 @@
+"""
+显存 / 内存回收策略
+
+原实现在每个请求之后都执行 gc.collect() 和 torch.cuda.empty_cache()：前者给每个
+请求加一次完整的 Python GC 停顿，后者把 CUDA 缓存分配器里的空闲块全部还给驱动，
+下一个请求又要重新分配。这里把回收时机做成可配置的策略:
+
+- always:    每个请求后回收 (原行为)
+- never:     从不主动回收
+- every_n:   每 N 个请求回收一次
+- watermark: 请求结束后占用超过阈值 (CUDA reserved / 总显存，CPU 上为 RSS / 总内存) 才回收 (默认)
+- idle:      空闲 idle_seconds 秒且没有进行中的请求时回收
+
+每个请求前后都会记录 allocated/reserved (CUDA) 或 RSS (CPU)，通过 stats() 查看。
+"""
+
+import gc
+import os
+import threading
+import time
+import logging
+import contextlib
+
+import torch
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+MEMORY_POLICIES = ("always", "never", "every_n", "watermark", "idle")
+
+
+def _rss_bytes():
+    """当前进程的 RSS；没有 psutil 时读取 /proc"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _total_ram_bytes():
+    if psutil is not None:
+        return psutil.virtual_memory().total
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def memory_snapshot(device):
+    """CUDA 上返回 allocated/reserved/total，CPU 上返回 rss/total (字节)"""
+    if device == "cuda" and torch.cuda.is_available():
+        return {
+            "allocated": torch.cuda.memory_allocated(),
+            "reserved": torch.cuda.memory_reserved(),
+            "total": torch.cuda.get_device_properties(0).total_memory,
+        }
+    return {"rss": _rss_bytes(), "total": _total_ram_bytes()}
+
+
+def _usage_fraction(snapshot):
+    used = snapshot.get("reserved", snapshot.get("rss"))
+    total = snapshot.get("total")
+    if not used or not total:
+        return 0.0
+    return used / total
+
+
+class MemoryPolicy:
+    """决定何时执行 gc.collect() / torch.cuda.empty_cache()
+
+    用法: with policy.track(): pipeline(...)
+    """
+
+    def __init__(self, mode="watermark", device="cpu", every_n=50, watermark=0.9, idle_seconds=5.0):
+        if mode not in MEMORY_POLICIES:
+            raise ValueError(f"Unknown memory policy: {mode} (expected one of {MEMORY_POLICIES})")
+        self.mode = mode
+        self.device = device
+        self.every_n = max(1, int(every_n))
+        self.watermark = float(watermark)
+        self.idle_seconds = float(idle_seconds)
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._last_finished = time.monotonic()
+        self._idle_timer = None
+
+        self._requests = 0
+        self._since_cleanup = 0
+        self._cleanups = 0
+        self._cleanup_seconds = 0.0
+        self._last = {}
+        self._peak = {}
+
+    @contextlib.contextmanager
+    def track(self):
+        """包裹一次请求：记录前后的内存占用，结束后按策略决定是否回收"""
+        with self._lock:
+            self._in_flight += 1
+        before = memory_snapshot(self.device)
+        try:
+            yield
+        finally:
+            after = memory_snapshot(self.device)
+            with self._lock:
+                self._in_flight -= 1
+                self._requests += 1
+                self._since_cleanup += 1
+                self._last_finished = time.monotonic()
+                self._last = {"before": before, "after": after}
+                for key, value in after.items():
+                    if key != "total" and value is not None:
+                        self._peak[key] = max(self._peak.get(key, 0), value)
+                should_cleanup = self._should_cleanup(after)
+            if should_cleanup:
+                self.cleanup()
+            elif self.mode == "idle":
+                self._arm_idle_timer()
+
+    def _should_cleanup(self, snapshot):
+        if self.mode == "always":
+            return True
+        if self.mode == "every_n":
+            return self._since_cleanup >= self.every_n
+        if self.mode == "watermark":
+            return _usage_fraction(snapshot) >= self.watermark
+        return False
+
+    def _arm_idle_timer(self):
+        with self._lock:
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+            self._idle_timer = threading.Timer(self.idle_seconds, self._on_idle)
+            self._idle_timer.daemon = True
+            self._idle_timer.start()
+
+    def _on_idle(self):
+        with self._lock:
+            self._idle_timer = None
+            idle = (
+                self._in_flight == 0
+                and self._since_cleanup > 0
+                and time.monotonic() - self._last_finished >= self.idle_seconds
+            )
+        if idle:
+            logger.info("🧹 worker 空闲，回收内存")
+            self.cleanup()
+
+    def cleanup(self):
+        """执行一次 gc.collect() + torch.cuda.empty_cache()"""
+        start = time.perf_counter()
+        gc.collect()
+        if self.device == "cuda" and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self._cleanups += 1
+            self._since_cleanup = 0
+            self._cleanup_seconds += seconds
+
+    def close(self):
+        with self._lock:
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+                self._idle_timer = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "requests": self._requests,
+                "cleanups": self._cleanups,
+                "cleanup_ms_total": round(self._cleanup_seconds * 1000, 2),
+                "last": dict(self._last),
+                "peak": dict(self._peak),
+            }
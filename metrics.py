@@ -0,0 +1,331 @@
+"""
+分阶段耗时统计和 metrics 端点
+
+生成路径上的每个阶段 (排队、参数校验、文本编码、每个去噪步骤、VAE 解码、PIL 转换、
+图像编码、base64) 和加载路径上的每个阶段 (每次加载策略尝试、每个组件的设备搬运、
+预热) 都记录到全局的直方图中，可以导出为 Prometheus 文本格式或 JSON。
+
+同时记录到当前线程激活的 RequestTrace 上，得到单个请求的耗时明细。合批时一次
+pipeline 调用服务多个请求，共享阶段 (文本编码、去噪、VAE 解码) 会记到批内每个请求上。
+
+请求可能跨线程执行 (微批处理线程、后处理线程池)，因此 trace 由调用方显式传递并
+用 activate() 在执行线程上激活，而不是依赖 contextvars。
+"""
+
+import bisect
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# 直方图桶上限 (秒)，覆盖单个去噪步骤 (毫秒级) 到冷启动加载 (分钟级)
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)
+
+# 指标族名称
+REQUEST_FAMILY = "sdxl_request_stage_seconds"
+LOAD_FAMILY = "sdxl_load_stage_seconds"
+
+FAMILY_HELP = {
+    REQUEST_FAMILY: "Per-request latency of each generation stage",
+    LOAD_FAMILY: "Latency of each model loading stage",
+}
+
+
+class Histogram:
+    """固定桶的累积直方图 (与 Prometheus histogram 语义一致)"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个是 +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """按桶内线性插值估算分位数，没有样本时返回 None"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            if n and cumulative + n >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(self.max, lower + (upper - lower) * (rank - cumulative) / n)
+            cumulative += n
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else None,
+            "max": round(self.max, 6),
+            "p50": _round(self.quantile(0.5)),
+            "p95": _round(self.quantile(0.95)),
+            "p99": _round(self.quantile(0.99)),
+        }
+
+
+def _round(value):
+    return round(value, 6) if value is not None else None
+
+
+def _label_text(labels):
+    return ",".join(f'{k}="{str(v)}"' for k, v in labels)
+
+
+def _format_le(bound):
+    return "+Inf" if bound is None else repr(float(bound))
+
+
+class MetricsRegistry:
+    """按 (指标族, 标签) 组织的直方图集合，线程安全"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, family, seconds, **labels):
+        key = (family, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(max(0.0, float(seconds)))
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def to_json(self):
+        """{指标族: [{"labels": {...}, "count", "sum", "mean", "max", "p50", "p95", "p99"}]}"""
+        with self._lock:
+            result = {}
+            for (family, labels), histogram in sorted(self._histograms.items()):
+                result.setdefault(family, []).append({"labels": dict(labels), **histogram.snapshot()})
+            return result
+
+    def prometheus_text(self):
+        """Prometheus 文本格式 (text/plain; version=0.0.4)"""
+        lines = []
+        with self._lock:
+            families = {}
+            for (family, labels), histogram in sorted(self._histograms.items()):
+                families.setdefault(family, []).append((labels, histogram))
+            for family, series in families.items():
+                lines.append(f"# HELP {family} {FAMILY_HELP.get(family, family)}")
+                lines.append(f"# TYPE {family} histogram")
+                for labels, histogram in series:
+                    cumulative = 0
+                    for bound, n in zip(list(histogram.buckets) + [None], histogram.counts):
+                        cumulative += n
+                        le = _label_text(labels + (("le", _format_le(bound)),))
+                        lines.append(f"{family}_bucket{{{le}}} {cumulative}")
+                    suffix = f"{{{_label_text(labels)}}}" if labels else ""
+                    lines.append(f"{family}_sum{suffix} {histogram.sum!r}")
+                    lines.append(f"{family}_count{suffix} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+class RequestTrace:
+    """单个请求的耗时明细 (毫秒)
+
+    同名阶段多次出现时累加 (例如分块调用 pipeline)，去噪步骤另外逐步记录。
+    """
+
+    def __init__(self):
+        self.created_at = time.perf_counter()
+        self.enqueued_at = None
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._steps = []
+
+    def add(self, stage, seconds):
+        with self._lock:
+            if stage == "denoise_step":
+                self._steps.append(seconds)
+            self._stages[stage] = self._stages.get(stage, 0.0) + seconds
+
+    def stages(self):
+        with self._lock:
+            return dict(self._stages)
+
+    def to_dict(self):
+        with self._lock:
+            stages = {name: round(seconds * 1000, 3) for name, seconds in self._stages.items()}
+            steps = [round(seconds * 1000, 3) for seconds in self._steps]
+        return {
+            "total_ms": round((time.perf_counter() - self.created_at) * 1000, 3),
+            "stages": stages,
+            "steps_ms": steps,
+        }
+
+
+# 全局注册表
+registry = MetricsRegistry()
+
+_local = threading.local()
+
+
+def _active_traces():
+    return getattr(_local, "traces", ())
+
+
+@contextmanager
+def activate(*traces):
+    """在当前线程上激活 trace (None 会被忽略)，期间记录的请求阶段都会写入这些 trace"""
+    previous = _active_traces()
+    _local.traces = previous + tuple(t for t in traces if t is not None)
+    try:
+        yield
+    finally:
+        _local.traces = previous
+
+
+def observe(stage, seconds, **labels):
+    """记录一个请求阶段的耗时 (全局直方图 + 当前激活的 trace)"""
+    registry.observe(REQUEST_FAMILY, seconds, stage=stage, **labels)
+    for trace in _active_traces():
+        trace.add(stage, seconds)
+
+
+def observe_load(stage, seconds, **labels):
+    """记录一个加载阶段的耗时 (只进入全局直方图，明细由 load_stats 返回)"""
+    registry.observe(LOAD_FAMILY, seconds, stage=stage, **labels)
+
+
+@contextmanager
+def stage(name, **labels):
+    """记录 with 块的耗时；块内抛出异常时不记录"""
+    start = time.perf_counter()
+    yield
+    observe(name, time.perf_counter() - start, **labels)
+
+
+class StepTimer:
+    """包装 callback_on_step_end，记录一次 pipeline 调用内部的各阶段
+
+    - text_encoding: pipeline 内部调用文本编码器的耗时 (由 instrument_text_encoders() 的 hook 上报)
+    - denoise_step:  相邻两次步骤回调之间的耗时，第一步从文本编码结束 (或调用开始) 算起
+    - vae_decode:    最后一次步骤回调到 pipeline 返回 (VAE 解码和后处理)
+
+    用作 with 块包住 pipeline 调用，callback 传给 callback_on_step_end。
+    """
+
+    def __init__(self, inner=None):
+        self.inner = inner
+        self.steps = 0
+        self._last = None
+        self._text_encoding = 0.0
+        self._encoder_depth = 0
+        self._encoder_start = None
+
+    def __enter__(self):
+        self._previous = getattr(_local, "step_timer", None)
+        _local.step_timer = self
+        self._last = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.step_timer = self._previous
+        if exc_type is None and self.steps:
+            observe("vae_decode", time.perf_counter() - self._last)
+        return False
+
+    def _encoder_enter(self):
+        if self._encoder_depth == 0:
+            self._encoder_start = time.perf_counter()
+        self._encoder_depth += 1
+
+    def _encoder_exit(self):
+        self._encoder_depth = max(0, self._encoder_depth - 1)
+        if self._encoder_depth == 0 and self._encoder_start is not None:
+            now = time.perf_counter()
+            self._text_encoding += now - self._encoder_start
+            self._encoder_start = None
+            self._last = now
+
+    def callback(self, pipe, step, timestep, callback_kwargs):
+        now = time.perf_counter()
+        if self.steps == 0 and self._text_encoding:
+            observe("text_encoding", self._text_encoding)
+        observe("denoise_step", now - self._last)
+        self.steps += 1
+        if self.inner is not None:
+            callback_kwargs = self.inner(pipe, step, timestep, callback_kwargs)
+        # 内层回调 (例如流式预览) 的耗时不计入下一步
+        self._last = time.perf_counter()
+        return callback_kwargs
+
+
+def _encoder_pre_hook(module, args):
+    timer = getattr(_local, "step_timer", None)
+    if timer is not None:
+        timer._encoder_enter()
+
+
+def _encoder_post_hook(module, args, output):
+    timer = getattr(_local, "step_timer", None)
+    if timer is not None:
+        timer._encoder_exit()
+
+
+def instrument_text_encoders(pipe):
+    """给文本编码器注册计时 hook (重复调用无副作用)
+
+    hook 只在 StepTimer 激活时计时，pipeline 之外的编码 (prompt 缓存、预热) 不受影响。
+    """
+    for name in ("text_encoder", "text_encoder_2"):
+        module = getattr(pipe, name, None)
+        if module is None or not hasattr(module, "register_forward_pre_hook"):
+            continue
+        if getattr(module, "_stage_timing_hooks", None) is None:
+            module._stage_timing_hooks = (
+                module.register_forward_pre_hook(_encoder_pre_hook),
+                module.register_forward_hook(_encoder_post_hook),
+            )
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body, content_type = registry.prometheus_text().encode(), "text/plain; version=0.0.4; charset=utf-8"
+        elif path == "/metrics.json":
+            body, content_type = json.dumps(registry.to_json()).encode(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port, host="0.0.0.0"):
+    """在后台线程中提供 /metrics (Prometheus) 和 /metrics.json，返回 server"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"📈 metrics 端点: http://{host}:{server.server_address[1]}/metrics")
+    return server
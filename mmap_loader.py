@@ -0,0 +1,255 @@
+"""
+内存映射 (mmap) 的 safetensors 权重加载
+
+from_pretrained() 会先把每个权重文件完整读入主机内存，再整体搬到目标设备。
+这里逐个组件处理：先在 meta 设备上构建不含参数存储的模型骨架，再用 safe_open
+映射 safetensors 文件，逐个张量直接读到目标设备 / dtype，最后用
+load_state_dict(assign=True) 把张量直接作为模型参数，不在主机上保留整份权重的
+额外副本，也不会留下需要 fix_meta_tensors() 修补的 meta 参数。
+
+四个模型组件在线程池中并发加载：文件读取、safetensors 解析和张量拷贝都会释放
+GIL，组件之间互不依赖。只有 meta 骨架的构建和 assign 需要串行：init_empty_weights
+会临时替换全局的 nn.Module.register_parameter，其它线程此时注册的参数 (包括 assign
+时的 setattr) 会被搬到 meta 设备。这两步不拷贝数据，很快。
+
+只支持 diffusers 格式目录中的 safetensors 文件 (含分片索引)；不满足条件时抛出
+异常，由调用方退回 from_pretrained() 策略。权重文件缺少模型需要的张量时抛出
+MissingWeightsError：from_pretrained() 会把缺失的权重随机初始化，退回它没有意义，
+check_weights_complete() 用同样的标准检查 from_pretrained() 加载的 pipeline。比较之前
+先按 from_pretrained() 的规则重命名张量 (diffusers 的旧版注意力权重名、transformers
+的权重重命名和 base_model_prefix)，旧格式的权重文件不会被误判为缺失。
+"""
+
+import importlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from accelerate import init_empty_weights
+from safetensors import safe_open
+
+logger = logging.getLogger(__name__)
+
+# 需要加载权重的组件 (按顺序加载)
+MMAP_COMPONENTS = ["unet", "vae", "text_encoder", "text_encoder_2"]
+
+# 不含权重的组件，用 from_pretrained 加载
+CONFIG_COMPONENTS = ["tokenizer", "tokenizer_2", "scheduler"]
+
+# init_empty_weights() 修改的是全局状态，骨架构建和 assign 必须串行
+_skeleton_lock = threading.Lock()
+
+
+class MissingWeightsError(ValueError):
+    """权重文件缺少模型需要的张量"""
+
+    def __init__(self, name, missing):
+        self.missing = list(missing)
+        super().__init__(f"{name}: missing weights {self.missing[:5]}{'...' if len(self.missing) > 5 else ''}")
+
+
+def safetensors_files(component_path, variant=None):
+    """返回组件目录中应当读取的 safetensors 文件 (分片时按索引返回全部分片)
+
+    指定的 variant 不存在时退回无 variant 的文件 (与 from_pretrained 一致)。
+    """
+    filenames = sorted(os.listdir(component_path))
+    if variant and not any(f".{variant}." in n and ".safetensors" in n for n in filenames):
+        variant = None
+
+    def _matches(name, suffix):
+        if not name.endswith(suffix):
+            return False
+        return (f".{variant}." in name) if variant else (".fp16." not in name)
+
+    indexes = [n for n in filenames if _matches(n, ".safetensors.index.json")]
+    if indexes:
+        with open(os.path.join(component_path, indexes[0])) as f:
+            shards = sorted(set(json.load(f)["weight_map"].values()))
+        return [os.path.join(component_path, shard) for shard in shards]
+
+    files = [n for n in filenames if _matches(n, ".safetensors")]
+    if len(files) != 1:
+        raise FileNotFoundError(
+            f"{component_path}: expected one {variant or 'non-variant'} safetensors file, found {files}"
+        )
+    return [os.path.join(component_path, files[0])]
+
+
+def _component_class(model_index, name):
+    library, class_name = model_index[name]
+    return getattr(importlib.import_module(library), class_name)
+
+
+def _empty_model(cls, config):
+    """在 meta 设备上构建模型骨架 (buffer 仍正常创建)
+
+    config 是组件目录路径，或已经解析好的配置 dict。
+    """
+    with init_empty_weights(include_buffers=False):
+        if hasattr(cls, "load_config"):
+            # diffusers ModelMixin
+            return cls.from_config(cls.load_config(config) if isinstance(config, str) else config)
+        # transformers PreTrainedModel
+        if isinstance(config, str):
+            return cls._from_config(cls.config_class.from_pretrained(config))
+        return cls._from_config(cls.config_class.from_dict(config))
+
+
+def _safe_open_device(device):
+    device = torch.device(device)
+    if device.type == "cuda":
+        return f"cuda:{device.index if device.index is not None else torch.cuda.current_device()}"
+    return device.type
+
+
+def read_tensors(path, torch_dtype, device, prefix=""):
+    """从 safetensors 文件中读取以 prefix 开头的张量 (去掉前缀)，返回 (state_dict, 字节数)"""
+    state_dict = {}
+    bytes_read = 0
+    with safe_open(path, framework="pt", device=_safe_open_device(device)) as f:
+        for key in f.keys():
+            if not key.startswith(prefix):
+                continue
+            tensor = f.get_tensor(key)
+            bytes_read += tensor.numel() * tensor.element_size()
+            if tensor.is_floating_point() and tensor.dtype != torch_dtype:
+                tensor = tensor.to(torch_dtype)
+            state_dict[key[len(prefix):]] = tensor
+    return state_dict, bytes_read
+
+
+def checkpoint_key_map(model, keys):
+    """按 from_pretrained() 的规则把权重文件中的张量名映射为模型参数名，返回 {参数名: 张量名}"""
+    names = {key: key for key in keys}
+    # diffusers: 旧版注意力块的 query/key/value/proj_attn -> to_q/to_k/to_v/to_out.0
+    if hasattr(model, "_fix_state_dict_keys_on_load"):
+        return model._fix_state_dict_keys_on_load(names)
+    try:
+        from transformers.conversion_mapping import get_model_conversion_mapping
+        from transformers.core_model_loading import WeightConverter, WeightRenaming, rename_source_key
+    except ImportError:
+        return names
+
+    # transformers: 使用模型自己的重命名规则，并按需要添加 / 去掉 base_model_prefix
+    transforms = get_model_conversion_mapping(model)
+    renamings = [t for t in transforms if isinstance(t, WeightRenaming)]
+    converters = [t for t in transforms if isinstance(t, WeightConverter)]
+    model_keys = model.state_dict()
+    prefix = getattr(model, "base_model_prefix", None)
+    renamed = {}
+    for key in keys:
+        target, _ = rename_source_key(key, renamings, converters, prefix, model_keys)
+        if target not in model_keys and key in model_keys:
+            target = key
+        renamed[target] = key
+    return renamed
+
+
+def materialize(cls, config, state_dict, device, name):
+    """构建 meta 骨架并直接把 state_dict 中的张量作为参数，返回可用的模型"""
+    with _skeleton_lock:
+        model = _empty_model(cls, config)
+        key_map = checkpoint_key_map(model, state_dict)
+        state_dict = {target: state_dict[key] for target, key in key_map.items()}
+        missing, unexpected = model.load_state_dict(state_dict, strict=False, assign=True)
+    if missing:
+        raise MissingWeightsError(name, missing)
+    if unexpected:
+        logger.info(f"ℹ️ {name}: 忽略多余的权重 {unexpected[:5]}")
+
+    # 参数已在目标设备 / dtype 上，这里只搬运 buffer
+    model = model.to(device)
+    meta = [key for key, p in list(model.named_parameters()) + list(model.named_buffers()) if p.is_meta]
+    if meta:
+        raise ValueError(f"{name}: tensors left on meta device: {meta[:5]}")
+    model.eval()
+    model.requires_grad_(False)
+    return model
+
+
+def load_component(cls, component_path, torch_dtype, device, variant=None):
+    """加载单个组件，返回 (model, {"bytes", "seconds", "files"})"""
+    start = time.perf_counter()
+    files = safetensors_files(component_path, variant)
+    state_dict = {}
+    bytes_read = 0
+    for path in files:
+        tensors, size = read_tensors(path, torch_dtype, device)
+        state_dict.update(tensors)
+        bytes_read += size
+
+    model = materialize(cls, component_path, state_dict, device, component_path)
+    stats = {
+        "bytes": bytes_read,
+        "seconds": round(time.perf_counter() - start, 4),
+        "files": [os.path.basename(p) for p in files],
+    }
+    return model, stats
+
+
+def check_weights_complete(pipe, model_path, variant=None):
+    """检查 pipeline 各组件的参数是否都能在权重文件中找到，缺失时抛出 MissingWeightsError
+
+    只读取 safetensors 头部的张量名 (按 checkpoint_key_map 重命名)；组件没有 safetensors 文件时跳过。
+    """
+    for name in MMAP_COMPONENTS:
+        model = getattr(pipe, name, None)
+        if model is None:
+            continue
+        try:
+            files = safetensors_files(os.path.join(model_path, name), variant)
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        keys = set()
+        for path in files:
+            with safe_open(path, framework="pt") as f:
+                keys.update(f.keys())
+        keys = checkpoint_key_map(model, keys)
+        missing = [key for key in model.state_dict() if key not in keys]
+        if missing:
+            raise MissingWeightsError(name, missing)
+
+
+def load_pipeline_mmap(model_path, pipeline_cls, torch_dtype=torch.float32, device="cpu", variant=None, workers=4):
+    """并发 mmap 加载整个 pipeline
+
+    返回 (pipeline, stats)：stats["components"] 是每个组件的 {"bytes", "seconds", "files"}，
+    stats["seconds"] 是整体耗时 (workers > 1 时小于各组件耗时之和)。
+    """
+    start = time.perf_counter()
+    with open(os.path.join(model_path, "model_index.json")) as f:
+        model_index = json.load(f)
+
+    def _load_model(name):
+        cls = _component_class(model_index, name)
+        return load_component(cls, os.path.join(model_path, name), torch_dtype, device, variant)
+
+    def _load_config(name):
+        return _component_class(model_index, name).from_pretrained(model_path, subfolder=name)
+
+    workers = max(1, int(workers))
+    with ThreadPoolExecutor(workers, thread_name_prefix="load") as executor:
+        # 最大的 unet 排在最前面，尽早开始
+        model_futures = {name: executor.submit(_load_model, name) for name in MMAP_COMPONENTS}
+        config_futures = {name: executor.submit(_load_config, name) for name in CONFIG_COMPONENTS}
+
+        components, component_stats = {}, {}
+        for name, future in model_futures.items():
+            components[name], component_stats[name] = future.result()
+            mb = component_stats[name]["bytes"] / 2 ** 20
+            logger.info(f"   📦 {name}: {mb:.1f} MB, {component_stats[name]['seconds']:.2f}s")
+        for name, future in config_futures.items():
+            components[name] = future.result()
+
+    # model_index 中的非组件配置项 (如 force_zeros_for_empty_prompt)
+    extra = {k: v for k, v in model_index.items() if not k.startswith("_") and not isinstance(v, list)}
+    pipe = pipeline_cls(**components, **extra)
+
+    seconds = time.perf_counter() - start
+    logger.info(f"   ⏱️ {len(MMAP_COMPONENTS)} 个组件加载完成 ({workers} 线程), 总耗时 {seconds:.2f}s")
+    return pipe, {"workers": workers, "seconds": round(seconds, 4), "components": component_stats}
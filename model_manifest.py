@@ -0,0 +1,169 @@
+"""
+模型目录的校验清单 (validated manifest)
+
+load_model() 成功后在模型目录旁写入 .validated_manifest.json，记录所有配置、
+tokenizer 和权重文件的大小、mtime 以及内容哈希。下次冷启动时只需一次 stat
+扫描就能确认目录未被修改，从而跳过 fix_config_none_values() /
+diagnose_volume_structure() / tokenizer 检查等修复流程。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = ".validated_manifest.json"
+MANIFEST_VERSION = 1
+
+# 小于该大小的文件做完整 sha256；更大的权重文件只哈希头尾各 HASH_SAMPLE_BYTES 字节
+# (加上文件大小)，避免每次写清单都把数 GB 权重从网络卷完整读一遍
+HASH_FULL_LIMIT = 16 * 1024 * 1024
+HASH_SAMPLE_BYTES = 4 * 1024 * 1024
+
+
+def manifest_path(model_path):
+    return os.path.join(model_path, MANIFEST_NAME)
+
+
+def _iter_files(model_path):
+    """遍历模型目录下所有需要记录的文件，返回 (相对路径, os.stat_result)
+
+    以 "." 开头的文件和目录 (清单本身、.cache 等) 不计入。
+    """
+    stack = [model_path]
+    while stack:
+        directory = stack.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=True):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=True):
+                    rel_path = os.path.relpath(entry.path, model_path).replace(os.sep, "/")
+                    yield rel_path, entry.stat(follow_symlinks=True)
+
+
+def file_hash(path, size=None):
+    """计算文件内容哈希，返回 (hash_mode, hexdigest)"""
+    if size is None:
+        size = os.path.getsize(path)
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        if size <= HASH_FULL_LIMIT:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+            return "sha256", digest.hexdigest()
+
+        digest.update(str(size).encode())
+        digest.update(f.read(HASH_SAMPLE_BYTES))
+        f.seek(size - HASH_SAMPLE_BYTES)
+        digest.update(f.read(HASH_SAMPLE_BYTES))
+        return "sha256-sampled", digest.hexdigest()
+
+
+def build_manifest(model_path, extra=None):
+    """扫描模型目录并生成清单 dict"""
+    files = {}
+    for rel_path, st in sorted(_iter_files(model_path)):
+        hash_mode, hexdigest = file_hash(os.path.join(model_path, rel_path), st.st_size)
+        files[rel_path] = {
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "hash": hexdigest,
+            "hash_mode": hash_mode,
+        }
+
+    # 整个目录的指纹，可作为模型版本标识
+    fingerprint = hashlib.sha256()
+    for rel_path, info in files.items():
+        fingerprint.update(f"{rel_path}:{info['hash']}\n".encode())
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "created_at": time.time(),
+        "digest": fingerprint.hexdigest(),
+        "files": files,
+    }
+    if extra:
+        manifest.update(extra)
+    return manifest
+
+
+def load_manifest(model_path):
+    """读取清单，不存在或损坏时返回 None"""
+    path = manifest_path(model_path)
+    try:
+        with open(path, "r") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"⚠️ 读取清单失败: {e}")
+        return None
+
+    if manifest.get("version") != MANIFEST_VERSION or not isinstance(manifest.get("files"), dict):
+        logger.info("ℹ️ 清单版本不匹配，忽略")
+        return None
+    return manifest
+
+
+def validate_manifest(model_path, manifest):
+    """一次 stat 扫描校验目录是否与清单一致 (文件集合、大小、mtime)"""
+    if manifest is None:
+        return False
+
+    expected = manifest["files"]
+    seen = 0
+    try:
+        for rel_path, st in _iter_files(model_path):
+            info = expected.get(rel_path)
+            if info is None:
+                logger.info(f"ℹ️ 清单失效，新增文件: {rel_path}")
+                return False
+            if info["size"] != st.st_size or info["mtime_ns"] != st.st_mtime_ns:
+                logger.info(f"ℹ️ 清单失效，文件已修改: {rel_path}")
+                return False
+            seen += 1
+    except OSError as e:
+        logger.warning(f"⚠️ 清单校验失败: {e}")
+        return False
+
+    if seen != len(expected):
+        logger.info(f"ℹ️ 清单失效，{len(expected) - seen} 个文件已删除")
+        return False
+    return True
+
+
+def write_manifest(model_path, extra=None):
+    """生成并原子写入清单，失败 (例如卷只读) 时返回 None"""
+    try:
+        manifest = build_manifest(model_path, extra)
+        path = manifest_path(model_path)
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, path)
+        logger.info(f"📝 已写入校验清单: {len(manifest['files'])} 个文件")
+        return manifest
+    except Exception as e:
+        logger.warning(f"⚠️ 写入校验清单失败: {e}")
+        return None
+
+
+def update_manifest(model_path, manifest, **fields):
+    """只更新清单中的附加字段 (例如加载策略)，不重新扫描和哈希文件"""
+    manifest.update(fields)
+    try:
+        path = manifest_path(model_path)
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.warning(f"⚠️ 更新校验清单失败: {e}")
+    return manifest
@@ -0,0 +1,144 @@
+"""
+输出图像编码
+
+把 PIL 图像编码为 PNG / JPEG / WebP / 原始 uint8 数组，并以 base64 内联返回，
+或者直接写到本地 / Volume 路径。编码时直接对 BytesIO 的底层缓冲区做 base64，
+省掉 getvalue() 的整份拷贝。
+"""
+
+import base64
+import logging
+import os
+from io import BytesIO
+
+import numpy as np
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_FORMATS = {
+    "png": ("PNG", "image/png", ".png"),
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+    "webp": ("WEBP", "image/webp", ".webp"),
+    "raw": (None, "application/octet-stream", ".raw"),
+}
+FORMAT_ALIASES = {"jpg": "jpeg"}
+
+DEFAULT_FORMAT = os.environ.get("OUTPUT_FORMAT", "png")
+DEFAULT_QUALITY = int(os.environ.get("OUTPUT_QUALITY", "90"))
+# PIL 默认 compress_level=6，对 1024x1024 图像很慢；1 的体积略大但编码快数倍
+DEFAULT_PNG_COMPRESS_LEVEL = int(os.environ.get("PNG_COMPRESS_LEVEL", "1"))
+# output_path 只允许写到该目录之下
+OUTPUT_ROOT = os.environ.get("OUTPUT_ROOT", "/runpod-volume/outputs")
+
+
+class OutputOptionsError(ValueError):
+    """客户端传入的输出参数无效"""
+
+
+def parse_output_options(input_data):
+    """从 handler 输入中解析并校验输出参数"""
+    output_format = str(input_data.get("output_format") or DEFAULT_FORMAT).lower()
+    output_format = FORMAT_ALIASES.get(output_format, output_format)
+    if output_format not in OUTPUT_FORMATS:
+        raise OutputOptionsError(
+            f"Unsupported output_format: {output_format} (expected one of {sorted(OUTPUT_FORMATS)})"
+        )
+
+    try:
+        quality = int(input_data.get("output_quality", DEFAULT_QUALITY))
+        compress_level = int(input_data.get("png_compress_level", DEFAULT_PNG_COMPRESS_LEVEL))
+    except (ValueError, TypeError):
+        raise OutputOptionsError("output_quality and png_compress_level must be integers")
+
+    output_path = input_data.get("output_path")
+    if output_path is not None:
+        output_path = resolve_output_path(str(output_path))
+
+    return {
+        "output_format": output_format,
+        "quality": min(100, max(1, quality)),
+        "compress_level": min(9, max(0, compress_level)),
+        "output_path": output_path,
+    }
+
+
+def _inside_root(path):
+    """返回 realpath 后的路径；不在 OUTPUT_ROOT 之下 (或就是 OUTPUT_ROOT 本身) 时抛出 OutputOptionsError"""
+    root = os.path.realpath(OUTPUT_ROOT)
+    full_path = os.path.realpath(path)
+    if full_path == root or os.path.commonpath([root, full_path]) != root:
+        raise OutputOptionsError(f"output_path must name a file inside {OUTPUT_ROOT}")
+    return full_path
+
+
+def resolve_output_path(path):
+    """把客户端给出的相对路径解析到 OUTPUT_ROOT 之下，拒绝越界路径"""
+    return _inside_root(os.path.join(os.path.realpath(OUTPUT_ROOT), path.lstrip("/")))
+
+
+def indexed_path(path, index, count):
+    """多图输出时在扩展名前追加序号: out.png -> out_0.png"""
+    if path is None or count <= 1:
+        return path
+    stem, ext = os.path.splitext(path)
+    return f"{stem}_{index}{ext}"
+
+
+def _write_encoded(image, fileobj, output_format, quality, compress_level):
+    """把图像编码写入 fileobj，返回附加元数据"""
+    if output_format == "raw":
+        array = np.asarray(image.convert("RGB"), dtype=np.uint8)
+        fileobj.write(memoryview(np.ascontiguousarray(array)).cast("B"))
+        return {"shape": list(array.shape), "dtype": "uint8"}
+
+    pil_format = OUTPUT_FORMATS[output_format][0]
+    if output_format == "png":
+        image.save(fileobj, format=pil_format, compress_level=compress_level)
+    elif output_format == "jpeg":
+        image.convert("RGB").save(fileobj, format=pil_format, quality=quality)
+    else:
+        image.save(fileobj, format=pil_format, quality=quality, method=4)
+    return {}
+
+
+def encode_output(image, output_format="png", quality=DEFAULT_QUALITY,
+                  compress_level=DEFAULT_PNG_COMPRESS_LEVEL, output_path=None):
+    """编码单张图像
+
+    返回 {"image": base64, "format", "mime_type", "bytes"}；指定 output_path 时
+    直接写入文件并返回 {"path", ...}，不再内联 base64。
+    """
+    _, mime_type, ext = OUTPUT_FORMATS[output_format]
+    result = {"format": output_format, "mime_type": mime_type}
+
+    if output_path is not None:
+        if not os.path.splitext(output_path)[1]:
+            output_path += ext
+        # 追加扩展名 / 序号后路径可能变化 (例如指向根目录外的符号链接)，重新检查
+        output_path = _inside_root(output_path)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        tmp_path = f"{output_path}.tmp.{os.getpid()}"
+        try:
+            with open(tmp_path, "wb") as f, metrics.stage("image_encode", format=output_format):
+                result.update(_write_encoded(image, f, output_format, quality, compress_level))
+                size = f.tell()
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        result.update({"path": output_path, "bytes": size})
+        return result
+
+    buffered = BytesIO()
+    with metrics.stage("image_encode", format=output_format):
+        result.update(_write_encoded(image, buffered, output_format, quality, compress_level))
+    # getbuffer() 是底层缓冲区的视图，直接交给 b64encode，避免 getvalue() 的拷贝
+    with buffered.getbuffer() as view, metrics.stage("base64"):
+        result["bytes"] = view.nbytes
+        result["image"] = base64.b64encode(view).decode("ascii")
+    return result
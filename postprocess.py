@@ -0,0 +1,104 @@
+"""
+图像后处理线程池
+
+pipeline 以 output_type="np" 返回 float 数组，数组 -> PIL -> PNG/JPEG -> base64
+全部放到线程池中执行 (PIL 编码和 zlib 压缩会释放 GIL)。微批处理的工作线程提交
+编码任务后立即开始下一批的去噪，请求 N 的编码与请求 N+1 的去噪重叠。
+
+未完成的任务数达到 max_pending 时 submit() 会阻塞 (背压)，编码跟不上时推理线程
+自然放慢，不会无限堆积解码后的图像。
+"""
+
+import threading
+import time
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+def to_pil(image):
+    """把 pipeline 的 np 输出 (H, W, C, 取值 0-1) 转为 PIL 图像；PIL 图像原样返回"""
+    if isinstance(image, Image.Image):
+        return image
+    array = (np.asarray(image) * 255).round().astype(np.uint8)
+    if array.ndim == 3 and array.shape[-1] == 1:
+        array = array[..., 0]
+    return Image.fromarray(array)
+
+
+def resolve(value):
+    """等待 Future 并返回结果；普通值原样返回"""
+    if isinstance(value, Future):
+        return value.result()
+    return value
+
+
+class PostProcessPool:
+    """带背压的后处理线程池"""
+
+    def __init__(self, workers=2, max_pending=8, name="postprocess"):
+        self.max_pending = max(1, int(max_pending))
+        self._executor = ThreadPoolExecutor(max(1, int(workers)), thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._completed = 0
+        self._pending = 0
+        self._max_pending_seen = 0
+        self._backpressure_waits = 0
+        self._backpressure_seconds = 0.0
+        self._task_seconds = 0.0
+
+    def submit(self, fn, *args, **kwargs):
+        """提交任务，返回 Future；未完成任务达到 max_pending 时阻塞"""
+        if not self._slots.acquire(blocking=False):
+            start = time.perf_counter()
+            self._slots.acquire()
+            with self._lock:
+                self._backpressure_waits += 1
+                self._backpressure_seconds += time.perf_counter() - start
+
+        with self._lock:
+            self._submitted += 1
+            self._pending += 1
+            self._max_pending_seen = max(self._max_pending_seen, self._pending)
+
+        def _run():
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._completed += 1
+                    self._pending -= 1
+                    self._task_seconds += time.perf_counter() - start
+                self._slots.release()
+
+        try:
+            return self._executor.submit(_run)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+            raise
+
+    def close(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "max_pending_seen": self._max_pending_seen,
+                "backpressure_waits": self._backpressure_waits,
+                "backpressure_ms_total": round(self._backpressure_seconds * 1000, 2),
+                "avg_task_ms": round(self._task_seconds / self._completed * 1000, 2) if self._completed else 0.0,
+            }
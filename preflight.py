@@ -0,0 +1,130 @@
+"""
+加载前检查 (preflight)：根据模型目录中的实际文件决定唯一可行的加载策略
+
+load_model() 原本按顺序尝试 5 种 from_pretrained 参数组合，每次失败都可能
+先读完数 GB 权重才抛错。这里只做目录扫描 (不读取权重内容)，判断
+fp16 变体、safetensors / bin 文件和缺失组件，直接选出应当成功的策略。
+"""
+
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# 需要权重文件的组件
+WEIGHT_COMPONENTS = ["unet", "vae", "text_encoder", "text_encoder_2"]
+# 只需要配置/词表文件的组件
+CONFIG_COMPONENTS = {
+    "tokenizer": ["vocab.json", "merges.txt"],
+    "tokenizer_2": ["vocab.json", "merges.txt"],
+    "scheduler": ["scheduler_config.json"],
+}
+
+# snapshot.py 导出的单文件快照 (相对模型目录)
+SNAPSHOT_CONFIG_PATH = os.path.join("snapshot", "snapshot.json")
+
+# 与 handler.build_load_strategies() 中的顺序一致
+STRATEGY_SNAPSHOT = "snapshot"
+STRATEGY_MMAP = "mmap_safetensors"
+STRATEGY_LOW_MEM_FP16 = "low_mem_fp16"
+STRATEGY_FP16 = "fp16"
+STRATEGY_NO_VARIANT = "no_variant"
+STRATEGY_FP16_VARIANT = "fp16_variant"
+STRATEGY_NO_SAFETENSORS = "no_safetensors"
+STRATEGY_ALLOW_DOWNLOAD = "allow_download"
+
+
+def _classify_weights(filenames):
+    """把组件目录中的文件名归类为 safetensors / bin 以及是否为 fp16 变体"""
+    found = {"safetensors": False, "safetensors_fp16": False, "bin": False, "bin_fp16": False}
+    for name in filenames:
+        if name.endswith(".safetensors.index.json") or name.endswith(".bin.index.json"):
+            # 分片权重的索引文件，和对应的分片一起判断
+            name = name[: -len(".index.json")]
+        if name.endswith(".fp16.safetensors"):
+            found["safetensors_fp16"] = True
+        elif name.endswith(".safetensors"):
+            found["safetensors"] = True
+        elif name.endswith(".fp16.bin"):
+            found["bin_fp16"] = True
+        elif name.endswith(".bin"):
+            found["bin"] = True
+    return found
+
+
+def inspect_model_dir(model_path):
+    """扫描模型目录，返回每个组件的文件情况和缺失组件列表"""
+    report = {"components": {}, "missing": [], "snapshot": os.path.isfile(os.path.join(model_path, SNAPSHOT_CONFIG_PATH))}
+
+    if not os.path.isfile(os.path.join(model_path, "model_index.json")):
+        report["missing"].append("model_index.json")
+
+    for component in WEIGHT_COMPONENTS:
+        component_path = os.path.join(model_path, component)
+        try:
+            filenames = os.listdir(component_path)
+        except OSError:
+            report["missing"].append(component)
+            continue
+
+        weights = _classify_weights(filenames)
+        weights["config"] = "config.json" in filenames
+        report["components"][component] = weights
+
+        if not weights["config"] or not any(
+            weights[k] for k in ("safetensors", "safetensors_fp16", "bin", "bin_fp16")
+        ):
+            report["missing"].append(component)
+
+    for component, required in CONFIG_COMPONENTS.items():
+        component_path = os.path.join(model_path, component)
+        try:
+            filenames = set(os.listdir(component_path))
+        except OSError:
+            report["missing"].append(component)
+            continue
+        # 新版 tokenizer 只保存 tokenizer.json 也可以加载
+        if component.startswith("tokenizer") and "tokenizer.json" in filenames:
+            continue
+        if not all(name in filenames for name in required):
+            report["missing"].append(component)
+
+    return report
+
+
+def choose_strategy(report, device, prefer_mmap=False, prefer_snapshot=False):
+    """根据目录检查结果选择加载策略名称
+
+    prefer_snapshot 时，存在导出的快照就从快照加载 (快照过期时加载失败，退回其它策略)；
+    prefer_mmap 时，只要每个组件都有 safetensors 文件就使用 mmap 逐组件加载。
+    """
+    if report["missing"]:
+        return STRATEGY_ALLOW_DOWNLOAD
+
+    if prefer_snapshot and report.get("snapshot"):
+        return STRATEGY_SNAPSHOT
+
+    components = report["components"].values()
+
+    # mmap 在 cuda 上读取 fp16 变体 (缺少时退回无 variant 的文件)，CPU 上只读取无 variant 的文件
+    if prefer_mmap and all(
+        c["safetensors"] or (device == "cuda" and c["safetensors_fp16"]) for c in components
+    ):
+        return STRATEGY_MMAP
+
+    # GPU 上优先使用 fp16 变体 (策略 1/2 在 cuda 上会指定 variant="fp16")
+    if device == "cuda" and all(c["safetensors_fp16"] for c in components):
+        return STRATEGY_LOW_MEM_FP16
+
+    # 没有 variant 的 safetensors 文件齐全
+    if all(c["safetensors"] for c in components):
+        # CPU 上策略 1 本身就不带 variant，直接使用即可
+        return STRATEGY_LOW_MEM_FP16 if device != "cuda" else STRATEGY_NO_VARIANT
+
+    # 每个组件都有 safetensors，但有的只有 fp16 变体 (例如 CPU 上的 fp16-only 目录)：
+    # 指定 variant="fp16"，CPU 上按 float32 加载
+    if all(c["safetensors"] or c["safetensors_fp16"] for c in components):
+        return STRATEGY_FP16_VARIANT
+
+    # 至少一个组件没有任何 safetensors 文件 (只有 .bin)，必须关闭 use_safetensors
+    return STRATEGY_NO_SAFETENSORS
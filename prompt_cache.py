@@ -0,0 +1,143 @@
+"""
+Prompt embedding LRU 缓存
+
+SDXL 每次生成都要把 prompt / negative_prompt 经过 text_encoder 和 text_encoder_2
+编码一遍。线上流量大量复用相同的 negative prompt 和少数风格 prompt，
+这里按 (模型标识, 文本) 缓存编码结果，并在字节预算内做 LRU 淘汰。
+"""
+
+import threading
+import logging
+from collections import OrderedDict
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def _nbytes(value):
+    """计算缓存值 (tensor 或 tensor 元组) 占用的字节数"""
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+
+class PromptEmbeddingCache:
+    """按字节预算淘汰的线程安全 LRU 缓存"""
+
+    def __init__(self, max_bytes=128 * 1024 * 1024):
+        self.max_bytes = int(max_bytes)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            # 单个条目超出整个预算，不缓存
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """命中则返回缓存值，否则调用 compute() 计算并写入缓存"""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def model_identity(pipe):
+    """文本编码器的标识：模型路径 + 编码器对象 + dtype，换模型后旧缓存自然失效"""
+    text_encoder_2 = getattr(pipe, "text_encoder_2", None)
+    dtype = getattr(text_encoder_2, "dtype", None)
+    return (
+        getattr(pipe, "name_or_path", None),
+        id(getattr(pipe, "text_encoder", None)),
+        id(text_encoder_2),
+        str(dtype),
+    )
+
+
+def encode_text(pipe, text):
+    """单独编码一段文本，返回 (prompt_embeds, pooled_prompt_embeds)
+
+    与 encode_prompt 内部 negative 分支的编码方式相同 (倒数第二层 hidden state
+    + text_encoder_2 的 pooled 输出)，因此同一缓存可以同时服务 prompt 和 negative prompt。
+    """
+    with torch.no_grad():
+        prompt_embeds, _, pooled_prompt_embeds, _ = pipe.encode_prompt(
+            prompt=text,
+            device=pipe._execution_device,
+            num_images_per_prompt=1,
+            do_classifier_free_guidance=False,
+        )
+    return prompt_embeds, pooled_prompt_embeds
+
+
+def cached_prompt_embeds(cache, pipe, prompts, negative_prompts):
+    """为逐样本的 prompt / negative_prompt 列表取出 (或编码) 嵌入并按批拼接
+
+    返回可直接传给 StableDiffusionXLPipeline 的关键字参数。
+    """
+    identity = model_identity(pipe)
+    encoded = {}
+
+    def _lookup(text):
+        if text not in encoded:
+            encoded[text] = cache.get_or_compute((identity, text), lambda: encode_text(pipe, text))
+        return encoded[text]
+
+    positives = [_lookup(p) for p in prompts]
+    negatives = [_lookup(n) for n in negative_prompts]
+
+    return {
+        "prompt_embeds": torch.cat([e[0] for e in positives]),
+        "pooled_prompt_embeds": torch.cat([e[1] for e in positives]),
+        "negative_prompt_embeds": torch.cat([e[0] for e in negatives]),
+        "negative_pooled_prompt_embeds": torch.cat([e[1] for e in negatives]),
+    }
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+流量回放压测工具
+
+读取录制的 handler 事件 (JSONL，每行 {"ts": 秒, "input": {...}}；也接受不带 ts 的
+{"input": {...}} 或 test_api_request.json 这样的单个 JSON)，在进程内调用
+handler.handler()，或通过 HTTP 发到 RunPod 的 /runsync 接口 (或本地替身服务)。
+
+时间模式:
+
+- original: 按录制时的到达间隔发送 (--speed 2 表示两倍速)
+- rps:      固定速率发送 (开环，不等待前一个请求完成)
+- closed:   --concurrency 个客户端，每个客户端收到响应后才发下一个请求 (闭环)
+
+报告 p50 / p95 / p99 延迟、吞吐和错误率。handler 设置 CAPTURE_TRAFFIC_PATH 后会把
+线上请求按同样的格式追加到 JSONL 文件中，可以直接回放。
+
+使用方法:
+python replay.py run traffic.jsonl [--mode original|rps|closed] [--rps 2] [--concurrency 4]
+                     [--url http://localhost:8000/runsync] [--tiny] [--result-cache] [--json report.json]
+python replay.py serve [--port 8000] [--tiny] [--result-cache]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+REPLAY_MODES = ("original", "rps", "closed")
+
+# 录制时不记录的管理类请求
+_SKIP_ACTIONS = ("stats", "metrics")
+
+
+class TrafficRecorder:
+    """把 handler 收到的事件追加到 JSONL 文件 (线程安全，每行写完即 flush)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.recorded = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def record(self, input_data):
+        if not isinstance(input_data, dict) or input_data.get("action") in _SKIP_ACTIONS:
+            return
+        line = json.dumps({"ts": round(time.time(), 6), "input": input_data}, ensure_ascii=False, default=str)
+        try:
+            with self._lock:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+                self.recorded += 1
+        except OSError as e:
+            logger.warning(f"⚠️ 录制请求失败: {e}")
+
+
+def load_events(path, limit=None):
+    """读取事件文件，返回 [{"ts": 秒或 None, "input": {...}}]"""
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+
+    try:
+        # 单个 JSON (例如 test_api_request.json)
+        records = [json.loads(text)]
+    except json.JSONDecodeError:
+        records = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    events = []
+    for record in records:
+        if "input" not in record:
+            raise ValueError(f"{path}: every event needs an 'input' field")
+        events.append({"ts": record.get("ts"), "input": record["input"]})
+        if limit and len(events) >= limit:
+            break
+    return events
+
+
+def schedule(events, mode, rps=1.0, speed=1.0):
+    """开环模式下每个事件相对开始时间的发送时刻 (秒)；closed 模式返回 None"""
+    if mode == "closed":
+        return None
+    if mode == "rps":
+        return [i / rps for i in range(len(events))]
+    # original：没有时间戳的事件紧跟前一个事件发送
+    offsets, first, last = [], None, 0.0
+    for event in events:
+        ts = event["ts"]
+        if ts is not None:
+            first = ts if first is None else first
+            last = max(last, (ts - first) / speed)
+        offsets.append(last)
+    return offsets
+
+
+def in_process_target(handler_fn):
+    """返回进程内调用 handler_fn 的 target：target(input) -> (ok, error)"""
+    def _call(input_data):
+        result = handler_fn({"input": input_data})
+        if isinstance(result, dict) and "error" in result:
+            return False, str(result["error"])
+        return True, None
+    return _call
+
+
+def http_target(url, api_key=None, timeout=600):
+    """返回把事件 POST 到 RunPod /runsync 风格接口的 target"""
+    headers = {"Content-Type": "application/json"}
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+
+    def _call(input_data):
+        body = json.dumps({"input": input_data}).encode()
+        request = urllib.request.Request(url, data=body, headers=headers, method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                payload = json.load(response)
+        except urllib.error.HTTPError as e:
+            return False, f"HTTP {e.code}"
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            return False, str(e)
+        if payload.get("status") not in (None, "COMPLETED"):
+            return False, f"status {payload.get('status')}: {payload.get('error')}"
+        output = payload.get("output")
+        if isinstance(output, dict) and "error" in output:
+            return False, str(output["error"])
+        return True, None
+
+    return _call
+
+
+def percentile(samples, q):
+    """最近秩分位数，与 benchmark.py 一致"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def summarize(records, seconds):
+    """汇总单个请求的结果 [{"latency_s", "ok", "error", "late_s"}]"""
+    latencies = [r["latency_s"] for r in records]
+    errors = [r for r in records if not r["ok"]]
+    error_kinds = {}
+    for r in errors:
+        key = (r["error"] or "")[:120]
+        error_kinds[key] = error_kinds.get(key, 0) + 1
+
+    def _ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        "requests": len(records),
+        "errors": len(errors),
+        "error_rate": round(len(errors) / len(records), 4) if records else 0.0,
+        "seconds": round(seconds, 3),
+        "throughput_rps": round(len(records) / seconds, 3) if seconds > 0 else None,
+        "p50_ms": _ms(percentile(latencies, 0.50)),
+        "p95_ms": _ms(percentile(latencies, 0.95)),
+        "p99_ms": _ms(percentile(latencies, 0.99)),
+        "max_ms": _ms(max(latencies) if latencies else None),
+        # 开环模式下发送线程不够时，请求会晚于计划时刻发出
+        "max_send_lag_ms": _ms(max((r["late_s"] for r in records), default=0.0)),
+        "error_kinds": error_kinds,
+    }
+
+
+def replay(events, target, mode="original", rps=1.0, speed=1.0, concurrency=4, max_inflight=64):
+    """按 mode 回放 events，返回 summarize() 的报告"""
+    if mode not in REPLAY_MODES:
+        raise ValueError(f"Unknown replay mode: {mode} (expected one of {REPLAY_MODES})")
+    if mode == "rps" and rps <= 0:
+        raise ValueError("rps must be positive")
+
+    records = [None] * len(events)
+    offsets = schedule(events, mode, rps, speed)
+    start = time.perf_counter()
+
+    def _send(index, planned=None):
+        sent = time.perf_counter()
+        try:
+            ok, error = target(events[index]["input"])
+        except Exception as e:
+            ok, error = False, str(e)
+        records[index] = {
+            "latency_s": time.perf_counter() - sent,
+            "ok": ok,
+            "error": error,
+            "late_s": max(0.0, sent - planned) if planned is not None else 0.0,
+        }
+
+    if mode == "closed":
+        cursor = iter(range(len(events)))
+        lock = threading.Lock()
+
+        def _client():
+            while True:
+                with lock:
+                    index = next(cursor, None)
+                if index is None:
+                    return
+                _send(index)
+
+        threads = [threading.Thread(target=_client, name=f"replay-{i}") for i in range(max(1, concurrency))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    else:
+        with ThreadPoolExecutor(max_inflight, thread_name_prefix="replay") as executor:
+            for index, offset in enumerate(offsets):
+                planned = start + offset
+                delay = planned - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(_send, index, planned)
+
+    return summarize(records, time.perf_counter() - start)
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """RunPod /runsync 的本地替身：POST {"input": ...} -> {"id", "status", "output"}"""
+
+    handler_fn = None
+
+    def do_POST(self):
+        if self.path.split("?", 1)[0].rstrip("/") not in ("/runsync", "/run"):
+            self.send_error(404)
+            return
+        try:
+            event = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+        except ValueError:
+            self.send_error(400, "invalid JSON")
+            return
+        output = self.handler_fn({"input": event.get("input") or {}})
+        body = json.dumps({"id": f"local-{time.time_ns()}", "status": "COMPLETED", "output": output}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(handler_fn, port=8000, host="127.0.0.1"):
+    """在后台线程中启动 /runsync 替身服务，返回 server (server_address[1] 是实际端口)"""
+    request_handler = type("StandInHandler", (_StandInHandler,), {"handler_fn": staticmethod(handler_fn)})
+    server = ThreadingHTTPServer((host, port), request_handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="replay-stand-in", daemon=True).start()
+    logger.info(f"🛰️ /runsync 替身服务: http://{host}:{server.server_address[1]}/runsync")
+    return server
+
+
+def _load_handler(tiny, result_cache=False):
+    import handler
+
+    # --repeat 和重复录制的 seed 固定请求会命中结果缓存，默认关闭以测量真实的生成延迟
+    if not result_cache:
+        handler.result_cache = None
+    if tiny:
+        from synthetic_sdxl import build_tiny_pipeline
+        handler.pipeline = build_tiny_pipeline()
+    return handler.handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放录制的 handler 请求并统计延迟")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="回放事件文件")
+    run.add_argument("events", help="JSONL 事件文件 (或单个 JSON 请求)")
+    run.add_argument("--mode", choices=REPLAY_MODES, default="original")
+    run.add_argument("--rps", type=float, default=1.0, help="rps 模式的发送速率")
+    run.add_argument("--speed", type=float, default=1.0, help="original 模式的回放倍速")
+    run.add_argument("--concurrency", type=int, default=4, help="closed 模式的客户端数")
+    run.add_argument("--max-inflight", type=int, default=64, help="开环模式同时进行的请求上限")
+    run.add_argument("--limit", type=int, default=None, help="只回放前 N 个事件")
+    run.add_argument("--repeat", type=int, default=1, help="把事件序列重复 N 遍")
+    run.add_argument("--url", default=None, help="发到 HTTP /runsync 接口，而不是进程内调用 handler()")
+    run.add_argument("--api-key", default=os.environ.get("RUNPOD_API_KEY"), help="HTTP 模式的 Bearer token")
+    run.add_argument("--tiny", action="store_true", help="进程内模式使用微型合成 pipeline (不加载真实模型)")
+    run.add_argument("--result-cache", action="store_true", help="进程内模式保留结果缓存 (默认关闭)")
+    run.add_argument("--json", help="把报告写入 JSON 文件")
+
+    serve_parser = subparsers.add_parser("serve", help="启动本地 /runsync 替身服务 (阻塞)")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--tiny", action="store_true", help="使用微型合成 pipeline")
+    serve_parser.add_argument("--result-cache", action="store_true", help="保留结果缓存 (默认关闭)")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.command == "serve":
+        server = serve(_load_handler(args.tiny, args.result_cache), args.port, args.host)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return 0
+
+    events = load_events(args.events, args.limit) * max(1, args.repeat)
+    if args.mode == "original" and args.repeat > 1:
+        logger.info("ℹ️ 重复回放时时间戳不连续，重复部分紧接着发送")
+    target = http_target(args.url, args.api_key) if args.url else in_process_target(_load_handler(args.tiny, args.result_cache))
+
+    logger.info(f"▶️ 回放 {len(events)} 个请求 (mode={args.mode})")
+    report = replay(
+        events, target, args.mode, rps=args.rps, speed=args.speed,
+        concurrency=args.concurrency, max_inflight=args.max_inflight
+    )
+    report["mode"] = args.mode
+    for key, value in report.items():
+        print(f"   {key}: {value}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 报告已写入: {args.json}")
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,328 @@
+"""
+确定性请求的结果缓存
+
+seed 固定时，同样的 prompt / negative_prompt / 步数 / guidance / 尺寸 / 采样器 / 自适应步数阈值 /
+输出参数在同一个模型上总是生成同样的图像。客户端的重试和重复提交不需要重新去噪，直接返回
+已经编码好的结果。
+
+缓存键是规范化请求参数加模型指纹 (模型目录指纹、scheduler 配置、dtype、设备、
+是否编译等) 的 SHA-256，模型或配置变化后旧条目自然失效。值是 encode_images() 的
+返回列表 (base64 图像 + seed 等)，以 JSON 字节保存:
+
+- 内存层：按字节预算 LRU 淘汰
+- 磁盘层 (可选，通常放在网络卷上，多个 worker 共享)：<dir>/<键前两位>/<键>.json，
+  命中时更新 mtime，总大小超过上限时按 mtime 淘汰最旧的文件
+
+同一个键正在生成时，后到的相同请求等待第一个请求的结果，而不是重复生成。
+异步 handler 使用 get_or_compute_async()：磁盘层的读写和淘汰放到线程池中执行，不阻塞事件循环。
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# 写入磁盘层的格式版本，格式变化时旧文件自动失效
+CACHE_FORMAT_VERSION = 1
+
+
+def fingerprint(**parts):
+    """把模型 / scheduler / 运行配置组合成一个指纹字符串"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def request_key(params, model_fingerprint):
+    """规范化请求参数的缓存键；seed 缺失 / 无效或要求写文件 (output_path) 时返回 None
+
+    params 中的步数、guidance 和尺寸应当已经过 normalize_params()。
+    """
+    seed = params.get("seed")
+    if seed is None or isinstance(seed, bool):
+        return None
+    try:
+        seed = int(seed)
+    except (ValueError, TypeError):
+        return None
+
+    output = dict(params.get("output_options") or {})
+    if output.pop("output_path", None) is not None:
+        return None
+
+    normalized = {
+        "version": CACHE_FORMAT_VERSION,
+        "model": model_fingerprint,
+        "prompt": str(params["prompt"]),
+        "negative_prompt": str(params.get("negative_prompt") or ""),
+        "steps": int(params["num_inference_steps"]),
+        "guidance": float(params["guidance_scale"]),
+        "width": int(params["width"]),
+        "height": int(params["height"]),
+        "seed": seed,
+        "count": int(params.get("num_images_per_prompt") or 1),
+        "sampler": params.get("sampler"),
+        "karras": bool(params.get("use_karras_sigmas")),
+        "adaptive": params.get("adaptive_threshold"),
+        "output": output,
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ResultCache:
+    """内存 LRU + 可选磁盘层的结果缓存 (线程安全)"""
+
+    def __init__(self, max_bytes=256 * 2 ** 20, disk_dir=None, max_disk_bytes=10 * 2 ** 30):
+        self.max_bytes = int(max_bytes)
+        self.disk_dir = disk_dir or None
+        self.max_disk_bytes = int(max_disk_bytes)
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (payload, render_seconds)
+        self._bytes = 0
+        self._disk_bytes = None  # 首次写入时扫描
+        self._inflight = {}
+        self._async_inflight = {}
+
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.hits_inflight = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions_memory = 0
+        self.evictions_disk = 0
+        self.bytes_saved = 0
+        self.seconds_saved = 0.0
+
+    # 内存层
+
+    def _memory_put(self, key, payload, render_seconds):
+        size = len(payload)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key)[0])
+            self._entries[key] = (payload, render_seconds)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions_memory += 1
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    # 磁盘层
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _disk_files(self):
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    files.append((st.st_mtime, st.st_size, path))
+        return files
+
+    def _disk_get(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                record = json.loads(f.read())
+            os.utime(path)  # 更新最近使用时间 (LRU)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ 读取结果缓存失败 ({key[:12]}): {e}")
+            return None
+        return json.dumps(record["value"]).encode(), float(record.get("render_s") or 0.0)
+
+    def _disk_put(self, key, payload, render_seconds):
+        path = self._disk_path(key)
+        record = b'{"render_s": %s, "value": %s}' % (repr(round(render_seconds, 4)).encode(), payload)
+        if len(record) > self.max_disk_bytes:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+            with open(tmp_path, "wb") as f:
+                f.write(record)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"⚠️ 写入结果缓存失败: {e}")
+            return
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+            else:
+                self._disk_bytes += len(record)
+            over = self._disk_bytes > self.max_disk_bytes
+        if over:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        # 其它 worker 也在写同一个目录，淘汰前重新扫描
+        files = sorted(self._disk_files())
+        total = sum(size for _, size, _ in files)
+        evicted = 0
+        for _, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        with self._lock:
+            self._disk_bytes = total
+            self.evictions_disk += evicted
+
+    # 对外接口
+
+    def _lookup(self, key):
+        """返回 (value, source, render_seconds, size)，未命中时 value 为 None"""
+        entry = self._memory_get(key)
+        if entry is not None:
+            payload, render_seconds = entry
+            return json.loads(payload), "memory", render_seconds, len(payload)
+        if self.disk_dir:
+            entry = self._disk_get(key)
+            if entry is not None:
+                payload, render_seconds = entry
+                self._memory_put(key, payload, render_seconds)
+                return json.loads(payload), "disk", render_seconds, len(payload)
+        return None, None, 0.0, 0
+
+    def _count_hit(self, source, render_seconds, size):
+        with self._lock:
+            setattr(self, f"hits_{source}", getattr(self, f"hits_{source}") + 1)
+            self.bytes_saved += size
+            self.seconds_saved += render_seconds
+
+    def get(self, key):
+        """返回 (value, source)，source 为 memory / disk；未命中时返回 (None, None) 并计为 miss"""
+        value, source, render_seconds, size = self._lookup(key)
+        if value is None:
+            with self._lock:
+                self.misses += 1
+            return None, None
+        self._count_hit(source, render_seconds, size)
+        return value, source
+
+    def put(self, key, value, render_seconds=0.0):
+        payload = json.dumps(value).encode()
+        self._memory_put(key, payload, render_seconds)
+        if self.disk_dir:
+            self._disk_put(key, payload, render_seconds)
+        with self._lock:
+            self.stores += 1
+
+    def get_or_compute(self, key, compute):
+        """命中时返回 (缓存值, source)；否则调用 compute() 生成并写入缓存，返回 (值, "computed")
+
+        同一个键正在生成时等待那次生成的结果 (source 为 "inflight")；那次生成失败时自己重新生成。
+        """
+        value, source, render_seconds, size = self._lookup(key)
+        if value is not None:
+            self._count_hit(source, render_seconds, size)
+            return value, source
+
+        with self._lock:
+            waiter = self._inflight.get(key)
+            if waiter is None:
+                self._inflight[key] = threading.Event()
+        if waiter is not None:
+            waiter.wait()
+            value, _, render_seconds, size = self._lookup(key)
+            if value is not None:
+                self._count_hit("inflight", render_seconds, size)
+                return value, "inflight"
+            return self.get_or_compute(key, compute)
+
+        with self._lock:
+            self.misses += 1
+        try:
+            start = time.perf_counter()
+            value = compute()
+            self.put(key, value, time.perf_counter() - start)
+            return value, "computed"
+        finally:
+            with self._lock:
+                self._inflight.pop(key).set()
+
+    async def get_or_compute_async(self, key, compute):
+        """get_or_compute() 的异步版本，compute 是返回 (value, render_seconds) 的协程函数
+
+        compute 返回的 value 为 None 时不写入缓存 (例如结果与请求参数不一致)，此时返回
+        (None, "computed")，等待者各自重新生成。查找和写入在默认线程池中执行。
+        """
+        loop = asyncio.get_running_loop()
+        value, source, render_seconds, size = await loop.run_in_executor(None, self._lookup, key)
+        if value is not None:
+            self._count_hit(source, render_seconds, size)
+            return value, source
+
+        with self._lock:
+            waiter = self._async_inflight.get(key)
+            if waiter is None:
+                self._async_inflight[key] = loop.create_future()
+        if waiter is not None:
+            await asyncio.shield(waiter)
+            value, _, render_seconds, size = await loop.run_in_executor(None, self._lookup, key)
+            if value is not None:
+                self._count_hit("inflight", render_seconds, size)
+                return value, "inflight"
+            return await self.get_or_compute_async(key, compute)
+
+        with self._lock:
+            self.misses += 1
+        try:
+            value, render_seconds = await compute()
+            if value is not None:
+                await loop.run_in_executor(None, self.put, key, value, render_seconds)
+            return value, "computed"
+        finally:
+            with self._lock:
+                future = self._async_inflight.pop(key)
+            future.set_result(None)
+
+    def stats(self):
+        with self._lock:
+            hits = self.hits_memory + self.hits_disk + self.hits_inflight
+            lookups = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "disk_dir": self.disk_dir,
+                "disk_bytes": self._disk_bytes,
+                "max_disk_bytes": self.max_disk_bytes if self.disk_dir else None,
+                "hits": hits,
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "hits_inflight": self.hits_inflight,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evictions_memory": self.evictions_memory,
+                "evictions_disk": self.evictions_disk,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "bytes_saved": self.bytes_saved,
+                "seconds_saved": round(self.seconds_saved, 3),
+            }
@@ -0,0 +1,103 @@
+"""
+采样器 (scheduler) 注册表
+
+所有采样器都从模型自带的同一份 scheduler 配置构建，每种 (采样器, Karras) 组合只
+构建一次并缓存，请求之间切换采样器只是替换 pipeline.scheduler，不需要重新加载
+任何权重。DPM++ 2M / UniPC 这类多步采样器通常 8-15 步就能达到 Euler 30 步的质量。
+"""
+
+import inspect
+import logging
+import threading
+
+import diffusers
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SCHEDULER_CLASS = "EulerDiscreteScheduler"
+
+# SDXL 的 scheduler 配置 (缺失 scheduler_config.json 或其中有 None 值时使用)
+BASE_SCHEDULER_CONFIG = {
+    "num_train_timesteps": 1000,
+    "beta_start": 0.00085,
+    "beta_end": 0.012,
+    "beta_schedule": "scaled_linear",
+    "prediction_type": "epsilon",
+    "clip_sample": False,
+    "set_alpha_to_one": False,
+    "steps_offset": 1,
+    "timestep_spacing": "leading",
+    "skip_prk_steps": True,
+    "use_karras_sigmas": False,
+    "sample_max_value": 1.0,
+    "trained_betas": None,
+}
+
+# 名称 -> (diffusers 类名, 在共享配置上覆盖的参数)
+SAMPLERS = {
+    "euler": ("EulerDiscreteScheduler", {}),
+    "euler_a": ("EulerAncestralDiscreteScheduler", {}),
+    "heun": ("HeunDiscreteScheduler", {}),
+    "dpmpp_2m": ("DPMSolverMultistepScheduler", {"algorithm_type": "dpmsolver++", "solver_order": 2}),
+    "dpmpp_2m_sde": ("DPMSolverMultistepScheduler", {"algorithm_type": "sde-dpmsolver++", "solver_order": 2}),
+    "unipc": ("UniPCMultistepScheduler", {}),
+    "deis": ("DEISMultistepScheduler", {}),
+    "ddim": ("DDIMScheduler", {}),
+}
+
+
+def supports_karras(name):
+    """采样器是否支持 use_karras_sigmas"""
+    cls = getattr(diffusers, SAMPLERS[name][0])
+    return "use_karras_sigmas" in inspect.signature(cls.__init__).parameters
+
+
+def validate_sampler(name, karras=False, default="euler"):
+    """检查采样器名称和 Karras 组合，返回规范化后的名称；无效时抛出 ValueError"""
+    name = str(name or default).lower()
+    if name not in SAMPLERS:
+        raise ValueError(f"Unknown sampler: {name} (expected one of {sorted(SAMPLERS)})")
+    if karras and not supports_karras(name):
+        raise ValueError(f"Sampler {name} does not support Karras sigmas")
+    return name
+
+
+class SchedulerRegistry:
+    """按 (采样器名, Karras) 缓存 scheduler 实例
+
+    scheduler 在 set_timesteps()/step() 中有内部状态，同一实例只能被一个
+    pipeline 调用同时使用；handler 在 pipeline_lock 内切换和使用它们。
+    """
+
+    def __init__(self, base_config, default="euler"):
+        validate_sampler(default)
+        self.base_config = dict(base_config)
+        self.default = default
+        self._lock = threading.Lock()
+        self._schedulers = {}
+        self._uses = {}
+
+    def get(self, name=None, karras=False):
+        """返回 (缓存的) scheduler 实例"""
+        name = validate_sampler(name, karras, self.default)
+        key = (name, bool(karras))
+        with self._lock:
+            scheduler = self._schedulers.get(key)
+            if scheduler is None:
+                class_name, overrides = SAMPLERS[name]
+                config = {**self.base_config, **overrides}
+                if supports_karras(name):
+                    config["use_karras_sigmas"] = bool(karras)
+                scheduler = getattr(diffusers, class_name).from_config(config)
+                self._schedulers[key] = scheduler
+                logger.info(f"🗓️ 构建采样器: {name}{' (karras)' if karras else ''} -> {class_name}")
+            self._uses[key] = self._uses.get(key, 0) + 1
+            return scheduler
+
+    def stats(self):
+        with self._lock:
+            return {
+                "default": self.default,
+                "available": sorted(SAMPLERS),
+                "uses": {f"{name}{'+karras' if karras else ''}": count for (name, karras), count in self._uses.items()},
+            }
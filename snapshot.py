@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+单文件 fp16 快照 (compiled snapshot)
+
+把 pipeline 的四个模型组件导出为 <模型目录>/snapshot/ 下的一个 safetensors 文件和
+一个合并配置 snapshot.json:
+
+- 权重文件按组件顺序写入 (unet, vae, text_encoder, text_encoder_2)，每个组件的张量
+  在文件中占用一段连续的字节区间，区间记录在 snapshot.json 的 layout 中
+- snapshot.json 包含 model_index、每个组件的类名和配置、scheduler 配置，加载时
+  不需要再读取各组件目录中的 config.json
+- source_files 记录导出时源文件的大小和 mtime，源目录被修改后快照自动失效
+
+tokenizer 仍从原目录加载 (只有几百 KB 的词表文件)。
+
+使用方法:
+python snapshot.py [模型目录] [--dtype fp16|bf16|fp32] [--variant fp16]
+"""
+
+import argparse
+import json
+import logging
+import os
+import struct
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from mmap_loader import MMAP_COMPONENTS, _component_class, load_pipeline_mmap, materialize, read_tensors
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIRNAME = "snapshot"
+SNAPSHOT_CONFIG = "snapshot.json"
+SNAPSHOT_VERSION = 1
+
+DTYPES = {"fp16": torch.float16, "bf16": torch.bfloat16, "fp32": torch.float32}
+
+# torch dtype -> safetensors 头部中的 dtype 名称
+_SAFETENSORS_DTYPES = {
+    torch.float16: "F16",
+    torch.bfloat16: "BF16",
+    torch.float32: "F32",
+    torch.float64: "F64",
+    torch.int64: "I64",
+    torch.int32: "I32",
+    torch.int16: "I16",
+    torch.int8: "I8",
+    torch.uint8: "U8",
+    torch.bool: "BOOL",
+}
+
+# safetensors 要求数据区按 8 字节对齐
+_ALIGNMENT = 8
+
+
+def snapshot_dir(model_path):
+    return os.path.join(model_path, SNAPSHOT_DIRNAME)
+
+
+def source_files(model_path):
+    """快照依赖的源文件: {相对路径: [大小, mtime_ns]}"""
+    files = {}
+    paths = [os.path.join(model_path, "model_index.json")]
+    for name in MMAP_COMPONENTS + ["scheduler"]:
+        component_path = os.path.join(model_path, name)
+        if os.path.isdir(component_path):
+            paths += [os.path.join(component_path, n) for n in sorted(os.listdir(component_path)) if not n.startswith(".")]
+    for path in paths:
+        if os.path.isfile(path):
+            st = os.stat(path)
+            files[os.path.relpath(path, model_path).replace(os.sep, "/")] = [st.st_size, st.st_mtime_ns]
+    return files
+
+
+def _component_config(component):
+    if hasattr(component.config, "to_dict"):
+        # transformers PretrainedConfig
+        return component.config.to_dict()
+    # diffusers FrozenDict
+    return {k: v for k, v in dict(component.config).items() if k != "_name_or_path"}
+
+
+def write_safetensors(path, groups, metadata=None):
+    """按 groups 的顺序流式写出 safetensors 文件，返回每组的 {"offset", "bytes", "tensors"}
+
+    groups 是 [(前缀, state_dict)]；同一组的张量在数据区中连续存放，整个文件不需要
+    在内存中拼成一个 dict。
+    """
+    header = {}
+    layout = {}
+    offset = 0
+    for prefix, state_dict in groups:
+        start = offset
+        for key, tensor in state_dict.items():
+            size = tensor.numel() * tensor.element_size()
+            header[f"{prefix}.{key}"] = {
+                "dtype": _SAFETENSORS_DTYPES[tensor.dtype],
+                "shape": list(tensor.shape),
+                "data_offsets": [offset, offset + size],
+            }
+            offset += size
+        layout[prefix] = {"offset": start, "bytes": offset - start, "tensors": len(state_dict)}
+    if metadata:
+        header["__metadata__"] = metadata
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+    header_bytes += b" " * (-len(header_bytes) % _ALIGNMENT)
+    data_start = 8 + len(header_bytes)
+
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for _, state_dict in groups:
+            for tensor in state_dict.values():
+                if tensor.numel():
+                    f.write(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+
+    for info in layout.values():
+        info["offset"] += data_start
+    return layout
+
+
+def export_snapshot(model_path, dtype="fp16", variant=None):
+    """导出快照，返回 snapshot.json 的内容"""
+    from diffusers import StableDiffusionXLPipeline
+
+    torch_dtype = DTYPES[dtype]
+    start = time.perf_counter()
+    stamp = source_files(model_path)
+    try:
+        pipe, _ = load_pipeline_mmap(model_path, StableDiffusionXLPipeline, torch_dtype=torch_dtype, variant=variant)
+    except Exception as e:
+        # 例如只有 .bin 权重
+        logger.info(f"ℹ️ mmap 加载失败 ({e})，改用 from_pretrained")
+        pipe = StableDiffusionXLPipeline.from_pretrained(model_path, torch_dtype=torch_dtype, variant=variant)
+
+    with open(os.path.join(model_path, "model_index.json")) as f:
+        model_index = json.load(f)
+
+    out_dir = snapshot_dir(model_path)
+    os.makedirs(out_dir, exist_ok=True)
+    weights_name = f"pipeline.{dtype}.safetensors"
+    tmp_weights = os.path.join(out_dir, f"{weights_name}.tmp.{os.getpid()}")
+    groups = [(name, getattr(pipe, name).state_dict()) for name in MMAP_COMPONENTS]
+    layout = write_safetensors(tmp_weights, groups, metadata={"format": "pt"})
+
+    config = {
+        "version": SNAPSHOT_VERSION,
+        "dtype": dtype,
+        "weights": weights_name,
+        "model_index": model_index,
+        "components": {
+            name: {"class": model_index[name], "config": _component_config(getattr(pipe, name))}
+            for name in MMAP_COMPONENTS
+        },
+        "scheduler": {"class": model_index["scheduler"], "config": dict(pipe.scheduler.config)},
+        "layout": layout,
+        "source_files": stamp,
+        "created_at": time.time(),
+    }
+
+    # 先替换权重再写配置：配置存在即表示快照完整
+    config_path = os.path.join(out_dir, SNAPSHOT_CONFIG)
+    if os.path.exists(config_path):
+        os.remove(config_path)
+    os.replace(tmp_weights, os.path.join(out_dir, weights_name))
+    tmp_config = f"{config_path}.tmp.{os.getpid()}"
+    with open(tmp_config, "w") as f:
+        json.dump(config, f, indent=2)
+    os.replace(tmp_config, config_path)
+
+    for name in os.listdir(out_dir):
+        if name.endswith(".safetensors") and name != weights_name:
+            os.remove(os.path.join(out_dir, name))
+
+    size_mb = sum(info["bytes"] for info in layout.values()) / 2 ** 20
+    logger.info(f"📦 快照已导出: {out_dir} ({size_mb:.1f} MB, {time.perf_counter() - start:.2f}s)")
+    return config
+
+
+def load_snapshot_config(model_path):
+    """读取与源目录一致的快照配置；不存在、版本不符或已过期时返回 None"""
+    config_path = os.path.join(snapshot_dir(model_path), SNAPSHOT_CONFIG)
+    try:
+        with open(config_path) as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"⚠️ 读取快照配置失败: {e}")
+        return None
+
+    if config.get("version") != SNAPSHOT_VERSION:
+        logger.info("ℹ️ 快照版本不匹配，忽略")
+        return None
+    if config.get("source_files") != source_files(model_path):
+        logger.info("ℹ️ 模型目录在导出快照后被修改，快照已过期")
+        return None
+    return config
+
+
+def load_snapshot(model_path, pipeline_cls, torch_dtype=torch.float16, device="cpu", workers=4):
+    """从快照加载 pipeline，返回 (pipeline, stats)，stats 与 load_pipeline_mmap() 相同"""
+    start = time.perf_counter()
+    config = load_snapshot_config(model_path)
+    if config is None:
+        raise FileNotFoundError(f"No valid snapshot in {snapshot_dir(model_path)}")
+    weights_path = os.path.join(snapshot_dir(model_path), config["weights"])
+
+    def _load_model(name):
+        component_start = time.perf_counter()
+        info = config["components"][name]
+        cls = _component_class({name: info["class"]}, name)
+        state_dict, size = read_tensors(weights_path, torch_dtype, device, prefix=f"{name}.")
+        model = materialize(cls, info["config"], state_dict, device, name)
+        return model, {"bytes": size, "seconds": round(time.perf_counter() - component_start, 4), "files": [config["weights"]]}
+
+    def _load_tokenizer(name):
+        return _component_class(config["model_index"], name).from_pretrained(model_path, subfolder=name)
+
+    workers = max(1, int(workers))
+    with ThreadPoolExecutor(workers, thread_name_prefix="snapshot") as executor:
+        model_futures = {name: executor.submit(_load_model, name) for name in MMAP_COMPONENTS}
+        tokenizer_futures = {name: executor.submit(_load_tokenizer, name) for name in ("tokenizer", "tokenizer_2")}
+
+        components, component_stats = {}, {}
+        for name, future in model_futures.items():
+            components[name], component_stats[name] = future.result()
+        for name, future in tokenizer_futures.items():
+            components[name] = future.result()
+
+    scheduler_cls = _component_class({"scheduler": config["scheduler"]["class"]}, "scheduler")
+    components["scheduler"] = scheduler_cls.from_config(config["scheduler"]["config"])
+
+    extra = {k: v for k, v in config["model_index"].items() if not k.startswith("_") and not isinstance(v, list)}
+    pipe = pipeline_cls(**components, **extra)
+
+    seconds = time.perf_counter() - start
+    logger.info(f"   ⏱️ 快照加载完成 ({workers} 线程), 总耗时 {seconds:.2f}s")
+    return pipe, {"workers": workers, "seconds": round(seconds, 4), "components": component_stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出单文件 fp16 快照")
+    parser.add_argument("model_path", nargs="?", default=os.environ.get("LOCAL_MODEL_PATH", "/runpod-volume/photonicfusion-sdxl"))
+    parser.add_argument("--dtype", choices=sorted(DTYPES), default="fp16")
+    parser.add_argument("--variant", default=None, help="读取源目录中的权重变体，例如 fp16")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    config = export_snapshot(args.model_path, args.dtype, args.variant)
+    for name, info in config["layout"].items():
+        print(f"   {name}: offset {info['offset']}, {info['bytes'] / 2 ** 20:.1f} MB, {info['tensors']} tensors")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+流式进度和中间预览
+
+通过 pipeline 的 callback_on_step_end 在每个去噪步骤后产生进度事件，并可每
+N 步附带一张低分辨率预览图。预览使用 SDXL latent -> RGB 的线性近似
+(4x3 矩阵 + 偏置)，不经过 VAE 解码，开销可以忽略。
+"""
+
+import base64
+import logging
+import queue
+import threading
+from io import BytesIO
+
+import numpy as np
+import torch
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# SDXL latent 通道到 RGB 的线性近似系数
+SDXL_LATENT_RGB_FACTORS = [
+    [0.3651, 0.4232, 0.4341],
+    [-0.2533, -0.0042, 0.1068],
+    [0.1076, 0.1111, -0.0362],
+    [-0.3165, -0.2492, -0.2188],
+]
+SDXL_LATENT_RGB_BIAS = [0.1084, -0.0175, -0.0011]
+
+
+def latents_to_preview(latents, max_size=256):
+    """把 (B, 4, h, w) latent 近似转换为 PIL 图像列表"""
+    latents = latents.detach().float().cpu()
+    factors = torch.tensor(SDXL_LATENT_RGB_FACTORS, dtype=torch.float32)
+    bias = torch.tensor(SDXL_LATENT_RGB_BIAS, dtype=torch.float32)
+
+    rgb = torch.einsum("bchw,cr->bhwr", latents[:, :4], factors) + bias
+    rgb = ((rgb + 1.0) / 2.0).clamp(0, 1).mul(255).round().to(torch.uint8).numpy()
+
+    previews = []
+    for array in rgb:
+        image = Image.fromarray(np.ascontiguousarray(array))
+        image.thumbnail((max_size, max_size))
+        previews.append(image)
+    return previews
+
+
+def encode_preview(image, quality=70):
+    """预览图用低质量 JPEG 编码，体积只有几 KB"""
+    buffered = BytesIO()
+    image.save(buffered, format="JPEG", quality=quality)
+    with buffered.getbuffer() as view:
+        return base64.b64encode(view).decode("ascii")
+
+
+class StepStreamer:
+    """生成 callback_on_step_end 回调，把进度 / 预览事件放入队列
+
+    cancel() 之后下一次回调会设置 pipeline 的 _interrupt 标志，diffusers 会跳过剩余步骤。
+    """
+
+    def __init__(self, total_steps, preview_every=0, preview_size=256):
+        self.total_steps = total_steps
+        self.preview_every = max(0, int(preview_every or 0))
+        self.preview_size = preview_size
+        self.events = queue.Queue()
+        self.cancelled = threading.Event()
+        self._chunk = 0
+        self._last_step = -1
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def callback(self, pipe, step, timestep, callback_kwargs):
+        if self.cancelled.is_set():
+            pipe._interrupt = True
+            return callback_kwargs
+
+        # 按显存分块多次调用 pipeline 时，步数会从 0 重新开始
+        if step <= self._last_step:
+            self._chunk += 1
+        self._last_step = step
+
+        done = step + 1
+        event = {"type": "progress", "step": done, "total": self.total_steps, "chunk": self._chunk}
+        self.events.put(event)
+
+        latents = callback_kwargs.get("latents")
+        if self.preview_every and latents is not None and (done % self.preview_every == 0 or done == self.total_steps):
+            try:
+                previews = latents_to_preview(latents, self.preview_size)
+                self.events.put({
+                    "type": "preview",
+                    "step": done,
+                    "chunk": self._chunk,
+                    "images": [encode_preview(p) for p in previews],
+                })
+            except Exception as e:
+                logger.warning(f"⚠️ 生成预览失败: {e}")
+
+        return callback_kwargs
+
+
+_DONE = object()
+
+
+def stream_generation(generate, streamer):
+    """在工作线程中运行 generate(streamer)，边生成边产出事件
+
+    最后产出 {"type": "result", ...} 或 {"type": "error", ...}。消费方提前关闭
+    生成器时会取消剩余去噪步骤。
+    """
+    outcome = {}
+
+    def _run():
+        try:
+            outcome["result"] = generate(streamer)
+        except Exception as e:
+            outcome["error"] = e
+        finally:
+            streamer.events.put(_DONE)
+
+    worker = threading.Thread(target=_run, name="stream-generation", daemon=True)
+    worker.start()
+
+    try:
+        while True:
+            event = streamer.events.get()
+            if event is _DONE:
+                break
+            yield event
+    finally:
+        # 客户端断开 / 生成器被关闭：让 pipeline 尽快结束
+        if worker.is_alive():
+            streamer.cancel()
+
+    worker.join()
+    if "error" in outcome:
+        yield {"type": "error", "error": str(outcome["error"])}
+    else:
+        yield {"type": "result", **outcome["result"]}
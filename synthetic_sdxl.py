@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+微型随机初始化 SDXL pipeline (CPU 基准测试 / 测试用)
+
+组件布局与 PhotonicFusionSDXL_V3-diffusers-manual/model_index.json 相同
+(unet / vae / text_encoder / text_encoder_2 / tokenizer / tokenizer_2 / scheduler)，
+但每个网络只有几万个参数，可以在 CPU 上秒级加载和推理。
+
+使用方法:
+python synthetic_sdxl.py /tmp/tiny-sdxl [--bin] [--no-fp16-variant]
+"""
+
+import argparse
+import json
+import os
+
+import torch
+
+# 与 create_missing_configs() 写入的调度器配置一致
+SCHEDULER_CONFIG = {
+    "beta_end": 0.012,
+    "beta_schedule": "scaled_linear",
+    "beta_start": 0.00085,
+    "num_train_timesteps": 1000,
+    "prediction_type": "epsilon",
+    "steps_offset": 1,
+    "timestep_spacing": "leading",
+    "use_karras_sigmas": False,
+}
+
+TINY_VOCAB_WORDS = [
+    "a", "cat", "dog", "test", "photo", "of", "the", "blurry", "low", "quality",
+    "distorted", "ugly", "beautiful", "sunset", "over", "mountains", "landscape",
+    "with", "and", "lake", "high", "detailed", "photorealistic", "bad", "anatomy",
+]
+
+
+def _write_tiny_vocab(directory):
+    """写入微型 vocab.json / merges.txt，返回两者路径"""
+    vocab = {"<|startoftext|>": 0, "<|endoftext|>": 1, "!": 2}
+    for word in TINY_VOCAB_WORDS:
+        vocab.setdefault(word + "</w>", len(vocab))
+    for ch in "abcdefghijklmnopqrstuvwxyz":
+        vocab.setdefault(ch, len(vocab))
+        vocab.setdefault(ch + "</w>", len(vocab))
+
+    vocab_path = os.path.join(directory, "vocab.json")
+    merges_path = os.path.join(directory, "merges.txt")
+    with open(vocab_path, "w") as f:
+        json.dump(vocab, f)
+    with open(merges_path, "w") as f:
+        f.write("#version: 0.2\n")
+    return vocab_path, merges_path
+
+
+def _tiny_tokenizer():
+    """构建一个只有几十个词的 CLIPTokenizer (未知词映射到 <|endoftext|>)"""
+    import tempfile
+    from transformers import CLIPTokenizer
+
+    with tempfile.TemporaryDirectory() as tmp:
+        vocab_path, merges_path = _write_tiny_vocab(tmp)
+        return CLIPTokenizer(
+            vocab_path, merges_path,
+            unk_token="<|endoftext|>", pad_token="<|endoftext|>",
+            model_max_length=77,
+        )
+
+
+def build_tiny_components(seed=0):
+    """返回随机初始化的微型 SDXL 组件字典"""
+    from diffusers import AutoencoderKL, EulerDiscreteScheduler, UNet2DConditionModel
+    from transformers import CLIPTextConfig, CLIPTextModel, CLIPTextModelWithProjection
+
+    torch.manual_seed(seed)
+
+    unet = UNet2DConditionModel(
+        sample_size=8,
+        in_channels=4,
+        out_channels=4,
+        layers_per_block=1,
+        block_out_channels=(32, 64),
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        attention_head_dim=(2, 4),
+        use_linear_projection=True,
+        addition_embed_type="text_time",
+        addition_time_embed_dim=8,
+        transformer_layers_per_block=(1, 1),
+        projection_class_embeddings_input_dim=80,  # 6 * 8 + 32
+        cross_attention_dim=64,
+        norm_num_groups=8,
+    )
+    vae = AutoencoderKL(
+        in_channels=3,
+        out_channels=3,
+        down_block_types=["DownEncoderBlock2D", "DownEncoderBlock2D", "DownEncoderBlock2D", "DownEncoderBlock2D"],
+        up_block_types=["UpDecoderBlock2D", "UpDecoderBlock2D", "UpDecoderBlock2D", "UpDecoderBlock2D"],
+        block_out_channels=[8, 8, 8, 8],
+        latent_channels=4,
+        norm_num_groups=8,
+        layers_per_block=1,
+        sample_size=64,
+    )
+
+    text_config = CLIPTextConfig(
+        bos_token_id=0,
+        eos_token_id=1,
+        pad_token_id=1,
+        hidden_size=32,
+        intermediate_size=37,
+        layer_norm_eps=1e-05,
+        num_attention_heads=4,
+        num_hidden_layers=3,
+        vocab_size=1000,
+        hidden_act="gelu",
+        projection_dim=32,
+    )
+    text_encoder = CLIPTextModel(text_config)
+    text_encoder_2 = CLIPTextModelWithProjection(text_config)
+
+    tokenizer = _tiny_tokenizer()
+    tokenizer_2 = _tiny_tokenizer()
+
+    scheduler = EulerDiscreteScheduler(**SCHEDULER_CONFIG)
+
+    return {
+        "unet": unet,
+        "vae": vae,
+        "text_encoder": text_encoder,
+        "text_encoder_2": text_encoder_2,
+        "tokenizer": tokenizer,
+        "tokenizer_2": tokenizer_2,
+        "scheduler": scheduler,
+    }
+
+
+def build_tiny_pipeline(seed=0):
+    """构建一个可直接调用的微型 StableDiffusionXLPipeline (CPU, float32)"""
+    from diffusers import StableDiffusionXLPipeline
+
+    pipe = StableDiffusionXLPipeline(**build_tiny_components(seed))
+    pipe.set_progress_bar_config(disable=True)
+    return pipe
+
+
+def write_tiny_model_dir(path, seed=0, safetensors=True, fp16_variant=True):
+    """把微型 pipeline 以 diffusers 目录格式写入 path
+
+    fp16_variant=True 时额外写入 *.fp16.safetensors 变体文件，模拟卷上的正式模型布局。
+    """
+    pipe = build_tiny_pipeline(seed)
+    pipe.save_pretrained(path, safe_serialization=safetensors)
+
+    # 与卷上的 model_index.json 保持一致：不登记未使用的 feature_extractor / image_encoder
+    model_index_path = os.path.join(path, "model_index.json")
+    with open(model_index_path) as f:
+        model_index = json.load(f)
+    model_index = {k: v for k, v in model_index.items() if v != [None, None]}
+    with open(model_index_path, "w") as f:
+        json.dump(model_index, f, indent=2)
+
+    # handler.load_model() 会检查 vocab.json / merges.txt 是否存在
+    for name in ["tokenizer", "tokenizer_2"]:
+        _write_tiny_vocab(os.path.join(path, name))
+
+    if fp16_variant and safetensors:
+        for name in ["unet", "vae", "text_encoder", "text_encoder_2"]:
+            component = getattr(pipe, name)
+            component.to(torch.float16).save_pretrained(
+                os.path.join(path, name), safe_serialization=True, variant="fp16"
+            )
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成微型随机 SDXL 模型目录")
+    parser.add_argument("path", help="输出目录")
+    parser.add_argument("--bin", action="store_true", help="使用 .bin 而不是 safetensors")
+    parser.add_argument("--no-fp16-variant", action="store_true", help="不写入 fp16 变体文件")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    write_tiny_model_dir(
+        args.path,
+        seed=args.seed,
+        safetensors=not args.bin,
+        fp16_variant=not args.no_fp16_variant,
+    )
+    print(f"✅ 微型 SDXL 模型已写入: {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+测试自适应步数：收敛检测、Euler 外推和 handler 集成 (CPU, 微型合成 SDXL 模型)
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import torch
+from diffusers import EulerDiscreteScheduler, DDIMScheduler
+
+import handler
+from adaptive_steps import ConvergenceMonitor, latent_delta, validate_threshold
+from result_cache import request_key
+from synthetic_sdxl import SCHEDULER_CONFIG, build_tiny_pipeline
+
+
+def _drive(monitor, scheduler, steps=8):
+    """按 pipeline 的方式驱动 scheduler，每步后调用 monitor；返回 (最终 latent, 每步 pred_original_sample)"""
+    pipe = SimpleNamespace(scheduler=scheduler, _interrupt=False)
+    scheduler.set_timesteps(steps)
+    latents = torch.randn(1, 4, 8, 8, generator=torch.Generator().manual_seed(0)) * scheduler.init_noise_sigma
+    eps = torch.randn(1, 4, 8, 8, generator=torch.Generator().manual_seed(1))
+    originals = []
+    for i, t in enumerate(scheduler.timesteps):
+        if pipe._interrupt:
+            continue
+        scheduler.scale_model_input(latents, t)
+        output = scheduler.step(eps * 0.5, t, latents)
+        originals.append(getattr(output, "pred_original_sample", None))
+        latents = monitor.callback(pipe, i, t, {"latents": output.prev_sample})["latents"]
+    return latents, originals
+
+
+def test_threshold_validation_and_delta():
+    assert validate_threshold("0.02") == 0.02
+    for bad in ("abc", -1, float("nan"), None):
+        try:
+            validate_threshold(bad)
+            raise AssertionError(f"expected ValueError for {bad!r}")
+        except ValueError:
+            pass
+
+    # 批内取最大的相对变化
+    previous = torch.ones(2, 4, 2, 2)
+    current = torch.stack([torch.ones(4, 2, 2), torch.full((4, 2, 2), 2.0)])
+    assert abs(latent_delta(previous, current) - 0.5) < 1e-6
+
+
+def test_monitor_extrapolates_euler_to_x0():
+    scheduler = EulerDiscreteScheduler.from_config(SCHEDULER_CONFIG)
+    monitor = ConvergenceMonitor(8, threshold=10.0, min_steps=3, patience=1)
+    latents, originals = _drive(monitor, scheduler)
+
+    assert monitor.exited_at == 3 and monitor.steps_run == 3 and monitor.extrapolated
+    # 沿最后一步导数外推到 sigma=0，等于最后一次预测的 x0
+    assert torch.allclose(latents, originals[-1], atol=1e-4)
+
+    # 阈值为 0 时从不提前结束
+    never = ConvergenceMonitor(8, threshold=0.0, min_steps=1)
+    _drive(never, EulerDiscreteScheduler.from_config(SCHEDULER_CONFIG))
+    assert never.exited_at is None and never.steps_run == 8 and len(never.deltas) == 7
+
+
+def test_monitor_stops_other_samplers_without_extrapolating():
+    monitor = ConvergenceMonitor(8, threshold=10.0, min_steps=4, patience=2, mode="extrapolate")
+    _drive(monitor, DDIMScheduler.from_config(SCHEDULER_CONFIG))
+    assert monitor.exited_at == 4 and not monitor.extrapolated
+
+
+def test_handler_adaptive_requests():
+    saved = handler.pipeline, handler.MAX_BATCH_SIZE, handler.ADAPTIVE_MIN_STEPS, handler.job_queue
+    handler.pipeline, handler.MAX_BATCH_SIZE, handler.ADAPTIVE_MIN_STEPS = build_tiny_pipeline(), 1, 4
+    handler.job_queue = None
+    before = handler.adaptive_stats.stats()
+    try:
+        base = {"prompt": "a cat", "num_inference_steps": 12, "width": 64, "height": 64, "seed": 3, "return_timings": True}
+        fixed = handler.handler({"input": base})
+        adaptive = handler.handler({"input": {**base, "adaptive_steps": True, "adaptive_threshold": 1.0}})
+        invalid = handler.handler({"input": {**base, "adaptive_steps": True, "adaptive_threshold": "x"}})
+        after = handler.adaptive_stats.stats()
+        params = handler.parse_request({**base, "adaptive_steps": True})
+        queued = asyncio.run(handler.handler_async(
+            {"input": {**base, "seed": 4, "adaptive_steps": True, "adaptive_threshold": 1.0}}
+        ))
+    finally:
+        if handler.job_queue is not None:
+            handler.job_queue.close()
+        handler.pipeline, handler.MAX_BATCH_SIZE, handler.ADAPTIVE_MIN_STEPS, handler.job_queue = saved
+
+    assert fixed["adaptive_threshold"] is None and len(fixed["timings"]["steps_ms"]) == 12
+    assert adaptive["adaptive_threshold"] == 1.0 and len(adaptive["timings"]["steps_ms"]) == 4
+    assert "cache" not in adaptive and adaptive["image"] != fixed["image"]
+    assert "adaptive_threshold" in invalid["error"]
+    assert after["early_exits"] - before["early_exits"] == 1
+    assert after["steps_saved"] - before["steps_saved"] == 8
+    # 任务队列的耗时模型按实际运行的步数更新
+    assert queued["queue"]["steps_run"] == 4 and queued["num_inference_steps"] == 12
+
+    # 默认阈值来自 ADAPTIVE_THRESHOLD；阈值不同的请求不共享结果缓存
+    assert params["adaptive_threshold"] == handler.ADAPTIVE_THRESHOLD
+    assert request_key(params, "m") != request_key({**params, "adaptive_threshold": None}, "m")
+
+
+def test_adaptive_requests_are_not_batched():
+    import threading
+
+    saved = handler.pipeline, handler.MAX_BATCH_SIZE, handler.ADAPTIVE_MIN_STEPS, handler.result_cache
+    handler.pipeline, handler.MAX_BATCH_SIZE, handler.ADAPTIVE_MIN_STEPS = build_tiny_pipeline(), 4, 2
+    handler.result_cache = None
+    submitted = []
+    batcher = handler.get_batcher()
+    submit = batcher.submit
+    batcher.submit = lambda *args, **kwargs: submitted.append(args) or submit(*args, **kwargs)
+    try:
+        base = {"prompt": "a cat", "num_inference_steps": 8, "width": 64, "height": 64}
+        alone = handler.handler({"input": {**base, "seed": 1, "adaptive_steps": True, "adaptive_threshold": 0.05}})
+        results = []
+        threads = [
+            threading.Thread(target=lambda i=i: results.append(handler.handler({"input": {
+                **base, "seed": i, "adaptive_steps": True, "adaptive_threshold": 0.05
+            }})))
+            for i in (1, 2, 3)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        batcher.submit = submit
+        handler.pipeline, handler.MAX_BATCH_SIZE, handler.ADAPTIVE_MIN_STEPS, handler.result_cache = saved
+
+    # 同一个 seed 的结果不受同时到达的其它请求影响
+    assert not submitted
+    assert [r["image"] for r in results if r["seed"] == 1] == [alone["image"]]
+
+
+if __name__ == "__main__":
+    test_threshold_validation_and_delta()
+    test_monitor_extrapolates_euler_to_x0()
+    test_monitor_stops_other_samplers_without_extrapolating()
+    test_handler_adaptive_requests()
+    test_adaptive_requests_are_not_batched()
+    print("✅ 所有自适应步数测试通过")
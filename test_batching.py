@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+测试请求微批处理 (CPU, 使用替身 pipeline)
+"""
+
+import threading
+import time
+from types import SimpleNamespace
+
+from PIL import Image
+
+import handler
+from batching import MicroBatcher
+
+
+class StandInPipeline:
+    """替身 pipeline：记录每次调用的批大小，按 prompt 生成纯色图像"""
+
+    def __init__(self, delay=0.05):
+        self.calls = []
+        self.delay = delay
+
+    def __call__(self, prompt, negative_prompt, num_inference_steps, guidance_scale,
+                 width, height, generator=None, num_images_per_prompt=1, **kwargs):
+        prompts = prompt if isinstance(prompt, list) else [prompt]
+        prompts = [p for p in prompts for _ in range(num_images_per_prompt)]
+        self.calls.append({
+            "prompts": list(prompts),
+            "generator": generator,
+            "size": (width, height),
+            "num_images_per_prompt": num_images_per_prompt
+        })
+        time.sleep(self.delay)
+        images = [Image.new("RGB", (width, height), (len(p) % 256, 0, 0)) for p in prompts]
+        return SimpleNamespace(images=images)
+
+
+def _submit_concurrently(fn, args_list):
+    results = [None] * len(args_list)
+
+    def _worker(i, args):
+        results[i] = fn(*args)
+
+    threads = [threading.Thread(target=_worker, args=(i, a)) for i, a in enumerate(args_list)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_compatible_requests_share_one_batch():
+    calls = []
+
+    def run_batch(payloads):
+        calls.append(list(payloads))
+        return [p * 10 for p in payloads]
+
+    batcher = MicroBatcher(run_batch, max_batch_size=4, window_ms=200)
+    try:
+        results = _submit_concurrently(batcher.submit, [("k", i) for i in range(4)])
+    finally:
+        batcher.close()
+
+    assert results == [0, 10, 20, 30]
+    assert len(calls) == 1
+    stats = batcher.stats()
+    assert stats["batches"] == 1
+    assert stats["batch_fill_ratio"] == 1.0
+    assert stats["avg_queue_wait_ms"] >= 0.0
+
+
+def test_incompatible_requests_are_not_merged():
+    calls = []
+
+    def run_batch(payloads):
+        calls.append(list(payloads))
+        return payloads
+
+    batcher = MicroBatcher(run_batch, max_batch_size=4, window_ms=100)
+    try:
+        args = [("a", 1), ("b", 2), ("a", 3), ("b", 4)]
+        results = _submit_concurrently(batcher.submit, args)
+    finally:
+        batcher.close()
+
+    assert results == [1, 2, 3, 4]
+    for batch in calls:
+        assert len({p % 2 for p in batch}) == 1
+    assert batcher.stats()["requests"] == 4
+
+
+def test_batch_error_reaches_every_caller():
+    def run_batch(payloads):
+        raise ValueError("boom")
+
+    batcher = MicroBatcher(run_batch, max_batch_size=2, window_ms=10)
+    try:
+        try:
+            batcher.submit("k", 1)
+        except ValueError as e:
+            assert str(e) == "boom"
+        else:
+            raise AssertionError("expected ValueError")
+    finally:
+        batcher.close()
+
+
+def test_handler_batches_concurrent_jobs():
+    stand_in = StandInPipeline()
+    old_pipeline, old_batcher = handler.pipeline, handler.batcher
+    handler.pipeline = stand_in
+    handler.batcher = MicroBatcher(handler.generate_batch, max_batch_size=3, window_ms=200)
+
+    try:
+        events = [
+            ({"input": {"prompt": "p" * (i + 1), "width": 64, "height": 64,
+                        "num_inference_steps": 2, "seed": i}},)
+            for i in range(3)
+        ]
+        results = _submit_concurrently(handler.handler, events)
+        stats = handler.handler({"input": {"action": "stats"}})["batching"]
+    finally:
+        handler.batcher.close()
+        handler.pipeline, handler.batcher = old_pipeline, old_batcher
+
+    assert all("image" in r for r in results), results
+    assert [r["seed"] for r in results] == [0, 1, 2]
+    assert len(stand_in.calls) == 1
+    call = stand_in.calls[0]
+    assert sorted(call["prompts"]) == ["p", "pp", "ppp"]
+    assert isinstance(call["generator"], list) and len(call["generator"]) == 3
+    assert stats["batches"] == 1
+
+
+def test_multi_image_requests_fan_out_per_request():
+    stand_in = StandInPipeline(delay=0.1)
+    old_pipeline, old_batcher = handler.pipeline, handler.batcher
+    handler.pipeline = stand_in
+    handler.batcher = MicroBatcher(handler.generate_batch, max_batch_size=4, window_ms=200)
+
+    try:
+        events = [
+            ({"input": {"prompt": "a", "width": 64, "height": 64, "seed": 10, "num_images_per_prompt": 3}},),
+            ({"input": {"prompt": "b", "width": 64, "height": 64, "seed": 20}},),
+        ]
+        results = _submit_concurrently(handler.handler, events)
+    finally:
+        handler.batcher.close()
+        handler.pipeline, handler.batcher = old_pipeline, old_batcher
+
+    assert [img["seed"] for img in results[0]["images"]] == [10, 11, 12]
+    assert [img["seed"] for img in results[1]["images"]] == [20]
+    assert sum(len(c["prompts"]) for c in stand_in.calls) == 4
+
+
+if __name__ == "__main__":
+    test_compatible_requests_share_one_batch()
+    test_incompatible_requests_are_not_merged()
+    test_batch_error_reaches_every_caller()
+    test_handler_batches_concurrent_jobs()
+    test_multi_image_requests_fan_out_per_request()
+    print("✅ 所有微批处理测试通过")
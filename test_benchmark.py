@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+测试基准结果的回归对比，以及吞吐基准不受结果缓存影响
+"""
+
+from types import SimpleNamespace
+
+import handler
+from benchmark import bench_throughput, compare_results
+
+
+def _result(name, rows):
+    return {"benchmark": name, "meta": {"commit": "abc"}, "results": rows}
+
+
+def test_compare_flags_slower_and_lower_throughput():
+    baseline = _result("throughput", [
+        {"scenario": "concurrency=1", "requests": 8, "requests_per_s": 10.0, "p95_ms": 100.0, "errors": 0},
+        {"scenario": "concurrency=4", "requests": 8, "requests_per_s": 20.0, "p95_ms": 200.0, "errors": 0},
+    ])
+    current = _result("throughput", [
+        {"scenario": "concurrency=4", "requests": 8, "requests_per_s": 15.0, "p95_ms": 210.0, "errors": 1},
+        {"scenario": "concurrency=1", "requests": 8, "requests_per_s": 12.0, "p95_ms": 80.0, "errors": 0},
+    ])
+    changes = compare_results(baseline, current, threshold=0.1)
+
+    regressions = {(c["row"], c["metric"]) for c in changes if c["regression"]}
+    # 行按字符串字段匹配 (与顺序无关)；p95 只慢了 5%，不超过阈值
+    assert regressions == {("concurrency=4", "requests_per_s"), ("concurrency=4", "errors")}
+    assert {c["metric"] for c in changes} == {"requests_per_s", "p95_ms", "errors"}
+
+
+def test_compare_suite_results_and_duplicate_rows():
+    baseline = _result("suite", {
+        "samplers": [{"sampler": "euler", "steps": 8, "latency_ms": 10.0}, {"sampler": "euler", "steps": 15, "latency_ms": 20.0}],
+        "encode": [{"format": "png", "median_ms": 5.0, "samples_s": [0.005]}],
+    })
+    current = _result("suite", {
+        "samplers": [{"sampler": "euler", "steps": 8, "latency_ms": 10.0}, {"sampler": "euler", "steps": 15, "latency_ms": 30.0}],
+        "encode": [{"format": "png", "median_ms": 5.1, "samples_s": [0.0051]}],
+        "generate": [{"scenario": "64x64", "median_ms": 1.0}],
+    })
+    changes = compare_results(baseline, current)
+
+    # 同名行按出现顺序配对；只出现在一边的基准不参与对比；samples_s 不是指标
+    assert [(c["benchmark"], c["current"], c["regression"]) for c in changes] == [
+        ("samplers", 10.0, False), ("samplers", 30.0, True), ("encode", 5.1, False)
+    ]
+
+
+def test_throughput_benchmark_bypasses_result_cache():
+    # 每个并发级别的请求都要真正经过合批和去噪，而不是命中上一级别的缓存
+    cache = handler.result_cache
+    results = bench_throughput(SimpleNamespace(requests=4))
+    assert handler.result_cache is cache
+    assert [r["scenario"] for r in results] == [f"concurrency={c}" for c in (1, 2, 4, 8)]
+    assert all(r["avg_batch"] > 0 and r["errors"] == 0 for r in results), results
+
+
+if __name__ == "__main__":
+    test_compare_flags_slower_and_lower_throughput()
+    test_compare_suite_results_and_duplicate_rows()
+    test_throughput_benchmark_bypasses_result_cache()
+    print("✅ 所有基准对比测试通过")
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+测试分辨率分桶和 latent 缓冲池 (CPU, 微型合成 SDXL 模型)
+"""
+
+import base64
+from io import BytesIO
+
+import numpy as np
+import torch
+from PIL import Image
+
+import handler
+from buckets import LatentPool, nearest_bucket, fit_to_size
+from synthetic_sdxl import build_tiny_pipeline
+
+
+def test_requests_snap_to_nearest_aspect_ratio():
+    assert nearest_bucket(1000, 1000) == (1024, 1024)
+    assert nearest_bucket(1920, 1080) == (1344, 768)
+    assert nearest_bucket(512, 768) == (832, 1216)
+    assert nearest_bucket(640, 1600) == (640, 1536)
+
+
+def test_fit_restores_requested_size():
+    image = Image.new("RGB", (1344, 768))
+    assert fit_to_size(image, 1920, 1080, "crop").size == (1920, 1080)
+    assert fit_to_size(image, 1000, 600, "resize").size == (1000, 600)
+    assert fit_to_size(image, 1000, 600, "none") is image
+
+
+def test_pooled_latents_match_pipeline_noise():
+    pipe = build_tiny_pipeline()
+    pool = LatentPool()
+
+    def _run(latents=None):
+        generators = [torch.Generator().manual_seed(s) for s in (3, 4)]
+        kwargs = {"latents": pool.acquire(pipe, 64, 64, generators)} if latents else {}
+        return pipe(prompt="a cat", num_inference_steps=2, width=64, height=64, num_images_per_prompt=2,
+                    generator=generators, output_type="np", **kwargs).images
+
+    assert np.array_equal(_run(), _run(latents=True))
+    _run(latents=True)
+    stats = pool.stats()["64x64"]
+    assert stats == {"requests": 2, "hits": 1, "allocations": 1, "hit_rate": 0.5}
+
+
+def test_handler_generates_in_bucket_and_crops_back():
+    saved = (handler.pipeline, handler.latent_pool, handler.RESOLUTION_BUCKETING, handler.RESOLUTION_BUCKETS)
+    handler.pipeline = build_tiny_pipeline()
+    handler.latent_pool = LatentPool()
+    handler.RESOLUTION_BUCKETING = True
+    handler.RESOLUTION_BUCKETS = [(64, 64), (96, 64), (64, 96)]
+    try:
+        results = [
+            handler.handler({"input": {"prompt": "a cat", "width": 70, "height": 50, "num_inference_steps": 2,
+                                       "bucket_fit": "crop", "seed": i}})
+            for i in range(2)
+        ]
+        stats = handler.get_stats()["buckets"]
+    finally:
+        handler.pipeline, handler.latent_pool, handler.RESOLUTION_BUCKETING, handler.RESOLUTION_BUCKETS = saved
+
+    result = results[0]
+    assert result["bucket"] == "96x64"
+    assert (result["width"], result["height"]) == (64, 48)
+    assert Image.open(BytesIO(base64.b64decode(result["image"]))).size == (64, 48)
+    assert stats["96x64"]["requests"] == 2 and stats["96x64"]["hits"] == 1
+
+
+if __name__ == "__main__":
+    test_requests_snap_to_nearest_aspect_ratio()
+    test_fit_restores_requested_size()
+    test_pooled_latents_match_pipeline_noise()
+    test_handler_generates_in_bucket_and_crops_back()
+    print("✅ 所有分桶测试通过")
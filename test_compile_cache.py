@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+测试 UNet 编译产物缓存 (CPU inductor 后端, 微型 UNet)
+
+跨进程复用的测试在两个子进程中运行，每个子进程使用全新的 inductor 本地缓存目录，
+第二个进程只能通过卷上的编译产物命中缓存。单核 CPU 上每次编译约 1-2 分钟。
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import torch
+
+import compile_cache
+from compile_cache import cache_key, compile_unet, model_digest
+from synthetic_sdxl import build_tiny_pipeline
+
+
+def _latents(pipe):
+    generator = torch.Generator().manual_seed(0)
+    return pipe(
+        prompt="a red fox", num_inference_steps=3, width=64, height=64, output_type="latent", generator=generator
+    ).images
+
+
+def _compile_in_child(cache_dir):
+    """子进程入口：编译 (或从缓存加载) 后输出统计和与 eager 结果的差异"""
+    from torch._dynamo.utils import counters
+
+    pipe = build_tiny_pipeline()
+    eager = _latents(pipe)
+    stats = compile_unet(pipe, cache_dir, "test-digest", [(64, 64)], mode="default")
+    compiled = _latents(pipe)
+    print(json.dumps({
+        "stats": stats,
+        "max_diff": (compiled - eager).abs().max().item(),
+        "counters": dict(counters["inductor"]),
+    }))
+
+
+def _run_child(cache_dir, inductor_dir):
+    env = dict(os.environ, TORCHINDUCTOR_CACHE_DIR=inductor_dir)
+    code = f"import test_compile_cache as t; t._compile_in_child({cache_dir!r})"
+    result = subprocess.run(
+        [sys.executable, "-c", code], env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, timeout=900,
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_cache_key_covers_model_torch_dtype_and_bucket():
+    base = cache_key("abc", torch.float16, 1024, 1024, "cuda", "default")
+    assert base[0]["torch"] == torch.__version__ and base[0]["bucket"] == "1024x1024"
+    variants = [
+        cache_key("def", torch.float16, 1024, 1024, "cuda", "default"),
+        cache_key("abc", torch.float32, 1024, 1024, "cuda", "default"),
+        cache_key("abc", torch.float16, 832, 1216, "cuda", "default"),
+        cache_key("abc", torch.float16, 1024, 1024, "cpu", "default"),
+        cache_key("abc", torch.float16, 1024, 1024, "cuda", "max-autotune"),
+    ]
+    assert len({key for _, key in variants + [base]}) == len(variants) + 1
+
+    pipe = build_tiny_pipeline()
+    assert model_digest({"digest": "abc"}, pipe.unet) == "abc"
+    assert model_digest(None, pipe.unet) == model_digest(None, pipe.unet)
+
+
+def test_falls_back_to_eager_when_compile_fails():
+    pipe = build_tiny_pipeline()
+    eager = _latents(pipe)
+    original = compile_cache._trigger
+
+    def _broken(*args):
+        raise RuntimeError("no C++ compiler")
+
+    compile_cache._trigger = _broken
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            stats = compile_unet(pipe, cache_dir, "test-digest", [(64, 64)], mode="default")
+    finally:
+        compile_cache._trigger = original
+
+    assert stats["status"] == "eager" and "no C++ compiler" in stats["error"]
+    assert pipe.unet._compiled_call_impl is None
+    assert torch.equal(_latents(pipe), eager)
+
+
+def test_each_bucket_file_holds_only_its_own_artifacts():
+    """save_cache_artifacts() 会累积，后面的桶不能把前面桶的产物再写一遍"""
+    from torch.compiler._cache import CacheArtifactManager
+
+    pipe = build_tiny_pipeline()
+    original = compile_cache._trigger
+
+    def _record(pipe, width, height):
+        CacheArtifactManager._ensure_cache_artifacts_registered()
+        CacheArtifactManager.record_artifact("inductor", f"graph-{width}x{height}", b"x" * 64)
+
+    compile_cache._trigger = _record
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            resolutions = [(64, 64), (64, 96), (96, 64)]
+            stats = compile_unet(pipe, cache_dir, "test-digest", resolutions, mode="default")
+            assert stats["status"] == "compiled"
+            for width, height in resolutions:
+                key = stats["buckets"][f"{width}x{height}"]["key"]
+                with open(os.path.join(cache_dir, f"{key}.bin"), "rb") as f:
+                    artifacts = CacheArtifactManager.deserialize(f.read())
+                assert [a.key for a in artifacts["inductor"]] == [f"graph-{width}x{height}"]
+                with open(os.path.join(cache_dir, f"{key}.json")) as f:
+                    assert json.load(f)["bucket"] == f"{width}x{height}"
+            assert not [name for name in os.listdir(cache_dir) if ".tmp." in name]
+    finally:
+        compile_cache._trigger = original
+        pipe.unet._compiled_call_impl = None
+        torch._dynamo.reset()
+
+
+def test_compiled_artifacts_are_reused_by_a_fresh_process():
+    if shutil.which("g++") is None and shutil.which("cc") is None:
+        print("⏭️ 没有 C++ 编译器，跳过 inductor 测试")
+        return
+
+    with tempfile.TemporaryDirectory() as root:
+        cache_dir = os.path.join(root, "volume-cache")
+        first = _run_child(cache_dir, os.path.join(root, "inductor-1"))
+        second = _run_child(cache_dir, os.path.join(root, "inductor-2"))
+
+    bucket = first["stats"]["buckets"]["64x64"]
+    assert first["stats"]["status"] == "compiled"
+    assert bucket["source"] == "compiled" and bucket["saved_bytes"] > 0
+    assert first["counters"].get("fxgraph_cache_miss", 0) >= 1
+    assert first["max_diff"] < 1e-3
+
+    assert second["stats"]["buckets"]["64x64"]["source"] == "cache"
+    assert second["counters"].get("fxgraph_cache_hit", 0) >= 1
+    assert second["counters"].get("fxgraph_cache_miss", 0) == 0
+    assert second["max_diff"] < 1e-3
+
+
+if __name__ == "__main__":
+    test_cache_key_covers_model_torch_dtype_and_bucket()
+    test_falls_back_to_eager_when_compile_fails()
+    test_each_bucket_file_holds_only_its_own_artifacts()
+    test_compiled_artifacts_are_reused_by_a_fresh_process()
+    print("✅ 所有编译缓存测试通过")
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+测试 num_images_per_prompt 多图生成 (CPU, 使用替身 pipeline)
+"""
+
+import handler
+from test_batching import StandInPipeline
+
+
+def _with_stand_in(fn):
+    stand_in = StandInPipeline(delay=0)
+    old_pipeline = handler.pipeline
+    handler.pipeline = stand_in
+    try:
+        return fn(), stand_in
+    finally:
+        handler.pipeline = old_pipeline
+
+
+def test_seeds_are_derived_from_base_seed():
+    results, stand_in = _with_stand_in(lambda: handler.generate_images(
+        "a cat", width=64, height=64, seed=42, num_images_per_prompt=4
+    ))
+
+    assert [r["seed"] for r in results] == [42, 43, 44, 45]
+    assert len(stand_in.calls) == 1
+    assert stand_in.calls[0]["num_images_per_prompt"] == 4
+    assert len(stand_in.calls[0]["generator"]) == 4
+
+
+def test_large_batches_are_split_into_chunks():
+    old_budget = handler.MAX_BATCH_PIXELS
+    handler.MAX_BATCH_PIXELS = 2 * 64 * 64
+    try:
+        results, stand_in = _with_stand_in(lambda: handler.generate_images(
+            "a cat", width=64, height=64, seed=7, num_images_per_prompt=5
+        ))
+    finally:
+        handler.MAX_BATCH_PIXELS = old_budget
+
+    assert len(results) == 5
+    assert [c["num_images_per_prompt"] for c in stand_in.calls] == [2, 2, 1]
+    assert [r["seed"] for r in results] == [7, 8, 9, 10, 11]
+
+
+def test_handler_rejects_too_many_images():
+    result = handler.handler({"input": {
+        "prompt": "a cat", "num_images_per_prompt": handler.MAX_IMAGES_PER_REQUEST + 1
+    }})
+    assert "error" in result
+
+
+if __name__ == "__main__":
+    test_seeds_are_derived_from_base_seed()
+    test_large_batches_are_split_into_chunks()
+    test_handler_rejects_too_many_images()
+    print("✅ 所有多图生成测试通过")
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+测试异步任务队列的优先级、截止时间降级 / 拒绝和 CPU/GPU 重叠 (使用替身 pipeline)
+"""
+
+import asyncio
+import time
+
+import handler
+from job_queue import JobQueue, StepCostModel, DeadlineError, LocalJobSource
+from test_batching import StandInPipeline
+
+
+def _params(name, steps=10, size=1000):
+    return {"name": name, "num_inference_steps": steps, "width": size, "height": size, "num_images_per_prompt": 1}
+
+
+def _sleeping_queue(gpu_s=0.05, cpu_s=0.0, order=None, **kwargs):
+    def run_gpu(params):
+        if order is not None:
+            order.append(params["name"])
+        time.sleep(gpu_s)
+        return params["name"]
+
+    def run_cpu(params, intermediate):
+        time.sleep(cpu_s)
+        return {"name": intermediate, "steps": params["num_inference_steps"]}
+
+    return JobQueue(run_gpu, run_cpu, **kwargs)
+
+
+def test_higher_priority_jobs_run_first():
+    order = []
+    queue = _sleeping_queue(order=order)
+
+    async def _main():
+        first = asyncio.ensure_future(queue.submit(_params("first")))
+        await asyncio.sleep(0.01)  # first 已经占用 GPU
+        rest = [queue.submit(_params(name), priority=p) for name, p in [("low", 0), ("high", 5), ("mid", 1)]]
+        await asyncio.gather(first, *rest)
+
+    asyncio.run(_main())
+    queue.close()
+    assert order == ["first", "high", "mid", "low"]
+
+
+def test_deadline_downgrades_steps_or_rejects():
+    # 1 MP, 每步 0.01s：30 步约 0.3s
+    cost = StepCostModel(seconds_per_step_mp=0.01, overhead_s=0.0, alpha=0.0)
+    queue = _sleeping_queue(gpu_s=0.0, min_steps=8, cost_model=cost)
+
+    async def _main():
+        loop = asyncio.get_running_loop()
+        result, info = await queue.submit(_params("fits", steps=30), deadline=loop.time() + 1.0)
+        assert result["steps"] == 30 and info["downgraded_from_steps"] is None
+
+        result, info = await queue.submit(_params("tight", steps=30), deadline=loop.time() + 0.1)
+        assert 8 <= result["steps"] < 30 and info["downgraded_from_steps"] == 30
+
+        try:
+            await queue.submit(_params("late", steps=30), deadline=loop.time() + 0.05)
+            assert False, "expected DeadlineError"
+        except DeadlineError:
+            pass
+
+    asyncio.run(_main())
+    stats = queue.stats()
+    queue.close()
+    assert stats["downgraded"] == 1 and stats["rejected"] == 1 and stats["completed"] == 2
+
+
+def test_average_wait_counts_only_dequeued_jobs():
+    cost = StepCostModel(seconds_per_step_mp=0.01, overhead_s=0.0, alpha=0.0)
+    queue = _sleeping_queue(gpu_s=0.05, min_steps=8, cost_model=cost)
+
+    async def _main():
+        loop = asyncio.get_running_loop()
+        done = await asyncio.gather(queue.submit(_params("a")), queue.submit(_params("b")))
+        try:
+            # 提交时就被拒绝，从未排队
+            await queue.submit(_params("late", steps=30), deadline=loop.time() + 0.01)
+            assert False, "expected DeadlineError"
+        except DeadlineError:
+            pass
+        return [info["queue_wait_ms"] for _, info in done]
+
+    waits = asyncio.run(_main())
+    stats = queue.stats()
+    queue.close()
+    assert stats["rejected"] == 1 and stats["completed"] == 2
+    assert abs(stats["avg_queue_wait_ms"] - sum(waits) / len(waits)) < 0.1
+
+
+def test_consumer_survives_a_failing_job():
+    def steps_run(intermediate):
+        if intermediate == "bad":
+            raise KeyError("steps")
+        return 10
+
+    queue = _sleeping_queue(gpu_s=0.0, steps_run=steps_run)
+
+    async def _main():
+        try:
+            await asyncio.wait_for(queue.submit(_params("bad")), timeout=5)
+            assert False, "expected KeyError"
+        except KeyError:
+            pass
+        return await asyncio.wait_for(queue.submit(_params("next")), timeout=5)
+
+    result, info = asyncio.run(_main())
+    queue.close()
+    assert result["name"] == "next" and info["steps_run"] == 10
+
+
+def test_cpu_post_processing_overlaps_next_job():
+    queue = _sleeping_queue(gpu_s=0.1, cpu_s=0.1)
+
+    async def _main():
+        start = time.perf_counter()
+        await asyncio.gather(*(queue.submit(_params(str(i))) for i in range(4)))
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(_main())
+    queue.close()
+    # 串行需要 0.8s；重叠后约为 4 * 0.1 + 0.1
+    assert elapsed < 0.7, elapsed
+
+
+def test_cost_model_learns_from_steps_actually_run():
+    # GPU 阶段只跑了计划 20 步中的 5 步 (自适应步数提前结束)，每步耗时按 5 步计算
+    model = StepCostModel(seconds_per_step_mp=1.0, overhead_s=0.0, alpha=1.0)
+    queue = _sleeping_queue(gpu_s=0.1, cost_model=model, steps_run=lambda intermediate: 5)
+
+    async def _main():
+        return await queue.submit(_params("early", steps=20))
+
+    _, info = asyncio.run(_main())
+    queue.close()
+    assert info["steps_run"] == 5
+    assert 0.1 / 5 <= model.seconds_per_step_mp < 0.2 / 5, model.seconds_per_step_mp
+
+
+def test_async_handler_with_local_job_source():
+    old_pipeline, old_queue = handler.pipeline, handler.job_queue
+    handler.pipeline = StandInPipeline(delay=0.01)
+    handler.job_queue = None
+    jobs = [
+        {"id": "a", "input": {"prompt": "a cat", "width": 64, "height": 64, "seed": 1}},
+        {"id": "b", "input": {"prompt": "a dog", "width": 64, "height": 64, "priority": 3}, "delay_s": 0.01},
+        {"id": "c", "input": {"prompt": ""}},
+        # 字符串形式的数值参数被转换，无效值返回错误而不是抛出异常
+        {"id": "d", "input": {"prompt": "a cow", "width": "64", "height": 64, "num_inference_steps": "4"}},
+        {"id": "e", "input": {"prompt": "a cow", "num_inference_steps": "many"}},
+    ]
+    try:
+        results = asyncio.run(LocalJobSource(jobs, concurrency=4).run(handler.handler_async))
+        stats = handler.job_queue.stats()
+    finally:
+        handler.job_queue.close()
+        handler.pipeline, handler.job_queue = old_pipeline, old_queue
+
+    by_id = {r["id"]: r["output"] for r in results}
+    assert by_id["a"]["seed"] == 1 and by_id["a"]["image"]
+    assert by_id["b"]["queue"]["priority"] == 3
+    assert by_id["c"] == {"error": "Prompt is required"}
+    assert by_id["d"]["num_inference_steps"] == 4 and by_id["d"]["width"] == 64
+    assert by_id["e"] == {"error": "Invalid num_inference_steps: many"}
+    assert stats["completed"] == 3
+
+
+if __name__ == "__main__":
+    test_higher_priority_jobs_run_first()
+    test_deadline_downgrades_steps_or_rejects()
+    test_average_wait_counts_only_dequeued_jobs()
+    test_consumer_survives_a_failing_job()
+    test_cpu_post_processing_overlaps_next_job()
+    test_cost_model_learns_from_steps_actually_run()
+    test_async_handler_with_local_job_source()
+    print("✅ 所有任务队列测试通过")
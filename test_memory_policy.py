@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+测试请求后的内存回收策略
+"""
+
+import time
+
+import handler
+from memory_policy import MemoryPolicy
+from test_batching import StandInPipeline
+
+
+def _run_requests(policy, count):
+    for _ in range(count):
+        with policy.track():
+            pass
+    return policy.stats()
+
+
+def test_policies_decide_cleanup_frequency():
+    assert _run_requests(MemoryPolicy("always"), 5)["cleanups"] == 5
+    assert _run_requests(MemoryPolicy("never"), 5)["cleanups"] == 0
+    assert _run_requests(MemoryPolicy("every_n", every_n=2), 5)["cleanups"] == 2
+    assert _run_requests(MemoryPolicy("watermark", watermark=0.0), 3)["cleanups"] == 3
+    assert _run_requests(MemoryPolicy("watermark", watermark=1.1), 3)["cleanups"] == 0
+
+
+def test_snapshots_are_recorded():
+    stats = _run_requests(MemoryPolicy("never"), 1)
+    assert stats["requests"] == 1
+    assert stats["last"]["before"]["rss"] > 0
+    assert stats["peak"]["rss"] >= stats["last"]["after"]["rss"]
+
+
+def test_idle_policy_cleans_up_after_quiet_period():
+    policy = MemoryPolicy("idle", idle_seconds=0.05)
+    try:
+        _run_requests(policy, 3)
+        assert policy.stats()["cleanups"] == 0
+        deadline = time.monotonic() + 2.0
+        while policy.stats()["cleanups"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert policy.stats()["cleanups"] == 1
+    finally:
+        policy.close()
+
+
+def test_generation_goes_through_the_policy():
+    old_pipeline, old_policy = handler.pipeline, handler.memory_policy
+    handler.pipeline = StandInPipeline(delay=0)
+    handler.memory_policy = MemoryPolicy("every_n", every_n=2)
+    try:
+        for _ in range(4):
+            handler.generate_images("a cat", width=64, height=64, seed=1)
+        stats = handler.get_stats()["memory"]
+    finally:
+        handler.pipeline, handler.memory_policy = old_pipeline, old_policy
+
+    assert stats["requests"] == 4
+    assert stats["cleanups"] == 2
+
+
+if __name__ == "__main__":
+    test_policies_decide_cleanup_frequency()
+    test_snapshots_are_recorded()
+    test_idle_policy_cleans_up_after_quiet_period()
+    test_generation_goes_through_the_policy()
+    print("✅ 所有内存回收策略测试通过")
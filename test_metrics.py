@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+测试分阶段耗时统计和 metrics 端点 (CPU, 微型合成 SDXL 模型)
+"""
+
+import json
+import urllib.request
+
+import handler
+import metrics
+from metrics import Histogram, MetricsRegistry, RequestTrace
+from synthetic_sdxl import build_tiny_pipeline
+
+GENERATION_STAGES = {
+    "validation", "text_encoding", "denoise_step", "vae_decode", "pil_convert", "image_encode", "base64"
+}
+
+
+def _with_tiny_pipeline(fn, **overrides):
+    saved = {name: getattr(handler, name) for name in ["pipeline", *overrides]}
+    handler.pipeline = build_tiny_pipeline()
+    for name, value in overrides.items():
+        setattr(handler, name, value)
+    try:
+        return fn()
+    finally:
+        for name, value in saved.items():
+            setattr(handler, name, value)
+
+
+def test_histogram_quantiles_and_prometheus_text():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.05, 0.5, 2.0):
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.99) <= 2.0
+
+    registry = MetricsRegistry(buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 2.0):
+        registry.observe("demo_seconds", value, stage="x")
+    text = registry.prometheus_text()
+    assert '# TYPE demo_seconds histogram' in text
+    assert 'demo_seconds_bucket{stage="x",le="0.1"} 1' in text
+    assert 'demo_seconds_bucket{stage="x",le="1.0"} 2' in text
+    assert 'demo_seconds_bucket{stage="x",le="+Inf"} 3' in text
+    assert 'demo_seconds_count{stage="x"} 3' in text
+    assert registry.to_json()["demo_seconds"][0]["count"] == 3
+
+
+def test_trace_only_collects_stages_while_active():
+    trace = RequestTrace()
+    metrics.observe("outside", 0.5)
+    with metrics.activate(trace, None):
+        metrics.observe("denoise_step", 0.01)
+        metrics.observe("denoise_step", 0.02)
+        with metrics.stage("pil_convert"):
+            pass
+    timings = trace.to_dict()
+    assert set(timings["stages"]) == {"denoise_step", "pil_convert"}
+    assert timings["steps_ms"] == [10.0, 20.0]
+    assert abs(timings["stages"]["denoise_step"] - 30.0) < 1e-6
+
+
+def test_handler_returns_per_stage_timings():
+    event = {"input": {
+        "prompt": "a cat", "num_inference_steps": 3, "width": 64, "height": 64, "seed": 1, "return_timings": True
+    }}
+    # 合批路径 (带排队) 使用 prompt 缓存；非合批路径关闭缓存时由文本编码器 hook 计时
+    batched = _with_tiny_pipeline(lambda: handler.handler(event), MAX_BATCH_SIZE=4, batcher=None)
+    direct = _with_tiny_pipeline(lambda: handler.handler(event), MAX_BATCH_SIZE=1, prompt_cache=None)
+
+    for result, extra in ((batched, {"queue_wait"}), (direct, set())):
+        assert "error" not in result, result
+        timings = result["timings"]
+        assert GENERATION_STAGES | extra <= set(timings["stages"]), timings
+        assert len(timings["steps_ms"]) == 3
+        assert timings["total_ms"] >= sum(timings["steps_ms"])
+    assert "timings" not in _with_tiny_pipeline(
+        lambda: handler.handler({"input": {"prompt": "a cat", "num_inference_steps": 2, "width": 64, "height": 64}}),
+        MAX_BATCH_SIZE=1
+    )
+
+
+def test_metrics_action_and_http_endpoint():
+    _with_tiny_pipeline(lambda: handler.handler({"input": {
+        "prompt": "a dog", "num_inference_steps": 2, "width": 64, "height": 64
+    }}), MAX_BATCH_SIZE=1)
+
+    stages = {s["labels"]["stage"] for s in handler.handler({"input": {"action": "metrics"}})["metrics"][metrics.REQUEST_FAMILY]}
+    assert {"denoise_step", "vae_decode", "total"} <= stages
+
+    text = handler.handler({"input": {"action": "metrics", "format": "prometheus"}})["metrics"]
+    assert 'sdxl_request_stage_seconds_bucket{stage="denoise_step",le="+Inf"}' in text
+
+    # 流式 handler 同样支持 metrics action
+    events = list(handler.handler_stream({"input": {"action": "metrics", "format": "prometheus"}}))
+    assert len(events) == 1 and events[0]["type"] == "metrics"
+    assert "sdxl_request_stage_seconds" in events[0]["metrics"]
+
+    server = metrics.start_server(0, host="127.0.0.1")
+    try:
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(f"{base}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert "# TYPE sdxl_request_stage_seconds histogram" in response.read().decode()
+        with urllib.request.urlopen(f"{base}/metrics.json") as response:
+            assert metrics.REQUEST_FAMILY in json.load(response)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    test_histogram_quantiles_and_prometheus_text()
+    test_trace_only_collects_stages_while_active()
+    test_handler_returns_per_stage_timings()
+    test_metrics_action_and_http_endpoint()
+    print("✅ 所有 metrics 测试通过")
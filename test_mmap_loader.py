@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+测试 mmap 逐组件加载 safetensors (CPU, 微型合成 SDXL 模型)
+"""
+
+import os
+import tempfile
+import threading
+import time
+
+import torch
+from diffusers import StableDiffusionXLPipeline
+from safetensors.torch import load_file, save_file
+
+import handler
+import mmap_loader
+from mmap_loader import MissingWeightsError, check_weights_complete, load_pipeline_mmap, safetensors_files
+from preflight import STRATEGY_MMAP
+from synthetic_sdxl import write_tiny_model_dir
+
+
+def test_weights_match_from_pretrained():
+    with tempfile.TemporaryDirectory() as model_path:
+        write_tiny_model_dir(model_path)
+        pipe, stats = load_pipeline_mmap(model_path, StableDiffusionXLPipeline)
+        reference = StableDiffusionXLPipeline.from_pretrained(model_path, torch_dtype=torch.float32)
+
+    for name in ("unet", "vae", "text_encoder", "text_encoder_2"):
+        ours, theirs = getattr(pipe, name).state_dict(), getattr(reference, name).state_dict()
+        assert ours.keys() == theirs.keys(), name
+        assert all(torch.equal(ours[k], theirs[k]) for k in theirs), name
+        assert not any(p.is_meta for p in getattr(pipe, name).parameters()), name
+        assert stats["components"][name]["bytes"] > 0 and stats["components"][name]["files"], name
+
+
+def test_variant_selection_and_dtype():
+    with tempfile.TemporaryDirectory() as model_path:
+        write_tiny_model_dir(model_path)
+        unet_path = os.path.join(model_path, "unet")
+        assert safetensors_files(unet_path, "fp16")[0].endswith("diffusion_pytorch_model.fp16.safetensors")
+        assert safetensors_files(unet_path)[0].endswith("diffusion_pytorch_model.safetensors")
+
+        os.remove(os.path.join(unet_path, "diffusion_pytorch_model.fp16.safetensors"))
+        assert safetensors_files(unet_path, "fp16")[0].endswith("diffusion_pytorch_model.safetensors")
+
+        pipe, stats = load_pipeline_mmap(model_path, StableDiffusionXLPipeline, torch_dtype=torch.float16, variant="fp16")
+    assert pipe.unet.dtype == torch.float16 and pipe.text_encoder.dtype == torch.float16
+    assert stats["components"]["vae"]["files"] == ["diffusion_pytorch_model.fp16.safetensors"]
+
+
+def test_components_load_concurrently():
+    register_parameter = torch.nn.Module.register_parameter
+    original = mmap_loader.load_component
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def _tracked(*args, **kwargs):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        try:
+            time.sleep(0.2)
+            return original(*args, **kwargs)
+        finally:
+            with lock:
+                active[0] -= 1
+
+    with tempfile.TemporaryDirectory() as model_path:
+        write_tiny_model_dir(model_path)
+        serial, _ = load_pipeline_mmap(model_path, StableDiffusionXLPipeline, workers=1)
+        mmap_loader.load_component = _tracked
+        try:
+            pipe, stats = load_pipeline_mmap(model_path, StableDiffusionXLPipeline, workers=4)
+        finally:
+            mmap_loader.load_component = original
+
+    assert peak[0] > 1
+    assert stats["workers"] == 4 and set(stats["components"]) == set(mmap_loader.MMAP_COMPONENTS)
+    # 并发构建骨架后全局的 register_parameter 必须还原
+    assert torch.nn.Module.register_parameter is register_parameter
+    for name in mmap_loader.MMAP_COMPONENTS:
+        ours, theirs = getattr(pipe, name).state_dict(), getattr(serial, name).state_dict()
+        assert all(torch.equal(ours[k], theirs[k]) for k in theirs), name
+    assert pipe.tokenizer_2 is not None and pipe.scheduler is not None
+
+
+def test_legacy_vae_attention_keys_are_renamed():
+    """旧版 VAE 的 query/key/value/proj_attn 权重名与 from_pretrained() 一样被重命名，不算缺失"""
+    legacy = {"to_q": "query", "to_k": "key", "to_v": "value", "to_out.0": "proj_attn"}
+    with tempfile.TemporaryDirectory() as model_path:
+        write_tiny_model_dir(model_path)
+        vae_file = os.path.join(model_path, "vae", "diffusion_pytorch_model.safetensors")
+        weights = {}
+        for key, tensor in load_file(vae_file).items():
+            for new, old in legacy.items():
+                key = key.replace(f".attentions.0.{new}.", f".attentions.0.{old}.")
+            weights[key] = tensor
+        assert any(".attentions.0.query." in key for key in weights)
+        save_file(weights, vae_file)
+
+        pipe, _ = load_pipeline_mmap(model_path, StableDiffusionXLPipeline)
+        reference = StableDiffusionXLPipeline.from_pretrained(model_path, torch_dtype=torch.float32)
+        check_weights_complete(reference, model_path)
+
+    ours, theirs = pipe.vae.state_dict(), reference.vae.state_dict()
+    assert ours.keys() == theirs.keys()
+    assert all(torch.equal(ours[k], theirs[k]) for k in theirs)
+
+
+def test_load_model_rejects_incomplete_weights():
+    saved = handler.MODEL_PATH, handler.pipeline, handler.USE_LOAD_MANIFEST
+    with tempfile.TemporaryDirectory() as model_path:
+        write_tiny_model_dir(model_path)
+        handler.MODEL_PATH, handler.USE_LOAD_MANIFEST = model_path, False
+        try:
+            handler.load_model()
+            assert handler.load_stats["strategy"]["name"] == STRATEGY_MMAP
+            assert set(handler.load_stats["components"]) == {"unet", "vae", "text_encoder", "text_encoder_2"}
+            assert handler.load_stats["component_load"]["workers"] == handler.LOAD_WORKERS
+            # 每次策略尝试、每个组件搬运和预热都有耗时记录
+            timings = handler.load_stats["timings"]
+            assert [(t["name"], t["ok"]) for t in timings if t["stage"] == "strategy"] == [(STRATEGY_MMAP, True)]
+            assert {t["name"] for t in timings if t["stage"] == "move"} == {"unet", "vae", "text_encoder", "text_encoder_2"}
+            assert [t["stage"] for t in timings][-1] == "warmup"
+
+            # 删掉一个权重后加载失败，不退回会随机初始化缺失权重的 from_pretrained
+            vae_file = os.path.join(model_path, "vae", "diffusion_pytorch_model.safetensors")
+            weights = load_file(vae_file)
+            removed = next(iter(weights))
+            weights.pop(removed)
+            save_file(weights, vae_file)
+            try:
+                handler.load_model()
+                assert False, "expected incomplete weights to be rejected"
+            except RuntimeError as e:
+                assert "missing weights" in str(e) and removed in str(e)
+
+            # from_pretrained 本身只会静默随机初始化，由 check_weights_complete 发现
+            pipe = StableDiffusionXLPipeline.from_pretrained(model_path, torch_dtype=torch.float32)
+            try:
+                check_weights_complete(pipe, model_path)
+                assert False, "expected missing weights"
+            except MissingWeightsError as e:
+                assert e.missing == [removed]
+        finally:
+            handler.MODEL_PATH, handler.pipeline, handler.USE_LOAD_MANIFEST = saved
+
+
+if __name__ == "__main__":
+    test_weights_match_from_pretrained()
+    test_variant_selection_and_dtype()
+    test_components_load_concurrently()
+    test_legacy_vae_attention_keys_are_renamed()
+    test_load_model_rejects_incomplete_weights()
+    print("✅ 所有 mmap 加载测试通过")
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+测试模型目录校验清单
+"""
+
+import os
+import tempfile
+
+import handler
+from model_manifest import load_manifest, validate_manifest, write_manifest
+from synthetic_sdxl import write_tiny_model_dir
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def test_manifest_detects_changes():
+    with tempfile.TemporaryDirectory() as model_path:
+        _write(os.path.join(model_path, "model_index.json"), "{}")
+        _write(os.path.join(model_path, "unet", "config.json"), '{"in_channels": 4}')
+
+        manifest = write_manifest(model_path)
+        assert manifest is not None
+        assert set(manifest["files"]) == {"model_index.json", "unet/config.json"}
+        assert validate_manifest(model_path, load_manifest(model_path))
+
+        # 修改文件
+        _write(os.path.join(model_path, "unet", "config.json"), '{"in_channels": 8}')
+        assert not validate_manifest(model_path, load_manifest(model_path))
+
+        # 新增文件
+        write_manifest(model_path)
+        _write(os.path.join(model_path, "vae", "config.json"), "{}")
+        assert not validate_manifest(model_path, load_manifest(model_path))
+
+        # 删除文件
+        write_manifest(model_path)
+        os.remove(os.path.join(model_path, "vae", "config.json"))
+        assert not validate_manifest(model_path, load_manifest(model_path))
+
+
+def test_load_model_skips_repairs_when_manifest_matches():
+    calls = []
+    old_path, old_pipeline = handler.MODEL_PATH, handler.pipeline
+    old_fix = handler.fix_config_none_values
+
+    def counting_fix():
+        calls.append(1)
+        old_fix()
+
+    with tempfile.TemporaryDirectory() as model_path:
+        write_tiny_model_dir(model_path, fp16_variant=False)
+        handler.MODEL_PATH = model_path
+        handler.fix_config_none_values = counting_fix
+        try:
+            handler.load_model()
+            assert load_manifest(model_path) is not None
+            handler.load_model()
+        finally:
+            handler.MODEL_PATH, handler.pipeline = old_path, old_pipeline
+            handler.fix_config_none_values = old_fix
+
+    assert len(calls) == 1
+
+
+if __name__ == "__main__":
+    test_manifest_detects_changes()
+    test_load_model_skips_repairs_when_manifest_matches()
+    print("✅ 所有校验清单测试通过")
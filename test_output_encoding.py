@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+测试输出图像编码
+"""
+
+import base64
+import os
+import tempfile
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+import output_encoding
+from output_encoding import OutputOptionsError, encode_output, parse_output_options
+
+
+def _image():
+    array = np.zeros((32, 48, 3), dtype=np.uint8)
+    array[..., 0] = np.arange(48, dtype=np.uint8)
+    return Image.fromarray(array)
+
+
+def test_formats_round_trip():
+    image = _image()
+    for output_format in ["png", "jpeg", "webp"]:
+        encoded = encode_output(image, output_format=output_format)
+        data = base64.b64decode(encoded["image"])
+        assert len(data) == encoded["bytes"]
+        decoded = Image.open(BytesIO(data))
+        assert decoded.size == image.size
+        assert decoded.format == output_format.upper()
+
+    encoded = encode_output(image, output_format="raw")
+    raw = np.frombuffer(base64.b64decode(encoded["image"]), dtype=np.uint8).reshape(encoded["shape"])
+    assert np.array_equal(raw, np.asarray(image))
+
+
+def test_png_is_lossless_at_every_compress_level():
+    image = _image()
+    for level in (0, 1, 9):
+        data = base64.b64decode(encode_output(image, compress_level=level)["image"])
+        assert np.array_equal(np.asarray(Image.open(BytesIO(data))), np.asarray(image))
+
+
+def test_output_path_writes_file_inside_root():
+    old_root = output_encoding.OUTPUT_ROOT
+    with tempfile.TemporaryDirectory() as root:
+        output_encoding.OUTPUT_ROOT = root
+        try:
+            options = parse_output_options({"output_format": "jpg", "output_path": "jobs/42/out"})
+            encoded = encode_output(_image(), **options)
+
+            assert "image" not in encoded
+            assert encoded["path"] == os.path.join(os.path.realpath(root), "jobs", "42", "out.jpg")
+            assert os.path.getsize(encoded["path"]) == encoded["bytes"]
+
+            # 根目录本身 ("" / ".") 追加扩展名后会落到根目录之外
+            for bad in ("../escape.png", "", ".", "/"):
+                try:
+                    parse_output_options({"output_path": bad})
+                except OutputOptionsError:
+                    pass
+                else:
+                    raise AssertionError(f"expected OutputOptionsError for {bad!r}")
+
+            # 编码失败时不留下临时文件
+            try:
+                encode_output(None, output_path=os.path.join(root, "broken.png"))
+            except AttributeError:
+                pass
+            else:
+                raise AssertionError("expected encoding to fail")
+            assert not [name for name in os.listdir(root) if ".tmp." in name]
+        finally:
+            output_encoding.OUTPUT_ROOT = old_root
+
+
+def test_invalid_format_is_rejected():
+    try:
+        parse_output_options({"output_format": "gif"})
+    except OutputOptionsError:
+        pass
+    else:
+        raise AssertionError("expected OutputOptionsError")
+
+
+if __name__ == "__main__":
+    test_formats_round_trip()
+    test_png_is_lossless_at_every_compress_level()
+    test_output_path_writes_file_inside_root()
+    test_invalid_format_is_rejected()
+    print("✅ 所有输出编码测试通过")
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+测试图像后处理线程池 (背压、np -> PIL 转换、批处理结果异步编码)
+"""
+
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+from PIL import Image
+
+import handler
+from postprocess import PostProcessPool, to_pil, resolve
+from test_batching import StandInPipeline
+
+
+def test_to_pil_converts_pipeline_arrays():
+    array = np.zeros((8, 4, 3), dtype=np.float32)
+    array[..., 0] = 1.0
+    image = to_pil(array)
+    assert image.size == (4, 8) and image.getpixel((0, 0)) == (255, 0, 0)
+
+    pil = Image.new("RGB", (2, 2))
+    assert to_pil(pil) is pil
+
+
+def test_submit_blocks_when_queue_is_full():
+    pool = PostProcessPool(workers=1, max_pending=1)
+    release = threading.Event()
+    try:
+        first = pool.submit(release.wait)
+        timer = threading.Timer(0.1, release.set)
+        timer.start()
+        start = time.perf_counter()
+        second = pool.submit(lambda: "done")
+        blocked = time.perf_counter() - start
+        assert first.result() and second.result() == "done"
+    finally:
+        pool.close()
+
+    stats = pool.stats()
+    assert blocked >= 0.05
+    assert stats["backpressure_waits"] == 1
+    assert stats["max_pending_seen"] == 1 and stats["pending"] == 0
+
+
+def test_batch_results_are_encoded_off_the_inference_thread():
+    old = handler.pipeline, handler.postprocess_pool
+    handler.pipeline = StandInPipeline(delay=0)
+    handler.postprocess_pool = PostProcessPool(workers=2, max_pending=4)
+    requests = [
+        {"prompt": "a", "negative_prompt": "", "seed": 1, "num_images_per_prompt": 2,
+         "num_inference_steps": 2, "guidance_scale": 7.0, "width": 64, "height": 64},
+        {"prompt": "b", "negative_prompt": "", "seed": 5, "num_images_per_prompt": 1,
+         "num_inference_steps": 2, "guidance_scale": 7.0, "width": 64, "height": 64},
+    ]
+    try:
+        pending = handler.generate_batch(requests)
+        results = [resolve(p) for p in pending]
+    finally:
+        handler.postprocess_pool.close()
+        handler.pipeline, handler.postprocess_pool = old
+
+    assert all(isinstance(p, Future) for p in pending)
+    assert [[img["seed"] for img in r] for r in results] == [[1, 2], [5]]
+
+
+if __name__ == "__main__":
+    test_to_pil_converts_pipeline_arrays()
+    test_submit_blocks_when_queue_is_full()
+    test_batch_results_are_encoded_off_the_inference_thread()
+    print("✅ 所有后处理测试通过")
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+测试加载前检查 (preflight) 的策略选择
+"""
+
+import os
+import tempfile
+
+import handler
+from model_manifest import load_manifest
+from preflight import (
+    inspect_model_dir, choose_strategy,
+    STRATEGY_MMAP, STRATEGY_LOW_MEM_FP16, STRATEGY_NO_VARIANT, STRATEGY_FP16_VARIANT, STRATEGY_NO_SAFETENSORS,
+    STRATEGY_ALLOW_DOWNLOAD
+)
+from synthetic_sdxl import write_tiny_model_dir
+
+
+def _touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "w").close()
+
+
+def _fake_model_dir(root, weight_names):
+    _touch(os.path.join(root, "model_index.json"))
+    _touch(os.path.join(root, "scheduler", "scheduler_config.json"))
+    for tokenizer in ["tokenizer", "tokenizer_2"]:
+        _touch(os.path.join(root, tokenizer, "vocab.json"))
+        _touch(os.path.join(root, tokenizer, "merges.txt"))
+    for component in ["unet", "vae", "text_encoder", "text_encoder_2"]:
+        _touch(os.path.join(root, component, "config.json"))
+        for name in weight_names:
+            _touch(os.path.join(root, component, name))
+
+
+def test_strategy_selection_follows_files():
+    cases = [
+        (["model.fp16.safetensors", "model.safetensors"], "cuda", STRATEGY_LOW_MEM_FP16),
+        (["model.safetensors"], "cuda", STRATEGY_NO_VARIANT),
+        (["model.safetensors"], "cpu", STRATEGY_LOW_MEM_FP16),
+        (["model.fp16.safetensors"], "cpu", STRATEGY_FP16_VARIANT),
+        (["pytorch_model.bin"], "cpu", STRATEGY_NO_SAFETENSORS),
+        ([], "cpu", STRATEGY_ALLOW_DOWNLOAD),
+    ]
+    for weight_names, device, expected in cases:
+        with tempfile.TemporaryDirectory() as root:
+            _fake_model_dir(root, weight_names)
+            assert choose_strategy(inspect_model_dir(root), device) == expected, (weight_names, device)
+
+    # CPU 上的 mmap 只读取无 variant 的文件，fp16-only 目录不选 mmap
+    with tempfile.TemporaryDirectory() as root:
+        _fake_model_dir(root, ["model.fp16.safetensors"])
+        report = inspect_model_dir(root)
+        assert choose_strategy(report, "cpu", prefer_mmap=True) == STRATEGY_FP16_VARIANT
+        assert choose_strategy(report, "cuda", prefer_mmap=True) == STRATEGY_MMAP
+
+
+def test_cpu_loads_fp16_only_safetensors_on_first_attempt():
+    saved = handler.MODEL_PATH, handler.pipeline, handler.USE_LOAD_MANIFEST
+    with tempfile.TemporaryDirectory() as model_path:
+        write_tiny_model_dir(model_path, fp16_variant=True)
+        for component in ["unet", "vae", "text_encoder", "text_encoder_2"]:
+            for name in os.listdir(os.path.join(model_path, component)):
+                if name.endswith(".safetensors") and ".fp16." not in name:
+                    os.remove(os.path.join(model_path, component, name))
+        handler.MODEL_PATH, handler.USE_LOAD_MANIFEST = model_path, False
+        try:
+            handler.load_model()
+            strategy = handler.load_stats["strategy"]
+            dtype = handler.pipeline.unet.dtype
+        finally:
+            handler.MODEL_PATH, handler.pipeline, handler.USE_LOAD_MANIFEST = saved
+
+    assert strategy["name"] == STRATEGY_FP16_VARIANT
+    assert strategy["attempts"] == 1 and strategy["source"] == "preflight"
+    assert str(dtype) == "torch.float32"
+
+
+def test_load_model_records_strategy_in_manifest():
+    old_path, old_pipeline = handler.MODEL_PATH, handler.pipeline
+
+    with tempfile.TemporaryDirectory() as model_path:
+        write_tiny_model_dir(model_path, safetensors=False, fp16_variant=False)
+        handler.MODEL_PATH = model_path
+        try:
+            handler.load_model()
+            first = handler.load_stats["strategy"]
+            handler.load_model()
+            second = handler.load_stats["strategy"]
+        finally:
+            handler.MODEL_PATH, handler.pipeline = old_path, old_pipeline
+
+        recorded = load_manifest(model_path)["load_strategy"]
+
+    assert first["name"] == STRATEGY_NO_SAFETENSORS
+    assert first["attempts"] == 1 and first["source"] == "preflight"
+    assert second["source"] == "manifest"
+    assert recorded["name"] == STRATEGY_NO_SAFETENSORS
+
+
+if __name__ == "__main__":
+    test_strategy_selection_follows_files()
+    test_cpu_loads_fp16_only_safetensors_on_first_attempt()
+    test_load_model_records_strategy_in_manifest()
+    print("✅ 所有 preflight 测试通过")
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+测试 prompt embedding LRU 缓存
+"""
+
+import torch
+
+from prompt_cache import PromptEmbeddingCache, cached_prompt_embeds
+from synthetic_sdxl import build_tiny_pipeline
+
+
+def test_lru_eviction_respects_byte_budget():
+    entry = (torch.zeros(256, dtype=torch.float32),)  # 1 KiB
+    cache = PromptEmbeddingCache(max_bytes=2048)
+
+    cache.put("a", entry)
+    cache.put("b", entry)
+    assert cache.get("a") is not None  # a 变为最近使用
+    cache.put("c", entry)              # 淘汰 b
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+    stats = cache.stats()
+    assert stats["bytes"] <= 2048
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 3 and stats["misses"] == 1
+
+
+def test_cached_embeds_match_pipeline_encoding():
+    pipe = build_tiny_pipeline()
+    cache = PromptEmbeddingCache()
+
+    embeds = cached_prompt_embeds(cache, pipe, ["a cat", "a dog"], ["blurry", "blurry"])
+    expected = pipe.encode_prompt(
+        prompt=["a cat", "a dog"],
+        device=pipe._execution_device,
+        num_images_per_prompt=1,
+        do_classifier_free_guidance=True,
+        negative_prompt=["blurry", "blurry"],
+    )
+
+    for actual, reference in zip(
+        (embeds["prompt_embeds"], embeds["negative_prompt_embeds"],
+         embeds["pooled_prompt_embeds"], embeds["negative_pooled_prompt_embeds"]),
+        expected,
+    ):
+        assert torch.allclose(actual, reference, atol=1e-5)
+
+    # 三段不同文本各编码一次，重复的 negative prompt 只查一次
+    assert cache.stats()["misses"] == 3
+
+    cached_prompt_embeds(cache, pipe, ["a cat"], ["blurry"])
+    assert cache.stats()["hits"] == 2
+
+
+if __name__ == "__main__":
+    test_lru_eviction_respects_byte_budget()
+    test_cached_embeds_match_pipeline_encoding()
+    print("✅ 所有 prompt 缓存测试通过")
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+测试流量回放: 事件读取、时间模式、HTTP 替身服务和 handler 流量录制 (CPU)
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+import handler
+from replay import (
+    TrafficRecorder, http_target, in_process_target, load_events, replay, schedule, serve
+)
+
+
+class _SlowHandler:
+    """替身 handler：sleep 模拟生成耗时，记录最大并发数；prompt 为 bad 时返回错误"""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self._lock:
+            self.active -= 1
+        if event["input"].get("prompt") == "bad":
+            return {"error": "Prompt is required"}
+        return {"image": "x", "seed": 1}
+
+
+def test_load_events_and_schedules():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "traffic.jsonl")
+        with open(path, "w") as f:
+            f.write(json.dumps({"ts": 100.0, "input": {"prompt": "a"}}) + "\n\n")
+            f.write(json.dumps({"ts": 101.0, "input": {"prompt": "b"}}) + "\n")
+            f.write(json.dumps({"input": {"prompt": "c"}}) + "\n")
+            f.write(json.dumps({"ts": 104.0, "input": {"prompt": "d"}}) + "\n")
+        events = load_events(path)
+        assert [e["input"]["prompt"] for e in events] == ["a", "b", "c", "d"]
+        assert len(load_events(path, limit=2)) == 2
+
+    # 仓库里的单个 JSON 请求也可以直接回放
+    single = load_events(os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_api_request.json"))
+    assert len(single) == 1 and single[0]["ts"] is None
+
+    assert schedule(events, "original") == [0.0, 1.0, 1.0, 4.0]
+    assert schedule(events, "original", speed=2.0) == [0.0, 0.5, 0.5, 2.0]
+    assert schedule(events, "rps", rps=4.0) == [0.0, 0.25, 0.5, 0.75]
+    assert schedule(events, "closed") is None
+
+
+def test_closed_loop_limits_concurrency_and_reports_errors():
+    stand_in = _SlowHandler(delay=0.05)
+    events = [{"ts": None, "input": {"prompt": "bad" if i == 3 else f"p{i}"}} for i in range(12)]
+    report = replay(events, in_process_target(stand_in), mode="closed", concurrency=3)
+
+    assert stand_in.max_active == 3
+    assert report["requests"] == 12 and report["errors"] == 1
+    assert report["error_rate"] == round(1 / 12, 4)
+    assert report["error_kinds"] == {"Prompt is required": 1}
+    assert 40 <= report["p50_ms"] <= report["p95_ms"] <= report["p99_ms"] <= report["max_ms"]
+    # 12 个 50ms 请求、3 个客户端：约 0.2s
+    assert report["seconds"] < 0.5
+
+
+def test_open_loop_rps_over_http_stand_in():
+    stand_in = _SlowHandler(delay=0.1)
+    server = serve(stand_in, port=0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/runsync"
+        events = [{"ts": None, "input": {"prompt": f"p{i}"}} for i in range(8)]
+        report = replay(events, http_target(url), mode="rps", rps=40.0)
+        bad = replay([{"ts": None, "input": {"prompt": "bad"}}], http_target(url), mode="rps")
+        missing = replay(events[:1], http_target(url.replace("/runsync", "/nope")), mode="rps")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # 开环：请求按 25ms 间隔发出，不等待前一个 100ms 的请求完成
+    assert report["errors"] == 0 and report["requests"] == 8
+    assert stand_in.max_active >= 3
+    assert report["seconds"] < 0.6
+    assert bad["errors"] == 1 and missing["error_kinds"] == {"HTTP 404": 1}
+
+
+def test_handler_captures_traffic_for_replay():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "captured", "traffic.jsonl")
+        saved = handler.traffic_recorder
+        handler.traffic_recorder = TrafficRecorder(path)
+        try:
+            handler.handler({"input": {"prompt": "", "seed": 1}})
+            handler.handler({"input": {"action": "stats"}})
+            handler.handler({"input": {"prompt": "", "seed": 2}})
+        finally:
+            handler.traffic_recorder = saved
+
+        events = load_events(path)
+        assert [e["input"]["seed"] for e in events] == [1, 2]
+        assert all(isinstance(e["ts"], float) for e in events)
+
+        # 录制的请求可以原样回放
+        report = replay(events, in_process_target(handler.handler), mode="original", speed=100.0)
+        assert report["requests"] == 2 and report["errors"] == 2
+
+
+if __name__ == "__main__":
+    test_load_events_and_schedules()
+    test_closed_loop_limits_concurrency_and_reports_errors()
+    test_open_loop_rps_over_http_stand_in()
+    test_handler_captures_traffic_for_replay()
+    print("✅ 所有流量回放测试通过")
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+测试确定性请求的结果缓存 (内存 / 磁盘两层、并发去重、handler 集成)
+"""
+
+import asyncio
+import os
+import tempfile
+import threading
+import time
+
+import handler
+from result_cache import ResultCache, request_key
+from test_batching import StandInPipeline
+
+PARAMS = {
+    "prompt": "a cat", "negative_prompt": "", "num_inference_steps": 20, "guidance_scale": 7.0,
+    "width": 1024, "height": 1024, "seed": 42, "num_images_per_prompt": 1,
+    "output_options": {"output_format": "png", "quality": 90, "compress_level": 1, "output_path": None},
+    "sampler": "euler", "use_karras_sigmas": False,
+}
+
+
+def test_request_key_normalization():
+    key = request_key(PARAMS, "model-a")
+    assert key == request_key({**PARAMS, "seed": "42", "guidance_scale": 7}, "model-a")
+    assert key != request_key({**PARAMS, "num_inference_steps": 21}, "model-a")
+    assert key != request_key({**PARAMS, "sampler": "dpmpp_2m"}, "model-a")
+    assert key != request_key(PARAMS, "model-b")
+    # 随机 seed 和写文件的请求不可缓存
+    assert request_key({**PARAMS, "seed": None}, "model-a") is None
+    assert request_key({**PARAMS, "seed": "abc"}, "model-a") is None
+    output_path = {**PARAMS["output_options"], "output_path": "/tmp/out.png"}
+    assert request_key({**PARAMS, "output_options": output_path}, "model-a") is None
+
+
+def test_memory_lru_and_disk_tier():
+    value = [{"image": "x" * 1000, "seed": 1}]
+    memory_only = ResultCache(max_bytes=2500)
+    for key in ("a", "b", "c"):
+        memory_only.put(key, value)
+    assert memory_only.get("a") == (None, None)  # 超出预算，最旧的被淘汰
+    assert memory_only.get("c") == (value, "memory")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ResultCache(max_bytes=2 ** 20, disk_dir=tmp, max_disk_bytes=2500)
+        cache.put("aa11", value, render_seconds=2.0)
+
+        # 新进程 (内存层为空) 从磁盘层读取，之后提升到内存层
+        other = ResultCache(max_bytes=2 ** 20, disk_dir=tmp, max_disk_bytes=2500)
+        assert other.get("aa11") == (value, "disk")
+        assert other.get("aa11") == (value, "memory")
+        stats = other.stats()
+        assert stats["hits_disk"] == 1 and stats["hits_memory"] == 1 and stats["hit_rate"] == 1.0
+        assert stats["seconds_saved"] == 4.0 and stats["bytes_saved"] > 2000
+
+        # 磁盘层超出上限时按 mtime 淘汰最旧的条目
+        old = os.path.join(tmp, "aa", "aa11.json")
+        os.utime(old, (time.time() - 100, time.time() - 100))
+        cache.put("bb22", value)
+        cache.put("cc33", value)
+        assert not os.path.exists(old)
+        assert os.path.exists(os.path.join(tmp, "cc", "cc33.json"))
+        assert cache.stats()["evictions_disk"] == 1
+
+
+def test_concurrent_identical_requests_render_once():
+    cache = ResultCache()
+    calls = []
+
+    def _compute():
+        calls.append(1)
+        time.sleep(0.1)
+        return [{"image": "img", "seed": 7}]
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("k", _compute))) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert sorted(source for _, source in results) == ["computed", "inflight", "inflight"]
+    assert cache.stats()["hits_inflight"] == 2
+
+    # 生成失败时不缓存，等待者自己重新生成
+    def _fail():
+        raise RuntimeError("boom")
+    try:
+        cache.get_or_compute("bad", _fail)
+    except RuntimeError:
+        pass
+    assert cache.get_or_compute("bad", _compute)[1] == "computed"
+
+
+def test_async_identical_requests_render_once_off_the_event_loop():
+    cache = ResultCache()
+    lookup_threads, calls = [], []
+    lookup = cache._lookup
+
+    def _lookup(key):
+        lookup_threads.append(threading.current_thread())
+        return lookup(key)
+    cache._lookup = _lookup
+
+    async def _compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return [{"image": "img", "seed": 7}], 0.05
+
+    async def _uncacheable():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return None, 0.0
+
+    async def _main():
+        cached = await asyncio.gather(*(cache.get_or_compute_async("k", _compute) for _ in range(3)))
+        # 结果不可缓存 (例如任务被降级) 时，等待者各自重新生成
+        uncached = await asyncio.gather(*(cache.get_or_compute_async("u", _uncacheable) for _ in range(2)))
+        return cached, uncached
+
+    cached, uncached = asyncio.run(_main())
+    assert sorted(source for _, source in cached) == ["computed", "inflight", "inflight"]
+    assert uncached == [(None, "computed"), (None, "computed")]
+    assert len(calls) == 3
+    assert lookup_threads and threading.main_thread() not in lookup_threads
+    assert cache.stats()["hits_inflight"] == 2
+
+
+def test_handler_serves_repeated_seeded_requests_from_cache():
+    stand_in = StandInPipeline(delay=0)
+    saved = handler.pipeline, handler.result_cache, handler.MAX_BATCH_SIZE
+    handler.pipeline, handler.result_cache, handler.MAX_BATCH_SIZE = stand_in, ResultCache(), 1
+    try:
+        event = {"input": {"prompt": "a cat", "width": 64, "height": 64, "seed": 5, "num_images_per_prompt": 2}}
+        first = handler.handler(event)
+        second = handler.handler(event)
+        unseeded = [handler.handler({"input": {"prompt": "a cat", "width": 64, "height": 64}}) for _ in range(2)]
+        other_size = handler.handler({"input": {**event["input"], "width": 72}})
+        stats = handler.get_stats()["result_cache"]
+    finally:
+        handler.pipeline, handler.result_cache, handler.MAX_BATCH_SIZE = saved
+
+    assert "cache" not in first and second["cache"] == "memory"
+    assert second["images"] == first["images"] and second["seed"] == 5
+    assert all("cache" not in r for r in unseeded) and "cache" not in other_size
+    # 第一次、两次随机 seed、另一尺寸各调用一次 pipeline
+    assert len(stand_in.calls) == 4
+    assert stats["hits"] == 1 and stats["misses"] == 2 and stats["bytes_saved"] > 0
+
+
+if __name__ == "__main__":
+    test_request_key_normalization()
+    test_memory_lru_and_disk_tier()
+    test_concurrent_identical_requests_render_once()
+    test_async_identical_requests_render_once_off_the_event_loop()
+    test_handler_serves_repeated_seeded_requests_from_cache()
+    print("✅ 所有结果缓存测试通过")
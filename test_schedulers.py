@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+测试采样器注册表和按请求选择采样器 (CPU, 微型合成 SDXL 模型)
+"""
+
+import handler
+from schedulers import SchedulerRegistry, SAMPLERS, supports_karras
+from synthetic_sdxl import SCHEDULER_CONFIG, build_tiny_pipeline
+
+
+def test_registry_caches_instances_per_sampler_and_karras():
+    registry = SchedulerRegistry(SCHEDULER_CONFIG)
+
+    euler = registry.get("euler")
+    assert registry.get() is euler
+    assert registry.get("euler", karras=True) is not euler
+    assert registry.get("euler", karras=True).config.use_karras_sigmas
+
+    dpm = registry.get("dpmpp_2m", karras=True)
+    assert type(dpm).__name__ == "DPMSolverMultistepScheduler"
+    assert dpm.config.algorithm_type == "dpmsolver++"
+    assert dpm.config.beta_schedule == SCHEDULER_CONFIG["beta_schedule"]
+    assert registry.stats()["uses"] == {"euler": 2, "euler+karras": 2, "dpmpp_2m+karras": 1}
+
+
+def test_invalid_sampler_requests_are_rejected():
+    registry = SchedulerRegistry(SCHEDULER_CONFIG)
+    assert not supports_karras("euler_a")
+    for name, karras in [("nope", False), ("euler_a", True)]:
+        try:
+            registry.get(name, karras)
+            assert False, name
+        except ValueError:
+            pass
+
+    result = handler.handler({"input": {"prompt": "a cat", "sampler": "nope"}})
+    assert "Unknown sampler" in result["error"]
+
+
+def test_every_sampler_runs_through_generate_images():
+    pipe = build_tiny_pipeline()
+    old = handler.pipeline, handler.scheduler_registry
+    handler.pipeline = pipe
+    handler.scheduler_registry = SchedulerRegistry(pipe.scheduler.config)
+    try:
+        for name in SAMPLERS:
+            karras = supports_karras(name)
+            results = handler.generate_images(
+                "a cat", num_inference_steps=3, width=64, height=64, seed=0,
+                sampler=name, use_karras_sigmas=karras
+            )
+            assert results[0]["image"], name
+            assert pipe.scheduler is handler.scheduler_registry.get(name, karras)
+    finally:
+        handler.pipeline, handler.scheduler_registry = old
+
+
+if __name__ == "__main__":
+    test_registry_caches_instances_per_sampler_and_karras()
+    test_invalid_sampler_requests_are_rejected()
+    test_every_sampler_runs_through_generate_images()
+    print("✅ 所有采样器测试通过")
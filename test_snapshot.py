@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+测试单文件 fp16 快照的导出、加载和 load_model 快速路径
+"""
+
+import json
+import os
+import struct
+import tempfile
+
+import torch
+from diffusers import StableDiffusionXLPipeline
+
+import handler
+from mmap_loader import MMAP_COMPONENTS
+from preflight import STRATEGY_SNAPSHOT, STRATEGY_MMAP
+from snapshot import export_snapshot, load_snapshot, load_snapshot_config, snapshot_dir
+from synthetic_sdxl import write_tiny_model_dir
+
+
+def _read_header(path):
+    with open(path, "rb") as f:
+        (length,) = struct.unpack("<Q", f.read(8))
+        return json.loads(f.read(length)), 8 + length
+
+
+def test_export_layout_is_contiguous_per_component():
+    with tempfile.TemporaryDirectory() as model_path:
+        write_tiny_model_dir(model_path)
+        config = export_snapshot(model_path)
+        header, data_start = _read_header(os.path.join(snapshot_dir(model_path), config["weights"]))
+
+    header.pop("__metadata__")
+    assert {entry["dtype"] for entry in header.values()} == {"F16"}
+
+    end = data_start
+    for name in MMAP_COMPONENTS:
+        offsets = [entry["data_offsets"] for key, entry in header.items() if key.startswith(f"{name}.")]
+        start, stop = min(o[0] for o in offsets) + data_start, max(o[1] for o in offsets) + data_start
+        layout = config["layout"][name]
+        assert (start, stop - start, len(offsets)) == (layout["offset"], layout["bytes"], layout["tensors"])
+        # 组件按顺序首尾相接
+        assert start == end, name
+        end = stop
+
+
+def test_snapshot_matches_folder_and_expires():
+    with tempfile.TemporaryDirectory() as model_path:
+        write_tiny_model_dir(model_path)
+        export_snapshot(model_path)
+        pipe, stats = load_snapshot(model_path, StableDiffusionXLPipeline, torch.float16)
+        reference = StableDiffusionXLPipeline.from_pretrained(model_path, torch_dtype=torch.float16, variant="fp16")
+
+        for name in MMAP_COMPONENTS:
+            ours, theirs = getattr(pipe, name).state_dict(), getattr(reference, name).state_dict()
+            assert ours.keys() == theirs.keys(), name
+            assert all(torch.equal(ours[k], theirs[k]) for k in theirs), name
+            assert stats["components"][name]["bytes"] > 0
+        assert type(pipe.scheduler) is type(reference.scheduler)
+        assert pipe.tokenizer_2.model_max_length == reference.tokenizer_2.model_max_length
+
+        # 源文件被修改后快照失效
+        os.utime(os.path.join(model_path, "unet", "config.json"), ns=(0, 0))
+        assert load_snapshot_config(model_path) is None
+
+
+def test_load_model_prefers_snapshot():
+    saved = handler.MODEL_PATH, handler.pipeline, handler.USE_LOAD_MANIFEST
+    with tempfile.TemporaryDirectory() as model_path:
+        write_tiny_model_dir(model_path)
+        handler.MODEL_PATH, handler.USE_LOAD_MANIFEST = model_path, False
+        try:
+            handler.load_model()
+            assert handler.load_stats["strategy"]["name"] == STRATEGY_MMAP
+
+            config = export_snapshot(model_path)
+            handler.load_model()
+            assert handler.load_stats["strategy"]["name"] == STRATEGY_SNAPSHOT
+            assert handler.load_stats["components"]["unet"]["files"] == [config["weights"]]
+            assert handler.pipeline.unet.dtype == torch.float32  # CPU 上按策略 dtype 转换
+
+            # 快照过期时退回目录加载
+            os.utime(os.path.join(model_path, "vae", "config.json"), ns=(0, 0))
+            handler.load_model()
+            strategy = handler.load_stats["strategy"]
+        finally:
+            handler.MODEL_PATH, handler.pipeline, handler.USE_LOAD_MANIFEST = saved
+
+    assert strategy["name"] == STRATEGY_MMAP and strategy["attempts"] == 2
+
+
+if __name__ == "__main__":
+    test_export_layout_is_contiguous_per_component()
+    test_snapshot_matches_folder_and_expires()
+    test_load_model_prefers_snapshot()
+    print("✅ 所有快照测试通过")
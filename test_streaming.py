@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+测试流式 handler 的进度 / 预览事件和取消 (CPU, 微型合成 SDXL 模型)
+"""
+
+import base64
+import threading
+
+import handler
+from streaming import StepStreamer, stream_generation
+from synthetic_sdxl import build_tiny_pipeline
+
+
+def _with_tiny_pipeline(fn):
+    old_pipeline = handler.pipeline
+    handler.pipeline = build_tiny_pipeline()
+    try:
+        return fn()
+    finally:
+        handler.pipeline = old_pipeline
+
+
+def test_stream_yields_progress_previews_then_result():
+    event = {"input": {
+        "prompt": "a cat", "num_inference_steps": 4, "width": 64, "height": 64,
+        "seed": 1, "preview_every": 2, "preview_size": 32
+    }}
+    events = _with_tiny_pipeline(lambda: list(handler.handler_stream(event)))
+
+    progress = [e for e in events if e["type"] == "progress"]
+    previews = [e for e in events if e["type"] == "preview"]
+    assert [e["step"] for e in progress] == [1, 2, 3, 4]
+    assert [e["step"] for e in previews] == [2, 4]
+    assert base64.b64decode(previews[0]["images"][0])[:2] == b"\xff\xd8"  # JPEG
+
+    assert events[-1]["type"] == "result"
+    assert events[-1]["seed"] == 1 and events[-1]["image"]
+
+
+def test_stream_reports_validation_errors():
+    events = list(handler.handler_stream({"input": {"prompt": ""}}))
+    assert events == [{"type": "error", "error": "Prompt is required"}]
+
+
+def test_closing_the_stream_interrupts_denoising():
+    pipe = build_tiny_pipeline()
+    streamer = StepStreamer(total_steps=50)
+    first_step_seen = threading.Event()
+    steps_run = []
+
+    def _generate(streamer):
+        def _callback(p, step, timestep, kwargs):
+            steps_run.append(step)
+            first_step_seen.set()
+            return streamer.callback(p, step, timestep, kwargs)
+        pipe(prompt="a cat", num_inference_steps=50, width=64, height=64, callback_on_step_end=_callback)
+        return {}
+
+    stream = stream_generation(_generate, streamer)
+    assert next(stream)["type"] == "progress"
+    stream.close()
+
+    assert streamer.cancelled.is_set()
+    assert first_step_seen.is_set()
+    # 关闭后 pipeline 在下一步设置 _interrupt，不会跑完 50 步
+    for thread in threading.enumerate():
+        if thread.name == "stream-generation":
+            thread.join(timeout=30)
+    assert len(steps_run) < 50
+
+
+if __name__ == "__main__":
+    test_stream_yields_progress_previews_then_result()
+    test_stream_reports_validation_errors()
+    test_closing_the_stream_interrupts_denoising()
+    print("✅ 所有流式测试通过")
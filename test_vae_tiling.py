@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+测试大尺寸输出自动使用分块 VAE (CPU, 微型合成 SDXL 模型)
+"""
+
+import numpy as np
+
+import handler
+from synthetic_sdxl import build_tiny_pipeline
+from vae_tiling import VaeTiling
+
+
+def test_tiling_follows_pixel_threshold():
+    vae = build_tiny_pipeline().vae
+    tiling = VaeTiling(min_pixels=64 * 64, tile_size=32)
+
+    assert tiling.configure(vae, 64, 64) == {"tiled": False, "sliced": False}
+    assert not vae.use_tiling
+
+    assert tiling.configure(vae, 128, 128, batch=2) == {"tiled": True, "sliced": True}
+    assert vae.use_tiling and vae.use_slicing
+    assert (vae.tile_sample_min_size, vae.tile_latent_min_size) == (32, 4)
+
+    tiling.configure(vae, 64, 64)
+    assert not vae.use_tiling and not vae.use_slicing
+    assert tiling.stats()["tiled"] == 1
+
+
+def test_large_requests_decode_in_tiles():
+    pipe = build_tiny_pipeline()
+    tiled_calls = []
+    original = pipe.vae.tiled_decode
+    pipe.vae.tiled_decode = lambda *a, **k: tiled_calls.append(1) or original(*a, **k)
+
+    def _generate():
+        return handler.run_pipeline(["a cat"], [""], [7], 2, 7.0, 128, 128)[0]
+
+    saved = handler.pipeline, handler.vae_tiling
+    handler.pipeline = pipe
+    try:
+        handler.vae_tiling = None
+        full = _generate()
+        handler.vae_tiling = VaeTiling(min_pixels=64 * 64, tile_size=64)
+        tiled = _generate()
+    finally:
+        handler.pipeline, handler.vae_tiling = saved
+
+    assert len(tiled_calls) == 1
+    assert tiled.shape == full.shape == (128, 128, 3)
+    # 重叠混合后与整块解码只有边界附近的微小差异
+    assert np.abs(tiled - full).mean() < 0.1
+
+
+if __name__ == "__main__":
+    test_tiling_follows_pixel_threshold()
+    test_large_requests_decode_in_tiles()
+    print("✅ 所有分块 VAE 测试通过")
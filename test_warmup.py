@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+测试模型预热模式
+"""
+
+from synthetic_sdxl import build_tiny_pipeline
+from warmup import parse_resolutions, run_warmup, start_background_warmup
+
+
+def test_parse_resolutions():
+    assert parse_resolutions("1024x1024, 830x1216,bad") == [(1024, 1024), (824, 1216)]
+    assert parse_resolutions("") == []
+
+
+def test_sync_modes_record_timings():
+    pipe = build_tiny_pipeline()
+
+    assert run_warmup(pipe, "skip")["seconds"] == 0.0
+    assert run_warmup(pipe, "encode")["seconds"] > 0
+
+    stats = run_warmup(pipe, "unet", [(64, 64), (128, 64)])
+    assert set(stats["resolutions"]) == {"64x64", "128x64"}
+
+    stats = run_warmup(pipe, "full")
+    assert stats["status"] == "ok" and "64x64" in stats["resolutions"]
+
+
+def test_background_warmup_finishes():
+    pipe = build_tiny_pipeline()
+    stats = {}
+    thread = start_background_warmup(pipe, [(64, 64)], stats=stats)
+    thread.join(timeout=60)
+
+    assert stats["status"] == "ok"
+    assert stats["mode"] == "background"
+    assert stats["seconds"] > 0
+
+
+if __name__ == "__main__":
+    test_parse_resolutions()
+    test_sync_modes_record_timings()
+    test_background_warmup_finishes()
+    print("✅ 所有预热测试通过")
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+测试本地权重缓存 (填充、哈希校验、命中、淘汰、load_model 集成)
+"""
+
+import json
+import os
+import signal
+import tempfile
+
+import handler
+import model_manifest
+import weight_cache
+from model_manifest import load_manifest, write_manifest
+from snapshot import SNAPSHOT_DIRNAME, export_snapshot
+from synthetic_sdxl import write_tiny_model_dir
+from weight_cache import ENTRY_MARKER, WeightCache
+
+
+def _model_dir(root, name, fp16_variant=False):
+    path = os.path.join(root, name)
+    write_tiny_model_dir(path, fp16_variant=fp16_variant)
+    return path, write_manifest(path)
+
+
+def test_populate_and_lookup():
+    with tempfile.TemporaryDirectory() as root:
+        model_path, manifest = _model_dir(root, "volume")
+        cache = WeightCache(os.path.join(root, "cache"), 2 ** 30, link_mode="copy")
+        assert cache.lookup(manifest) is None
+
+        entry = cache.populate(model_path, manifest)
+        assert entry == cache.entry_path(manifest["digest"])
+        assert cache.lookup(manifest) == entry
+        for rel_path, info in manifest["files"].items():
+            local = os.path.join(entry, rel_path)
+            assert not os.path.samefile(local, os.path.join(model_path, rel_path))
+            assert os.path.getsize(local) == info["size"]
+
+        stats = cache.stats()
+        assert stats["hits"] == 1 and stats["misses"] == 1 and stats["entries"] == 1
+        assert stats["last_populate"]["modes"] == {"copy": len(manifest["files"])}
+
+        # 本地副本被修改后不再命中
+        with open(os.path.join(entry, "model_index.json"), "a") as f:
+            f.write(" ")
+        assert cache.lookup(manifest) is None
+
+        # 同一文件系统上 auto 模式使用硬链接
+        linked = WeightCache(os.path.join(root, "linked"), 2 ** 30)
+        entry = linked.populate(model_path, manifest)
+        assert os.path.samefile(os.path.join(entry, "unet", "config.json"), os.path.join(model_path, "unet", "config.json"))
+
+
+def test_hash_mismatch_is_not_published():
+    with tempfile.TemporaryDirectory() as root:
+        model_path, manifest = _model_dir(root, "volume")
+        manifest["files"]["unet/config.json"]["hash"] = "0" * 64
+        cache = WeightCache(os.path.join(root, "cache"), 2 ** 30, link_mode="copy")
+        try:
+            cache.populate(model_path, manifest)
+            assert False, "expected hash mismatch"
+        except ValueError:
+            pass
+        assert os.listdir(cache.root) == []
+        assert cache.lookup(manifest) is None
+
+
+def test_corrupted_copy_of_sampled_file_is_rejected():
+    """清单只采样大文件头尾；副本中间的损坏要靠完整哈希发现"""
+    saved = model_manifest.HASH_FULL_LIMIT, model_manifest.HASH_SAMPLE_BYTES, weight_cache._copy_hashed
+    copy_hashed = weight_cache._copy_hashed
+
+    def corrupting_copy(src, dst):
+        source_hash = copy_hashed(src, dst)
+        if dst.endswith("blob.bin"):
+            st = os.stat(dst)
+            with open(dst, "r+b") as f:
+                f.seek(st.st_size // 2)
+                byte = f.read(1)
+                f.seek(st.st_size // 2)
+                f.write(bytes([byte[0] ^ 0xFF]))
+            os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+        return source_hash
+
+    with tempfile.TemporaryDirectory() as root:
+        model_path = os.path.join(root, "volume")
+        write_tiny_model_dir(model_path)
+        with open(os.path.join(model_path, "unet", "blob.bin"), "wb") as f:
+            f.write(os.urandom(64 * 1024))
+        model_manifest.HASH_FULL_LIMIT, model_manifest.HASH_SAMPLE_BYTES = 1024, 256
+        try:
+            manifest = write_manifest(model_path)
+            assert manifest["files"]["unet/blob.bin"]["hash_mode"] == "sha256-sampled"
+
+            cache = WeightCache(os.path.join(root, "cache"), 2 ** 30, link_mode="copy")
+            weight_cache._copy_hashed = corrupting_copy
+            try:
+                cache.populate(model_path, manifest)
+                assert False, "expected corrupted copy to be rejected"
+            except ValueError as e:
+                assert "blob.bin" in str(e)
+            assert os.listdir(cache.root) == []
+
+            # 未损坏时完整哈希写入条目标记
+            weight_cache._copy_hashed = copy_hashed
+            entry = cache.populate(model_path, manifest)
+            with open(os.path.join(entry, ENTRY_MARKER)) as f:
+                recorded = json.load(f)["sha256"]
+            assert recorded["unet/blob.bin"] == weight_cache.full_hash(os.path.join(model_path, "unet", "blob.bin"))
+        finally:
+            model_manifest.HASH_FULL_LIMIT, model_manifest.HASH_SAMPLE_BYTES, weight_cache._copy_hashed = saved
+
+
+def test_snapshot_is_not_cached():
+    with tempfile.TemporaryDirectory() as root:
+        model_path = os.path.join(root, "volume")
+        write_tiny_model_dir(model_path)
+        export_snapshot(model_path)
+        manifest = write_manifest(model_path)
+        snapshot_bytes = sum(
+            info["size"] for rel_path, info in manifest["files"].items() if rel_path.startswith(SNAPSHOT_DIRNAME + "/")
+        )
+        assert snapshot_bytes > 0
+
+        cache = WeightCache(os.path.join(root, "cache"), 2 ** 30, link_mode="copy")
+        entry = cache.populate(model_path, manifest)
+        assert not os.path.exists(os.path.join(entry, SNAPSHOT_DIRNAME))
+        assert cache.lookup(manifest) == entry
+        total = sum(info["size"] for info in manifest["files"].values())
+        assert cache.stats()["bytes"] == total - snapshot_bytes
+
+
+def test_forked_child_does_not_inherit_a_held_lock():
+    with tempfile.TemporaryDirectory() as root:
+        cache = WeightCache(os.path.join(root, "cache"), 2 ** 30)
+        # 模拟 fork 时后台填充线程正持有锁
+        with cache._lock:
+            pid = os.fork()
+            if pid == 0:
+                signal.alarm(10)
+                cache.stats()
+                os._exit(0)
+        _, status = os.waitpid(pid, 0)
+        assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+
+
+def test_eviction_keeps_cache_under_cap():
+    with tempfile.TemporaryDirectory() as root:
+        old_path, old_manifest = _model_dir(root, "v1")
+        new_path, new_manifest = _model_dir(root, "v2", fp16_variant=True)
+        assert old_manifest["digest"] != new_manifest["digest"]
+        size = sum(info["size"] for info in new_manifest["files"].values())
+
+        cache = WeightCache(os.path.join(root, "cache"), size * 1.5, link_mode="copy")
+        cache.populate(old_path, old_manifest)
+        cache.populate(new_path, new_manifest)
+
+        stats = cache.stats()
+        assert stats["evicted"] == 1 and stats["entries"] == 1
+        assert stats["bytes"] <= cache.max_bytes
+        assert cache.lookup(old_manifest) is None
+        assert cache.lookup(new_manifest) is not None
+
+        # 单个模型就超过上限时不缓存
+        tiny = WeightCache(os.path.join(root, "tiny"), 1024, link_mode="copy")
+        assert tiny.populate(new_path, new_manifest) is None
+
+
+def test_load_model_uses_local_copy_after_first_load():
+    saved = handler.MODEL_PATH, handler.pipeline, handler.USE_LOAD_MANIFEST, handler.weight_cache
+    with tempfile.TemporaryDirectory() as root:
+        model_path = os.path.join(root, "volume")
+        write_tiny_model_dir(model_path)
+        handler.MODEL_PATH, handler.USE_LOAD_MANIFEST = model_path, True
+        handler.weight_cache = WeightCache(os.path.join(root, "cache"), 2 ** 30, link_mode="copy")
+        try:
+            handler.load_model()
+            assert handler.load_stats["source"] == "volume"
+            handler.weight_cache._thread.join(timeout=60)
+
+            digest = load_manifest(model_path)["digest"]
+            entry = handler.weight_cache.entry_path(digest)
+            assert os.path.exists(os.path.join(entry, ENTRY_MARKER))
+
+            handler.load_model()
+            assert handler.load_stats["source"] == "local_cache"
+            assert handler.get_stats()["weight_cache"]["hits"] == 1
+        finally:
+            handler.MODEL_PATH, handler.pipeline, handler.USE_LOAD_MANIFEST, handler.weight_cache = saved
+
+
+if __name__ == "__main__":
+    test_populate_and_lookup()
+    test_hash_mismatch_is_not_published()
+    test_corrupted_copy_of_sampled_file_is_rejected()
+    test_snapshot_is_not_cached()
+    test_forked_child_does_not_inherit_a_held_lock()
+    test_eviction_keeps_cache_under_cap()
+    test_load_model_uses_local_copy_after_first_load()
+    print("✅ 所有权重缓存测试通过")
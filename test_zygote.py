@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+测试 zygote 模式：fork 出的子进程继承已加载的 pipeline，异常退出的子进程被重启
+"""
+
+import json
+import os
+import tempfile
+import time
+
+import torch
+
+from synthetic_sdxl import build_tiny_pipeline
+from zygote import Supervisor
+
+
+def _latents(pipe):
+    generator = torch.Generator().manual_seed(0)
+    with torch.no_grad():
+        return pipe(
+            prompt="a red fox", num_inference_steps=2, width=64, height=64, output_type="latent", generator=generator
+        ).images
+
+
+def _wait_until_finished(supervisor, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        supervisor.supervise_once()
+        if all(child["status"] in ("exited", "failed") for child in supervisor.stats()["children"]):
+            return supervisor.stats()
+        time.sleep(0.05)
+    supervisor.stop()
+    raise AssertionError("children did not finish")
+
+
+def test_children_inherit_loaded_pipeline():
+    load_start = time.perf_counter()
+    pipe = build_tiny_pipeline()
+    expected = _latents(pipe)
+    load_seconds = time.perf_counter() - load_start
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        def _target():
+            import random
+            import zygote
+            info = zygote.worker_info()
+            torch.save(
+                {"latents": _latents(pipe), "random": random.random(), "info": info},
+                os.path.join(out_dir, f"{info['index']}.pt"),
+            )
+
+        supervisor = Supervisor(_target, workers=2, ready_check=lambda: pipe.encode_prompt("ready", device="cpu"),
+                                parent_load_s=load_seconds)
+        supervisor.start()
+        assert supervisor.wait_ready(timeout=60)
+        stats = _wait_until_finished(supervisor)
+        results = [torch.load(os.path.join(out_dir, f"{i}.pt")) for i in range(2)]
+
+    assert [child["status"] for child in stats["children"]] == ["exited", "exited"]
+    assert all(child["time_to_ready_s"] is not None for child in stats["children"])
+    assert stats["parent_load_s"] == load_seconds and stats["restarts"] == 0
+    for result in results:
+        assert torch.equal(result["latents"], expected)
+        assert result["info"]["parent_load_s"] == load_seconds
+    # 每个子进程重新播种，随机 seed 不会重复
+    assert results[0]["random"] != results[1]["random"]
+
+
+def test_crashed_child_is_restarted():
+    with tempfile.TemporaryDirectory() as out_dir:
+        marker = os.path.join(out_dir, "crashed")
+
+        def _crash_once():
+            if not os.path.exists(marker):
+                open(marker, "w").close()
+                os._exit(3)
+
+        supervisor = Supervisor(_crash_once, workers=1, restart_backoff=0)
+        supervisor.start()
+        stats = _wait_until_finished(supervisor)
+
+    child = stats["children"][0]
+    assert child["status"] == "exited" and child["exitcode"] == 0
+    assert child["generation"] == 2 and stats["restarts"] == 1
+
+
+def test_restart_limit():
+    supervisor = Supervisor(lambda: os._exit(1), workers=1, max_restarts=2, restart_backoff=0)
+    supervisor.start()
+    stats = _wait_until_finished(supervisor)
+    child = stats["children"][0]
+    assert child["status"] == "failed" and child["restarts"] == 2 and child["generation"] == 3
+    print(json.dumps(stats))
+
+
+if __name__ == "__main__":
+    test_children_inherit_loaded_pipeline()
+    test_crashed_child_is_restarted()
+    test_restart_limit()
+    print("✅ 所有 zygote 测试通过")
@@ -0,0 +1,155 @@
+"""
+模型预热 (warmup)
+
+替代 load_model() 末尾固定的 1 步 64x64 冒烟测试。支持的模式:
+
+- skip:       不做任何检查
+- encode:     只跑一次两个文本编码器
+- unet:       在小 latent 上做一次 UNet 前向 (默认，能暴露 meta tensor / 设备问题)
+- full:       完整 1 步 pipeline 调用 (原冒烟测试)
+- background: 完整预热放到后台线程，worker 立即开始接收任务
+
+配置了 resolutions 时，unet/full/background 模式会按这些分辨率逐个预热，
+让之后真实请求的 kernel 选择和显存分配都已经完成。
+"""
+
+import threading
+import time
+import logging
+import contextlib
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+WARMUP_MODES = ("skip", "encode", "unet", "full", "background")
+
+# 未配置分辨率时使用的最小尺寸 (与原冒烟测试一致)
+DEFAULT_RESOLUTION = (64, 64)
+
+
+def parse_resolutions(value):
+    """解析 "1024x1024,832x1216" 形式的分辨率列表"""
+    resolutions = []
+    for item in (value or "").split(","):
+        item = item.strip().lower()
+        if not item:
+            continue
+        try:
+            width, height = (int(v) for v in item.split("x"))
+        except ValueError:
+            logger.warning(f"⚠️ 无效的预热分辨率: {item}")
+            continue
+        resolutions.append(((width // 8) * 8, (height // 8) * 8))
+    return resolutions
+
+
+def warmup_encode(pipe):
+    """只运行文本编码器"""
+    with torch.no_grad():
+        pipe.encode_prompt(
+            prompt="warmup",
+            device=pipe._execution_device,
+            num_images_per_prompt=1,
+            do_classifier_free_guidance=True,
+            negative_prompt="",
+        )
+
+
+def warmup_unet(pipe, width, height):
+    """在 (height/8, width/8) 的 latent 上做一次 UNet 前向，带 CFG 的批大小 2"""
+    unet = pipe.unet
+    config = unet.config
+    device = pipe._execution_device
+    dtype = unet.dtype
+
+    batch = 2
+    latents = torch.zeros(batch, config.in_channels, height // 8, width // 8, device=device, dtype=dtype)
+    encoder_hidden_states = torch.zeros(batch, 77, config.cross_attention_dim, device=device, dtype=dtype)
+
+    added_cond_kwargs = None
+    if config.addition_embed_type == "text_time":
+        time_ids_dim = 6 * config.addition_time_embed_dim
+        text_embeds_dim = config.projection_class_embeddings_input_dim - time_ids_dim
+        added_cond_kwargs = {
+            "text_embeds": torch.zeros(batch, text_embeds_dim, device=device, dtype=dtype),
+            "time_ids": torch.tensor(
+                [[height, width, 0, 0, height, width]] * batch, device=device, dtype=dtype
+            ),
+        }
+
+    with torch.no_grad():
+        unet(
+            latents,
+            torch.tensor(999, device=device),
+            encoder_hidden_states=encoder_hidden_states,
+            added_cond_kwargs=added_cond_kwargs,
+            return_dict=False,
+        )
+
+
+def warmup_full(pipe, width, height):
+    """完整的 1 步 pipeline 调用"""
+    with torch.no_grad():
+        pipe(
+            prompt="test",
+            num_inference_steps=1,
+            width=width,
+            height=height,
+            output_type="pil",
+        )
+
+
+def run_warmup(pipe, mode="unet", resolutions=None, lock=None):
+    """同步执行预热，返回 {mode, seconds, resolutions: {"WxH": seconds}, status}
+
+    lock 用于与并发请求互斥 (每个分辨率单独加锁，后台预热不会长时间阻塞请求)。
+    出错时抛出异常，由调用方决定是否视为加载失败。
+    """
+    if mode not in WARMUP_MODES:
+        raise ValueError(f"Unknown warmup mode: {mode} (expected one of {WARMUP_MODES})")
+
+    lock = lock or contextlib.nullcontext()
+    stats = {"mode": mode, "seconds": 0.0, "resolutions": {}, "status": "ok"}
+    start = time.perf_counter()
+
+    if mode == "skip":
+        return stats
+
+    if mode == "encode":
+        with lock:
+            warmup_encode(pipe)
+    else:
+        for width, height in resolutions or [DEFAULT_RESOLUTION]:
+            resolution_start = time.perf_counter()
+            with lock:
+                if mode == "unet":
+                    warmup_unet(pipe, width, height)
+                else:
+                    warmup_full(pipe, width, height)
+            seconds = time.perf_counter() - resolution_start
+            stats["resolutions"][f"{width}x{height}"] = round(seconds, 4)
+            logger.info(f"🔥 预热 {width}x{height} ({mode}) 耗时 {seconds:.2f}s")
+
+    stats["seconds"] = round(time.perf_counter() - start, 4)
+    logger.info(f"🔥 预热完成 ({mode}): {stats['seconds']:.2f}s")
+    return stats
+
+
+def start_background_warmup(pipe, resolutions=None, lock=None, stats=None):
+    """在后台线程中执行完整预热，stats dict 会在完成后被原地更新"""
+    stats = stats if stats is not None else {}
+    stats.update({"mode": "background", "status": "running", "seconds": None, "resolutions": {}})
+
+    def _run():
+        try:
+            result = run_warmup(pipe, "full", resolutions, lock)
+            result["mode"] = "background"
+            stats.update(result)
+        except Exception as e:
+            logger.error(f"❌ 后台预热失败: {e}")
+            stats.update({"status": "failed", "error": str(e)})
+
+    thread = threading.Thread(target=_run, name="warmup", daemon=True)
+    thread.start()
+    return thread
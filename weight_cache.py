@@ -0,0 +1,292 @@
+"""
+网络卷前面的本地权重缓存
+
+MODEL_PATH 位于网络卷上，首次读取很慢。模型加载成功后，在后台把校验清单中的
+文件复制到容器本地磁盘 (同一文件系统时用硬链接，支持时用 reflink，否则普通复制)，
+逐个按清单哈希校验，全部通过后才原子地发布为缓存条目。之后的冷启动 (例如进程
+重启) 直接从本地副本加载。
+
+清单对大文件只采样头尾计算哈希，因此副本 (非硬链接) 另外计算完整的 SHA-256 并与
+源文件逐字节的完整哈希比较，记录在条目标记文件中。snapshot/ 下的单文件快照与各组件
+的权重重复，不进入缓存 (从本地副本加载时使用 mmap 逐组件加载)，缓存占用不会翻倍。
+
+缓存条目以清单的目录指纹 (digest) 命名，同一缓存目录可以容纳多个模型版本；
+总大小超过 max_bytes 时按最近使用时间淘汰旧条目。复制时保留 mtime，命中时用
+validate_manifest() 一次 stat 扫描即可确认本地副本完整。
+"""
+
+import errno
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import weakref
+
+from model_manifest import file_hash, validate_manifest
+from snapshot import SNAPSHOT_DIRNAME
+
+logger = logging.getLogger(__name__)
+
+ENTRY_MARKER = ".weight_cache_entry.json"
+
+# Linux FICLONE ioctl (btrfs / xfs 等支持 reflink 的文件系统)
+_FICLONE = 0x40049409
+
+LINK_MODES = ("auto", "hardlink", "reflink", "copy")
+
+# 超过该时间未更新的 .partial 目录视为中断的填充任务遗留，可以删除
+STALE_PARTIAL_SECONDS = 3600
+
+# 复制 / 计算完整哈希时每次读取的字节数
+COPY_CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def full_hash(path):
+    """整个文件的 SHA-256 (流式读取)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _copy_hashed(src, dst):
+    """复制文件并保留 mtime，返回复制过程中读到的源文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        for chunk in iter(lambda: fin.read(COPY_CHUNK_BYTES), b""):
+            digest.update(chunk)
+            fout.write(chunk)
+    shutil.copystat(src, dst)
+    return digest.hexdigest()
+
+
+def cached_files(manifest):
+    """清单中需要进入缓存的文件 (不含 snapshot/ 下的快照)"""
+    prefix = SNAPSHOT_DIRNAME + "/"
+    return {rel_path: info for rel_path, info in manifest["files"].items() if not rel_path.startswith(prefix)}
+
+
+def _reflink(src, dst):
+    import fcntl
+
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        fcntl.ioctl(fout.fileno(), _FICLONE, fin.fileno())
+
+
+def place_file(src, dst, mode="auto"):
+    """把 src 放到 dst，返回 (实际使用的方式, 源文件的完整 SHA-256)
+
+    方式为 hardlink / reflink / copy；只有普通复制时顺带计算源文件哈希，其余为 None。
+    复制时保留 mtime (shutil.copystat)，便于之后用清单做 stat 校验。
+    """
+    if mode in ("auto", "hardlink"):
+        try:
+            os.link(src, dst)
+            return "hardlink", None
+        except OSError:
+            if mode == "hardlink":
+                raise
+    if mode in ("auto", "reflink"):
+        try:
+            _reflink(src, dst)
+            shutil.copystat(src, dst)
+            return "reflink", None
+        except (OSError, ImportError):
+            if os.path.exists(dst):
+                os.remove(dst)
+            if mode == "reflink":
+                raise
+    return "copy", _copy_hashed(src, dst)
+
+
+class WeightCache:
+    """按模型指纹组织的本地权重缓存
+
+    root/<digest>/           已校验的完整副本 (含 ENTRY_MARKER)
+    root/<digest>.partial-*  正在填充的临时目录
+    """
+
+    def __init__(self, root, max_bytes, link_mode="auto"):
+        if link_mode not in LINK_MODES:
+            raise ValueError(f"link_mode must be one of {LINK_MODES}, got {link_mode!r}")
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.link_mode = link_mode
+
+        self._lock = threading.Lock()
+        self._thread = None
+        # zygote 模式在后台填充线程运行时 fork：子进程里没有这个线程，它持有的锁永远不会释放
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._reset_after_fork())
+        self._hits = 0
+        self._misses = 0
+        self._populated = 0
+        self._evicted = 0
+        self._last_populate = None
+
+    def entry_path(self, digest):
+        return os.path.join(self.root, digest)
+
+    def _entries(self):
+        """已发布的条目: [(digest, 大小, 最近使用时间)]"""
+        entries = []
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            marker = os.path.join(self.root, name, ENTRY_MARKER)
+            try:
+                with open(marker) as f:
+                    info = json.load(f)
+                entries.append((name, int(info["bytes"]), os.stat(marker).st_mtime))
+            except (OSError, ValueError, KeyError):
+                continue
+        return entries
+
+    def lookup(self, manifest):
+        """返回与清单一致的本地副本路径，没有时返回 None"""
+        if not manifest or not manifest.get("digest"):
+            return None
+        path = self.entry_path(manifest["digest"])
+        marker = os.path.join(path, ENTRY_MARKER)
+        if os.path.exists(marker) and validate_manifest(path, {**manifest, "files": cached_files(manifest)}):
+            os.utime(marker)  # 更新最近使用时间 (LRU)
+            with self._lock:
+                self._hits += 1
+            return path
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def _remove_stale_partials(self):
+        now = time.time()
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if ".partial-" in name and now - os.stat(path).st_mtime > STALE_PARTIAL_SECONDS:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _evict(self, needed, keep):
+        """淘汰最久未使用的条目，直到能再放下 needed 字节"""
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        for digest, size, _ in entries:
+            if total + needed <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            shutil.rmtree(self.entry_path(digest), ignore_errors=True)
+            total -= size
+            with self._lock:
+                self._evicted += 1
+            logger.info(f"🗑️ 淘汰权重缓存条目 {digest[:12]} ({size / 2 ** 30:.2f} GB)")
+        return total + needed <= self.max_bytes
+
+    def populate(self, source_path, manifest):
+        """把 source_path 复制到缓存并按清单校验，成功时返回条目路径"""
+        digest = manifest["digest"]
+        files = cached_files(manifest)
+        needed = sum(info["size"] for info in files.values())
+        final_path = self.entry_path(digest)
+        if os.path.exists(os.path.join(final_path, ENTRY_MARKER)):
+            return final_path
+
+        if needed > self.max_bytes:
+            logger.warning(f"⚠️ 模型大小 {needed / 2 ** 30:.2f} GB 超过权重缓存上限，不缓存")
+            return None
+        os.makedirs(self.root, exist_ok=True)
+        self._remove_stale_partials()
+        if not self._evict(needed, keep=digest) or shutil.disk_usage(self.root).free < needed:
+            logger.warning("⚠️ 本地磁盘空间不足，不缓存权重")
+            return None
+
+        start = time.perf_counter()
+        tmp_path = f"{final_path}.partial-{os.getpid()}-{threading.get_ident()}"
+        modes = {}
+        full_hashes = {}
+        try:
+            for rel_path, info in files.items():
+                src = os.path.join(source_path, rel_path)
+                dst = os.path.join(tmp_path, rel_path)
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                mode, source_hash = place_file(src, dst, self.link_mode)
+                modes[mode] = modes.get(mode, 0) + 1
+
+                hash_mode, hexdigest = file_hash(dst, info["size"])
+                if os.path.getsize(dst) != info["size"] or (hash_mode, hexdigest) != (info["hash_mode"], info["hash"]):
+                    raise ValueError(f"hash mismatch for {rel_path}")
+                # 硬链接与源文件是同一个 inode；其它方式逐字节比较完整哈希
+                if mode != "hardlink":
+                    full_hashes[rel_path] = full_hash(dst)
+                    if full_hashes[rel_path] != (source_hash or full_hash(src)):
+                        raise ValueError(f"copy of {rel_path} differs from the source")
+
+            with open(os.path.join(tmp_path, ENTRY_MARKER), "w") as f:
+                json.dump({
+                    "digest": digest, "bytes": needed, "source": source_path, "created_at": time.time(),
+                    "sha256": full_hashes,
+                }, f)
+            try:
+                os.rename(tmp_path, final_path)
+            except OSError as e:
+                # 其它进程已经发布了同一条目
+                if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                    raise
+                shutil.rmtree(tmp_path, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self._populated += 1
+            self._last_populate = {
+                "digest": digest,
+                "bytes": needed,
+                "seconds": round(seconds, 3),
+                "modes": modes,
+            }
+        logger.info(f"💾 权重已缓存到本地: {needed / 2 ** 20:.1f} MB, {seconds:.2f}s, {modes}")
+        return final_path
+
+    def _reset_after_fork(self):
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def populate_in_background(self, source_path, manifest):
+        """在后台线程中填充缓存；已有填充任务在运行时不重复启动"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return self._thread
+
+            def _run():
+                try:
+                    self.populate(source_path, manifest)
+                except Exception as e:
+                    logger.warning(f"⚠️ 填充权重缓存失败: {e}")
+                    with self._lock:
+                        self._last_populate = {"digest": manifest.get("digest"), "error": str(e)}
+
+            self._thread = threading.Thread(target=_run, name="weight-cache", daemon=True)
+            self._thread.start()
+            return self._thread
+
+    def stats(self):
+        entries = self._entries()
+        with self._lock:
+            return {
+                "root": self.root,
+                "max_bytes": self.max_bytes,
+                "bytes": sum(size for _, size, _ in entries),
+                "entries": len(entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "populated": self._populated,
+                "evicted": self._evicted,
+                "populating": self._thread is not None and self._thread.is_alive(),
+                "last_populate": self._last_populate,
+            }
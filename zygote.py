@@ -0,0 +1,211 @@
+"""
+zygote 模式：父进程加载一次模型，fork 出的子进程直接继承
+
+父进程执行 load_model() 和预热，然后 fork 出多个 worker 子进程。子进程通过写时复制
+(copy-on-write) 共享父进程中已经初始化好的权重页，不需要重新读取和反序列化权重，
+就绪时间只取决于 fork 和子进程自身的初始化。
+
+Supervisor 负责管理子进程：异常退出 (非 0 退出码或被信号杀死) 的子进程按退避时间
+重新 fork，每个槽位的重启次数有上限；父进程退出时子进程也随之退出。
+
+只支持 CPU：CUDA 上下文无法在 fork 出的子进程中使用。
+"""
+
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import threading
+import time
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# 当前进程是 zygote 子进程时的信息 (在子进程中设置)
+current_worker = None
+
+
+def worker_info():
+    """子进程中返回 {"index", "generation", "pid", "time_to_ready_s", "parent_load_s"}，其它进程返回 None"""
+    return dict(current_worker) if current_worker is not None else None
+
+
+def _watch_parent(parent_pid, interval=1.0):
+    """父进程退出后子进程会被 init 收养，此时直接退出"""
+    while True:
+        if os.getppid() != parent_pid:
+            os._exit(0)
+        time.sleep(interval)
+
+
+def _child_main(target, index, generation, forked_at, parent_pid, parent_load_s, threads, ready_check, ready_queue):
+    global current_worker
+
+    # fork 后随机数状态与父进程和其它子进程完全相同，必须重新播种，否则随机 seed 会重复
+    random.seed()
+    torch.seed()
+    if threads > 0:
+        torch.set_num_threads(threads)
+    threading.Thread(target=_watch_parent, args=(parent_pid,), name="zygote-parent-watch", daemon=True).start()
+
+    if ready_check is not None:
+        ready_check()
+    time_to_ready = time.time() - forked_at
+    current_worker = {
+        "index": index,
+        "generation": generation,
+        "pid": os.getpid(),
+        "time_to_ready_s": round(time_to_ready, 4),
+        "parent_load_s": parent_load_s,
+    }
+    ready_queue.put((index, generation, os.getpid(), time_to_ready))
+    logger.info(f"🧬 worker {index} (第 {generation} 代) 就绪: {time_to_ready:.3f}s")
+
+    target()
+
+
+class Supervisor:
+    """fork 并管理 zygote 子进程
+
+    target 是子进程的主函数 (例如启动 RunPod worker)，在子进程中调用；
+    ready_check 在 target 之前调用 (例如一次很小的推理)，完成即视为就绪。
+    调用方需要先在父进程中加载好模型，parent_load_s 是加载耗时，用于对比。
+    """
+
+    def __init__(self, target, workers=2, ready_check=None, parent_load_s=None,
+                 max_restarts=5, restart_backoff=1.0, threads_per_worker=0):
+        if torch.cuda.is_initialized():
+            raise RuntimeError("zygote mode cannot fork after CUDA has been initialized")
+        self.target = target
+        self.workers = int(workers)
+        self.ready_check = ready_check
+        self.parent_load_s = parent_load_s
+        self.max_restarts = int(max_restarts)
+        self.restart_backoff = float(restart_backoff)
+        self.threads_per_worker = int(threads_per_worker)
+
+        self._ctx = multiprocessing.get_context("fork")
+        self._ready_queue = self._ctx.Queue()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._slots = [
+            {"process": None, "generation": 0, "restarts": 0, "forked_at": None, "time_to_ready_s": None,
+             "status": "pending", "exitcode": None, "restart_at": None}
+            for _ in range(self.workers)
+        ]
+
+    def _fork(self, index):
+        slot = self._slots[index]
+        slot["generation"] += 1
+        slot["forked_at"] = time.time()
+        slot["time_to_ready_s"] = None
+        slot["status"] = "starting"
+        slot["restart_at"] = None
+        process = self._ctx.Process(
+            target=_child_main,
+            args=(
+                self.target, index, slot["generation"], slot["forked_at"], os.getpid(), self.parent_load_s,
+                self.threads_per_worker, self.ready_check, self._ready_queue,
+            ),
+            name=f"zygote-worker-{index}",
+            daemon=False,
+        )
+        process.start()
+        slot["process"] = process
+
+    def start(self):
+        with self._lock:
+            for index in range(self.workers):
+                self._fork(index)
+        logger.info(f"🧬 已 fork {self.workers} 个 worker")
+
+    def _drain_ready(self):
+        while True:
+            try:
+                index, generation, pid, time_to_ready = self._ready_queue.get_nowait()
+            except queue.Empty:
+                return
+            slot = self._slots[index]
+            if slot["generation"] == generation:
+                slot["time_to_ready_s"] = round(time_to_ready, 4)
+                slot["status"] = "ready"
+
+    def supervise_once(self):
+        """检查一次子进程状态：收集就绪消息，重启异常退出的子进程"""
+        now = time.time()
+        with self._lock:
+            self._drain_ready()
+            for index, slot in enumerate(self._slots):
+                process = slot["process"]
+                if slot["status"] == "backoff":
+                    if not self._stopping.is_set() and now >= slot["restart_at"]:
+                        self._fork(index)
+                    continue
+                if process is None or process.is_alive() or slot["status"] in ("exited", "failed"):
+                    continue
+
+                slot["exitcode"] = process.exitcode
+                if process.exitcode == 0 or self._stopping.is_set():
+                    slot["status"] = "exited"
+                elif slot["restarts"] >= self.max_restarts:
+                    slot["status"] = "failed"
+                    logger.error(f"❌ worker {index} 重启次数达到上限 ({self.max_restarts})")
+                else:
+                    slot["restarts"] += 1
+                    slot["status"] = "backoff"
+                    slot["restart_at"] = now + self.restart_backoff * slot["restarts"]
+                    logger.warning(f"⚠️ worker {index} 异常退出 (exitcode {process.exitcode})，准备重启")
+
+    def wait_ready(self, timeout=60):
+        """等待所有子进程就绪，超时返回 False"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            self.supervise_once()
+            if all(slot["status"] == "ready" for slot in self._slots):
+                return True
+            time.sleep(0.05)
+        return False
+
+    def run(self, poll_interval=1.0):
+        """启动子进程并持续监控，直到 stop() 或所有子进程都已结束"""
+        self.start()
+        while not self._stopping.is_set():
+            self.supervise_once()
+            if all(slot["status"] in ("exited", "failed") for slot in self._slots):
+                break
+            self._stopping.wait(poll_interval)
+
+    def stop(self, timeout=10):
+        self._stopping.set()
+        processes = [slot["process"] for slot in self._slots if slot["process"] is not None]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join(timeout)
+        self.supervise_once()
+
+    def stats(self):
+        with self._lock:
+            self._drain_ready()
+            ready_times = [s["time_to_ready_s"] for s in self._slots if s["time_to_ready_s"] is not None]
+            return {
+                "workers": self.workers,
+                "parent_load_s": self.parent_load_s,
+                "avg_time_to_ready_s": round(sum(ready_times) / len(ready_times), 4) if ready_times else None,
+                "restarts": sum(s["restarts"] for s in self._slots),
+                "children": [
+                    {
+                        "index": index,
+                        "pid": s["process"].pid if s["process"] is not None else None,
+                        "generation": s["generation"],
+                        "status": s["status"],
+                        "restarts": s["restarts"],
+                        "time_to_ready_s": s["time_to_ready_s"],
+                        "exitcode": s["exitcode"],
+                    }
+                    for index, s in enumerate(self._slots)
+                ],
+            }